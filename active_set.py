@@ -0,0 +1,97 @@
+import numpy as np
+import heapq
+from population import SUSCEPTIBLE, SOCIAL_DISTANCE, INFECTIOUS
+
+'''
+Notes:
+- Schedules the people of one update phase of `CellularAutomation.step` (the non SD people, then the SD people) and
+  only visits the ones that can change ("active"), everyone else would do nothing in their update so they are skipped:
+    - Infected people with a stage starting this step (see `event_calendar.py`)
+    - People that move: the movement draw of everyone in the phase is made at once at the start (`move_draws`), plus
+      SD people whose cell isn't safe (they have to move)
+    - Susceptible people next to an infectious person (they get an infection check)
+- Things change during the phase, so people also become active when someone moves next to them (SD people, and
+  susceptible people if the mover is infectious) or a neighbor becomes infectious
+- Same order as shuffling everyone: every person gets a random key (only drawn once they are active) and people are
+  updated by increasing key, someone that becomes active with a key below the current one was already passed while
+  inactive so is skipped
+- Late in an epidemic (most people recovered or not moving) a step costs about the size of the active set
+'''
+
+# Relative positions of the 8 neighbors
+NEIGHBOR_DX = np.array([-1, 0, 1, -1, 1, -1, 0, 1])
+NEIGHBOR_DY = np.array([-1, -1, -1, 0, 0, 1, 1, 1])
+
+
+class ActiveSet:
+    # ids: set of the ids of the phase, social_distance: if it is the SD phase
+    # skip_inactive: False to visit everyone (same as shuffling all of them)
+    def __init__(self, CA, ids, social_distance, skip_inactive=True):
+        self.CA = CA
+        self.population = pop = CA.population
+        self.members = ids
+        self.social_distance = social_distance
+        self.current_key = 0.
+        ids = np.array(sorted(ids), dtype=np.int64)
+        # Movement draws of everyone in the phase
+        draws = CA.rng.random(len(ids))
+        CA.move_draws[ids] = draws
+        if skip_inactive:
+            active = CA.due[ids] | (draws < pop.movement_prob(ids))
+            # SD people with someone in their neighborhood (not safe)
+            SD = pop.has(SOCIAL_DISTANCE, ids)
+            active[SD] |= (self._neighbor_ids(ids[SD]) >= 0).any(axis=1)
+            # Susceptible people next to an infectious person
+            alive = pop.alive_ids()
+            near_infectious = self._neighbor_ids(alive[pop.infection_stage[alive] == INFECTIOUS]).ravel()
+            exposed = np.zeros(pop.capacity, dtype=bool)
+            exposed[near_infectious[near_infectious >= 0]] = True
+            active |= exposed[ids] & pop.has(SUSCEPTIBLE, ids)
+            ids = ids[active]
+        # People that were made active (or passed), they never get another key
+        self.seen = np.zeros(pop.capacity, dtype=bool)
+        self.seen[ids] = True
+        self.heap = list(zip(CA.rng.random(len(ids)).tolist(), ids.tolist()))
+        heapq.heapify(self.heap)
+
+    # Ids (n, 8) of the neighbors of people, -1 if empty
+    def _neighbor_ids(self, ids):
+        pop, grid = self.population, self.CA.grid
+        height, width = grid.shape
+        return grid[(pop.y[ids, None] + NEIGHBOR_DY) % height, (pop.x[ids, None] + NEIGHBOR_DX) % width]
+
+    def __iter__(self):
+        while self.heap:
+            self.current_key, id = heapq.heappop(self.heap)
+            yield id
+
+    def activate(self, id):
+        if self.seen[id] or id not in self.members:
+            return
+        self.seen[id] = True
+        key = self.population.uniforms.random()
+        if key > self.current_key:
+            heapq.heappush(self.heap, (key, id))
+
+    # Activate the people around a position that pass a flag mask
+    def _activate_around(self, position, flag):
+        neighborhood_ids = self.CA._get_neighborhood_ids(position, 3).ravel()
+        neighborhood_ids = neighborhood_ids[neighborhood_ids >= 0]
+        for id in neighborhood_ids[(self.population.flags[neighborhood_ids] & flag) != 0].tolist():
+            self.activate(id)
+
+    # Someone moved to a position: SD people around it aren't safe anymore (only matters in the SD phase, in the non SD
+    # phase they became SD this step so were already updated) and susceptible people around it have an infectious
+    # neighbor if the mover is infectious
+    def moved(self, id, position):
+        pop = self.population
+        # SD people only move to cells with no one around
+        if pop.flags[id] & SOCIAL_DISTANCE:
+            return
+        flag = SOCIAL_DISTANCE if self.social_distance else 0
+        if pop.infection_stage[id] == INFECTIOUS: flag |= SUSCEPTIBLE
+        if flag: self._activate_around(position, flag)
+
+    # Someone infectious: susceptible people around them get an infection check
+    def infectious(self, position):
+        self._activate_around(position, SUSCEPTIBLE)
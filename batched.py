@@ -0,0 +1,255 @@
+import numpy as np
+import json
+import argparse
+from main import policies_safety
+from vectorized import VectorizedCellularAutomation, NEIGHBOR_DX, NEIGHBOR_DY
+from population import Population, DEFAULT_COURSE_TEMPLATES, SUSCEPTIBLE, RECOVERED, DAYS_SD, DAYS_NOT_SD, DAYS_WM, DAYS_NOT_WM
+from data_collector import DataCollector
+from ensemble import apply_params, expand_grid, aggregate, _parse_grid_arg
+from rng import resolve_seed, make_rng
+from contacts import configured_structure
+
+'''
+Notes:
+- Runs K independent simulations (scenarios, eg. each policy type or mask effect) together in one process: they are
+  stacked along a leading axis (grid of shape (K, height, width), the people of every scenario in one
+  `BatchedPopulation` that knows each person's scenario) and each phase of a timestep is one batch of array operations
+  over all of them, so the python overhead of a step (which is most of the time on small grids) is paid once, not K times
+- Same rules as the vectorized engine, scenarios never see each other (neighbors wrap around inside their own grid)
+- Per scenario constants: everything in 'person' and 'disease' plus `initial_pop_size`, except the ones in
+  `shared_constants` which have to be the same for every scenario
+- One generator for the whole batch (the seed of the first scenario), so a scenario in a batch doesn't give the same
+  run as on its own (same distribution though)
+- Each scenario has its own `DataCollector`, which collects from the scenario's part of the population (slices of the
+  arrays, no copies); infections, deaths and recoveries are split by scenario by the engine
+- Can't be rendered or checkpointed
+- `python batched.py --grid person.policy_type=low,medium,high,"very high" --replicates 5` runs every combination and
+  replicate as one batch and writes the same aggregated output as `ensemble.py`
+'''
+
+# Constants every scenario of a batch has to share
+shared_constants = {'grid': ['width', 'height', 'number_iterations'], 'person': ['move_length'],
+                    'disease': ['total_length_infection']}
+
+
+class BatchedPopulation(Population):
+    array_names = Population.array_names + ['scenario']
+
+    def __init__(self, capacity, scenario_constants, rng):
+        super(BatchedPopulation, self).__init__(capacity, scenario_constants[0]['person'], scenario_constants[0]['disease'],
+                                                rng)
+        self.scenario = np.zeros(capacity, dtype=np.int32)
+        # One row of movement probs per scenario
+        self.movement_probs = np.array([[C['person']['movement_prob'], C['person']['altruistic_movement_prob'], 0.]
+                                        for C in scenario_constants], dtype=np.float32)
+        # Course templates of every scenario one after the other (the first ones were sampled by `Population`)
+        templates = [self.course_templates] + [
+            self._sample_courses(C['disease'].get('course_templates', DEFAULT_COURSE_TEMPLATES), C['disease'])
+            for C in scenario_constants[1:]]
+        self.course_templates = np.concatenate(templates)
+        self.template_counts = np.array([len(t) for t in templates])
+        self.template_starts = np.cumsum(self.template_counts) - self.template_counts
+
+    # Add people of one scenario
+    def add(self, scenario, x, y, age, social_distance, wear_mask, altruistic, infected):
+        self.scenario[self.size:self.size + len(x)] = scenario
+        return super(BatchedPopulation, self).add(x, y, age, social_distance, wear_mask, altruistic, infected)
+
+    # Random course templates of each person's scenario
+    def assign_courses(self, ids, templates=None):
+        if templates is None:
+            scenario = self.scenario[ids]
+            templates = self.template_starts[scenario] + self.rng.integers(self.template_counts[scenario])
+        super(BatchedPopulation, self).assign_courses(ids, templates)
+
+    def movement_prob(self, ids):
+        return self.movement_probs[self.scenario[ids], self.movement[ids]]
+
+    # `Population` of the people of one scenario (ids start to end - 1) that shares the arrays
+    def scenario_view(self, scenario, start, end, constants):
+        view = Population.__new__(Population)
+        view.__dict__.update(self.__dict__)
+        for k in Population.array_names:
+            if k != 'course_templates':
+                setattr(view, k, getattr(self, k)[start:end])
+        view.size = view.capacity = end - start
+        view.person_C, view.disease_C = constants['person'], constants['disease']
+        view.movement_probs = self.movement_probs[scenario]
+        return view
+
+
+# Stands in for the data collector of the vectorized engine: each scenario's data collector gets its part of the
+# population, the counts the vectorized engine gives for everyone at once (infections, deaths, R0) are given per
+# scenario by `BatchedCellularAutomation` instead
+class ScenarioCollectors:
+    def __init__(self, data_collects, views):
+        self.data_collects = data_collects
+        self.views = views
+        self.profiler = None
+
+    def update_population(self, population):
+        for data_collect, view in zip(self.data_collects, self.views):
+            data_collect.update_population(view)
+
+    def reset(self, timestep, last=False):
+        for data_collect in self.data_collects:
+            data_collect.reset(timestep, last)
+
+    def increment_total_infected(self, amount=1):
+        pass
+
+    def increment_death_data(self, amount=1):
+        pass
+
+    def add_lifetime_infected_batch(self, num_infected, SD_days, not_SD_days, WM_days, not_WM_days):
+        pass
+
+
+class BatchedCellularAutomation(VectorizedCellularAutomation):
+    structure_support = []
+
+    # scenario_constants: constants of each scenario, data_collects: a `DataCollector` for each scenario
+    def __init__(self, scenario_constants, data_collects):
+        assert len(scenario_constants) == len(data_collects) > 0, 'Need one data collector per scenario'
+        for C in scenario_constants[1:]:
+            for section, names in list(shared_constants.items()):
+                for name in names:
+                    assert C[section][name] == scenario_constants[0][section][name], \
+                        'Every scenario of a batch needs the same {}.{}'.format(section, name)
+        self.scenario_constants = scenario_constants
+        self.num_scenarios = len(scenario_constants)
+        self.grid_C = scenario_constants[0]['grid']
+        self.render_C = scenario_constants[0]['render']
+        self.person_C = scenario_constants[0]['person']
+        self.disease_C = scenario_constants[0]['disease']
+        self.data_collects = data_collects
+        # Every random draw of the batch comes from one generator (see `rng.py`)
+        self.seed = resolve_seed(self.grid_C.get('seed'))
+        self.rng = make_rng(self.seed)
+        for data_collect in data_collects:
+            data_collect.set_seed(self.seed)
+        self.width = self.grid_C['width']
+        self.height = self.grid_C['height']
+        # One grid per scenario, flat cell indices go through all of them
+        self.grid = np.full((self.num_scenarios, self.height, self.width), -1, dtype=np.int32)
+        self.grid_flat = self.grid.reshape(-1)
+        self.infectious_grid = np.zeros(self.grid.shape, dtype=np.int8)
+        self.infectious_grid_flat = self.infectious_grid.reshape(-1)
+        # Infection constants of each scenario
+        self.base_infection_probs = np.array([C['disease']['base_infection_prob'] for C in scenario_constants])
+        self.mask_infection_prob_decreases = np.array([C['disease']['mask_infection_prob_decrease']
+                                                       for C in scenario_constants])
+        self.timestep = 0
+        self.profiler = None
+        for C in scenario_constants:
+            assert not configured_structure(C['grid']), 'Batched scenarios run on the plain grid (see `contacts.py`)'
+        self._initialize_people()
+
+    # Grid initialization ------
+    def _initialize_people(self):
+        sizes = [C['grid']['initial_pop_size'] for C in self.scenario_constants]
+        self.population = BatchedPopulation(sum(sizes), self.scenario_constants, self.rng)
+        views = []
+        for scenario, (C, n) in enumerate(zip(self.scenario_constants, sizes)):
+            assert n <= self.width * self.height, 'More people ({}) than cells'.format(n)
+            policy = policies_safety[C['person']['policy_type']]
+            # Random (unique) positions
+            cells = self.rng.choice(self.width * self.height, size=n, replace=False)
+            age = self.rng.integers(C['person']['age_range'][0], C['person']['age_range'][1] + 1, size=n)
+            SD = self.rng.random(n) < policy['social_distance_prob']
+            WM = self.rng.random(n) < policy['wear_mask_prob']
+            altruistic = self.rng.random(n) < C['person']['altruistic_prob']
+            infected = self.rng.random(n) < C['person']['initial_infection_prob']
+            start = self.population.size
+            ids = self.population.add(scenario, cells % self.width, cells // self.width, age, SD, WM, altruistic, infected)
+            self.grid_flat[scenario * self.width * self.height + cells] = ids
+            views.append(self.population.scenario_view(scenario, start, self.population.size, C))
+            self.data_collects[scenario].increment_initial_S(int((~infected).sum()))
+        self.data_collect = ScenarioCollectors(self.data_collects, views)
+        # Initial data
+        self.data_collect.update_population(self.population)
+
+    # Neighbors ------
+    def _neighbor_cells(self, ids):
+        pop = self.population
+        xs = (pop.x[ids, None] + NEIGHBOR_DX) % self.width
+        ys = (pop.y[ids, None] + NEIGHBOR_DY) % self.height + pop.scenario[ids, None] * self.height
+        return ys * self.width + xs
+
+    def _cells(self, ids):
+        pop = self.population
+        return (pop.scenario[ids] * self.height + pop.y[ids]) * self.width + pop.x[ids]
+
+    # Amount of each scenario in some people
+    def _per_scenario(self, ids):
+        return np.bincount(self.population.scenario[ids], minlength=self.num_scenarios).tolist()
+
+    # Infection ------
+    def _infection_prob(self, ids, r, masks):
+        scenario = self.population.scenario[ids]
+        p = self.base_infection_probs[scenario] - (masks * self.mask_infection_prob_decreases[scenario]) / r
+        return 1 - (1 - p) ** r
+
+    def _check_infection(self, ids):
+        pop = self.population
+        susceptible = ids[pop.has(SUSCEPTIBLE, ids)]
+        super(BatchedCellularAutomation, self)._check_infection(ids)
+        infected = susceptible[~pop.has(SUSCEPTIBLE, susceptible)]
+        for data_collect, amount in zip(self.data_collects, self._per_scenario(infected)):
+            data_collect.increment_total_infected(amount)
+
+    def _kill_people(self, ids):
+        super(BatchedCellularAutomation, self)._kill_people(ids)
+        for data_collect, amount in zip(self.data_collects, self._per_scenario(ids)):
+            data_collect.increment_death_data(amount)
+
+    def _progress_infection(self, ids):
+        pop = self.population
+        recovered_before = pop.has(RECOVERED)
+        super(BatchedCellularAutomation, self)._progress_infection(ids)
+        # R0 of the people that just recovered, by scenario
+        recovered = np.flatnonzero(pop.has(RECOVERED) & ~recovered_before)
+        scenario = pop.scenario[recovered]
+        for s, data_collect in enumerate(self.data_collects):
+            ids = recovered[scenario == s]
+            days = pop.infectious_days[ids]
+            data_collect.add_lifetime_infected_batch(pop.num_people_infected[ids], days[:, DAYS_SD], days[:, DAYS_NOT_SD],
+                                                     days[:, DAYS_WM], days[:, DAYS_NOT_WM])
+
+    def run(self, render=False, profiler=None, frames=None):
+        assert not render and frames is None, 'A batch of scenarios cannot be rendered'
+        super(BatchedCellularAutomation, self).run(profiler=profiler)
+
+
+# Run scenarios as one batch, returns their (finished) data collectors
+def run_scenarios(scenario_constants, data_collects=None):
+    if data_collects is None:
+        data_collects = []
+        for C in scenario_constants:
+            data_collect = DataCollector(C, save_experiment=False, print_visualizations=False)
+            data_collect.set_print_options(basic_to_print=[], adv_to_print=[])
+            data_collects.append(data_collect)
+    BatchedCellularAutomation(scenario_constants, data_collects).run()
+    return data_collects
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run replicates of a parameter grid as one batch')
+    parser.add_argument('--constants', default='constants.json')
+    parser.add_argument('--grid', action='append', default=[], help="'section.name=v1,v2,...' (can repeat)")
+    parser.add_argument('--replicates', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default='batched.json')
+    args = parser.parse_args()
+    constants = json.load(open(args.constants))
+    configs = expand_grid(dict(_parse_grid_arg(arg) for arg in args.grid))
+    scenarios = [(c, r) for c in range(len(configs)) for r in range(args.replicates)]
+    scenario_constants = [apply_params(constants, dict(configs[c], **{'grid.seed': args.seed})) for c, _ in scenarios]
+    data_collects = run_scenarios(scenario_constants)
+    results = [{'config': c, 'replicate': r, 'seed': args.seed, 'summary': data_collect.summary()}
+               for (c, r), data_collect in zip(scenarios, data_collects)]
+    aggregated = aggregate(results, configs)
+    for info in aggregated:
+        # No std with a single replicate
+        print('{} --- SAR: {:.3f} +- {:.3f}'.format(info['params'], info['SAR']['mean'], info['SAR']['std'] or 0.))
+    json.dump(aggregated, open(args.out, 'w'), indent=4, allow_nan=False)
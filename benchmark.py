@@ -0,0 +1,260 @@
+import numpy as np
+import json
+import copy
+import time
+import sys
+import platform
+import argparse
+import resource
+from multiprocessing import Pool
+from data_collector import DataCollector
+from person import Person
+from population import SOCIAL_DISTANCE
+from main import CellularAutomation, create_automation
+
+'''
+Notes:
+- Benchmark suite of the simulation hot paths, writes a JSON report so regressions and scaling cliffs are visible
+    - Times the initialization, full steps and each phase inside a step (eg. `_check_neighbors_SD`,
+      `Person.progress_infection`, `DataCollector.update_population` and `reset`) by wrapping them while the
+      simulation runs, with the number of calls and time per call
+    - Throughput is in agent updates per second (alive people updated per step / seconds per step)
+    - Peak RSS of every configuration (each one runs in a fresh process so they don't add up)
+- Sweeps one parameter at a time around a base configuration: grid size, `initial_pop_size`, `policy_type` (the
+  share of SD people) and `move_length`, plus the density sweep (population on a fixed grid with the 'very high'
+  policy) which gives the scaling curve of the SD path: candidate cells checked for safety per SD person update
+  (`safe_cell_checks_per_SD_update`, the `safe_cell_checks` counter of the engines, see `profiler.py`)
+- Open cells section (`open_cells`, object engine): the grid initialization and single moves (clearing a cell and
+  taking an open one) on a big sparse grid, for a few populations (`benchmark_initialization` and `benchmark_movement`)
+- Run `python benchmark.py --engine object --steps 5 --out benchmark.json` (uses `constants.json` for everything else)
+'''
+
+# Phases timed inside a step (method names of each engine)
+engine_phases = {'object': ['step', '_update_person', '_check_neighbors_SD', '_check_neighbors_not_SD', '_check_infection',
+                            '_move_person', '_get_neighborhood_ids', '_yield_neighbors'],
+                 'vectorized': ['step', '_progress_infection', '_check_infection', '_movement', '_resolve_conflicts',
+                                '_refresh_infectious_grid', '_update_phase'],
+                 'jit': ['step', '_progress_infection', '_refresh_infectious_grid', '_update_phase']}
+data_collector_phases = ['update_population', 'reset']
+# Default sweeps (the base configuration is the first value of each)
+default_sweeps = {'grid_size': [100, 200, 400],
+                  'initial_pop_size': [1000, 2000, 4000, 8000],
+                  'policy_type': ['low', 'medium', 'high', 'very high'],
+                  'move_length': [1, 3, 6, 12],
+                  'density': [0.05, 0.1, 0.2, 0.3, 0.4]}
+DENSITY_POLICY = 'very high'
+# Open cells section: populations on a grid_size x grid_size grid, timing `moves` single moves of each
+default_open_cells = {'grid_size': 1000, 'initial_pop_size': [1000, 10000, 100000], 'moves': 10000}
+
+
+def make_constants(constants, width, height, initial_pop_size):
+    constants = copy.deepcopy(constants)
+    constants['grid'].update({'width': width, 'height': height, 'initial_pop_size': initial_pop_size})
+    return constants
+
+
+def make_data_collector(constants):
+    data_collect = DataCollector(constants, save_experiment=False, print_visualizations=False)
+    data_collect.set_print_options(basic_to_print=[], adv_to_print=[])
+    return data_collect
+
+
+# Returns the seconds it took and the created simulation
+def benchmark_initialization(constants):
+    start = time.perf_counter()
+    CA = CellularAutomation(constants, make_data_collector(constants))
+    return time.perf_counter() - start, CA
+
+
+# Move random people to random open positions, returns the seconds per move
+def benchmark_movement(CA, num_moves):
+    ids = CA.rng.choice(CA.population.alive_ids(), size=num_moves)
+    start = time.perf_counter()
+    for id in ids:
+        person = CA._get_person(id)
+        CA._move_person(id, person, CA.open_positions.random_position())
+    return (time.perf_counter() - start) / num_moves
+
+
+# Initialization and single moves of one population of the open cells section
+def benchmark_open_cells(job):
+    constants, num_moves = job
+    init_seconds, CA = benchmark_initialization(constants)
+    return {'init_seconds': init_seconds, 'us_per_move': benchmark_movement(CA, num_moves) * 1e6,
+            'peak_rss_mb': peak_rss_mb()}
+
+
+# Accumulated seconds and calls of each wrapped phase
+class PhaseTimer:
+    def __init__(self):
+        self.seconds = {}
+        self.calls = {}
+        # Counters of the engines (same as a `Profiler`'s, the timer is set as the simulation's profiler)
+        self.counters = {}
+
+    def count(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def _add(self, name, seconds):
+        self.seconds[name] = self.seconds.get(name, 0.) + seconds
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def wrap(self, function, name, generator=False):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            result = function(*args, **kwargs)
+            # Generators do their work when consumed, so consume them here
+            if generator: result = iter(list(result))
+            self._add(name, time.perf_counter() - start)
+            return result
+        return timed
+
+    # Wrap methods of an object (the instance attribute shadows the method)
+    def instrument(self, obj, names, prefix=''):
+        for name in names:
+            setattr(obj, name, self.wrap(getattr(obj, name), prefix + name, generator=name == '_yield_neighbors'))
+
+    def report(self):
+        return {name: {'calls': self.calls[name], 'seconds': self.seconds[name],
+                       'us_per_call': self.seconds[name] / self.calls[name] * 1e6} for name in sorted(self.seconds)}
+
+
+def peak_rss_mb():
+    # Kilobytes on Linux (bytes on macOS)
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / (1024. ** 2 if sys.platform == 'darwin' else 1024.)
+
+
+# Constants of one configuration of a sweep
+def sweep_constants(constants, base, sweep, value):
+    params = dict(base)
+    if sweep == 'density':
+        params['policy_type'] = DENSITY_POLICY
+        params['initial_pop_size'] = int(value * params['grid_size'] ** 2)
+    else:
+        params[sweep] = value
+    constants = make_constants(constants, params['grid_size'], params['grid_size'], params['initial_pop_size'])
+    constants['person']['policy_type'] = params['policy_type']
+    constants['person']['move_length'] = params['move_length']
+    return params, constants
+
+
+# Initialize and run some steps of one configuration with every phase timed
+def benchmark_config(job):
+    constants, steps = job
+    data_collect = make_data_collector(constants)
+    start = time.perf_counter()
+    CA = create_automation(constants, data_collect)
+    init_seconds = time.perf_counter() - start
+    timer = PhaseTimer()
+    timer.instrument(CA, engine_phases[constants['grid']['engine']])
+    timer.instrument(data_collect, data_collector_phases, prefix='DataCollector.')
+    CA.profiler = timer
+    original_progress_infection = Person.progress_infection
+    Person.progress_infection = timer.wrap(original_progress_infection, 'Person.progress_infection')
+    agent_updates = 0
+    num_SD_updates = 0
+    try:
+        for t in range(steps):
+            alive = CA.population.alive_ids()
+            agent_updates += len(alive)
+            num_SD_updates += int(CA.population.has(SOCIAL_DISTANCE, alive).sum())
+            CA.advance(1)
+    finally:
+        Person.progress_infection = original_progress_infection
+    phases = timer.report()
+    step_seconds = phases['step']['seconds']
+    result = {'init_seconds': init_seconds, 'steps': steps, 'step_seconds': step_seconds / steps,
+              'agent_updates_per_second': agent_updates / step_seconds if step_seconds > 0 else None,
+              'phases': phases, 'counters': timer.counters, 'peak_rss_mb': peak_rss_mb()}
+    if num_SD_updates > 0:
+        result['safe_cell_checks_per_SD_update'] = timer.counters.get('safe_cell_checks', 0) / num_SD_updates
+    return result
+
+
+# Base configuration: the first value of each parameter sweep
+def get_base(sweeps):
+    return {k: sweeps[k][0] for k in ['grid_size', 'initial_pop_size', 'policy_type', 'move_length']}
+
+
+# sweeps: {sweep: values} to run, base: the configuration the sweeps change one parameter of
+# open_cells: the open cells section to run (see `default_open_cells`), None to skip it
+def run_suite(constants, engine, steps, sweeps, base, seed=0, open_cells=None):
+    constants = copy.deepcopy(constants)
+    constants['grid']['engine'] = engine
+    constants['grid']['seed'] = seed
+    configs = [(sweep, value) + sweep_constants(constants, base, sweep, value)
+               for sweep in sweeps for value in sweeps[sweep]]
+    open_cells_configs = []
+    if open_cells is not None:
+        size = open_cells['grid_size']
+        open_cells_configs = [make_constants(constants, size, size, n) for n in open_cells['initial_pop_size']]
+    # A fresh process per configuration so the peak RSS is of that configuration only
+    with Pool(processes=1, maxtasksperchild=1) as pool:
+        timings = pool.map(benchmark_config, [(C, steps) for _, _, _, C in configs], chunksize=1)
+        open_cells_timings = pool.map(benchmark_open_cells, [(C, open_cells['moves']) for C in open_cells_configs],
+                                      chunksize=1)
+    results = []
+    for (sweep, value, params, _), timing in zip(configs, timings):
+        result = {'sweep': sweep, 'value': value, 'params': params}
+        result.update(timing)
+        results.append(result)
+    open_cells_results = []
+    for C, timing in zip(open_cells_configs, open_cells_timings):
+        result = {'grid_size': open_cells['grid_size'], 'initial_pop_size': C['grid']['initial_pop_size'],
+                  'moves': open_cells['moves']}
+        result.update(timing)
+        open_cells_results.append(result)
+    meta = {'engine': engine, 'steps': steps, 'seed': seed, 'base': base, 'python': platform.python_version(),
+            'numpy': np.__version__, 'platform': platform.platform(), 'time': time.strftime('%Y-%m-%d %H:%M:%S')}
+    return {'meta': meta, 'results': results, 'open_cells': open_cells_results}
+
+
+# 'v1,v2,...' -> [v1, v2, ...] (values are json if possible, o.w. strings)
+def _parse_values(arg):
+    def parse(value):
+        try:
+            return json.loads(value)
+        except ValueError:
+            return value
+    return [parse(v) for v in arg.split(',')]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the simulation hot paths and write a JSON report')
+    parser.add_argument('--constants', default='constants.json')
+    parser.add_argument('--engine', default='object', choices=sorted(engine_phases))
+    parser.add_argument('--steps', type=int, default=5, help='Timed steps of each configuration')
+    parser.add_argument('--seed', type=int, default=0)
+    for sweep in default_sweeps:
+        parser.add_argument('--' + sweep.replace('_', '-'), default=None,
+                            help='Comma separated values (default: {}, the first one is the base)'.format(
+                                ','.join(str(v) for v in default_sweeps[sweep])))
+    parser.add_argument('--open-cells', default=None,
+                        help='Comma separated populations of the open cells section (default: {})'.format(
+                            ','.join(str(v) for v in default_open_cells['initial_pop_size'])))
+    parser.add_argument('--only', default=None,
+                        help='Comma separated sweeps (and/or open_cells) to run (default: all)')
+    parser.add_argument('--out', default='benchmark.json')
+    args = parser.parse_args()
+    constants = json.load(open(args.constants))
+    sweeps = {}
+    for sweep in default_sweeps:
+        arg = getattr(args, sweep)
+        sweeps[sweep] = _parse_values(arg) if arg else default_sweeps[sweep]
+    base = get_base(sweeps)
+    open_cells = dict(default_open_cells)
+    if args.open_cells:
+        open_cells['initial_pop_size'] = _parse_values(args.open_cells)
+    if args.only:
+        sweeps = {k: v for k, v in sweeps.items() if k in args.only.split(',')}
+        if 'open_cells' not in args.only.split(','): open_cells = None
+    report = run_suite(constants, args.engine, args.steps, sweeps, base, args.seed, open_cells)
+    for result in report['results']:
+        print('{} = {} --- init: {:.02f} s --- step: {:.03f} s --- {:.0f} agent updates/s --- peak RSS: {:.0f} MB'.format(
+            result['sweep'], result['value'], result['init_seconds'], result['step_seconds'],
+            result['agent_updates_per_second'] or 0, result['peak_rss_mb']))
+    for result in report['open_cells']:
+        print('{0}x{0} grid, {1} people --- initialization: {2:.02f} s --- movement: {3:.02f} us per move'.format(
+            result['grid_size'], result['initial_pop_size'], result['init_seconds'], result['us_per_move']))
+    json.dump(report, open(args.out, 'w'), indent=4)
@@ -0,0 +1,146 @@
+import numpy as np
+import json
+import os
+from data_collector import DataCollector
+from population import Population
+from free_cells import FreeCells
+from rng import make_rng
+from event_calendar import EventCalendar
+
+'''
+Notes:
+- Saves the full state of a simulation between timesteps (grid, population, SD id sets, open positions, event calendar,
+  data collector and the state of the random generator) so a run can be resumed later or many scenarios can be forked
+  from one warm-up
+- A checkpoint is a directory: every array is its own `.npy` file and everything else is in `checkpoint.json`
+    - Arrays are loaded memory-mapped copy-on-write by default, so many forks of the same checkpoint share the pages
+      they don't change and loading is almost free
+- Works with every engine: the engine of the run is saved and the checkpoint is loaded as the same engine, so a
+  resumed run continues exactly
+- eg. warm up once and fork:
+    CA.advance(30); save_checkpoint(CA, 'warm_up')
+    for scenario_constants, seed in ...: load_checkpoint('warm_up', constants=scenario_constants, seed=seed).run()
+'''
+
+CHECKPOINT_FILE = 'checkpoint.json'
+# Arrays of each engine besides the population ones
+engine_arrays = {'object': ['grid'], 'vectorized': ['grid', 'infectious_grid'], 'tiled': ['grid', 'infectious_grid'],
+                 'jit': ['grid', 'infectious_grid']}
+data_collector_arrays = ['basic_data', 'adv_infection_data', 'current_bin_sums', 'current_bin_counts']
+
+
+# Name of the engine of a simulation (the `engine` grid constant)
+def _engine_name(CA):
+    from main import engine_class
+    engine = CA.grid_C.get('engine', 'object')
+    assert isinstance(CA, engine_class(engine)), 'The engine constant ({}) is not the engine of the simulation'.format(engine)
+    return engine
+
+
+def save_checkpoint(CA, path):
+    os.makedirs(path, exist_ok=True)
+    engine = _engine_name(CA)
+    dc = CA.data_collect
+    arrays = {'population.' + k: getattr(CA.population, k) for k in Population.array_names}
+    arrays.update({k: getattr(CA, k) for k in engine_arrays[engine]})
+    arrays.update({'data_collect.' + k: getattr(dc, k) for k in data_collector_arrays})
+    arrays['uniforms'] = CA.population.uniforms.remaining()
+    info = {'engine': engine, 'timestep': CA.timestep,
+            'constants': {'grid': CA.grid_C, 'render': CA.render_C, 'person': CA.person_C, 'disease': CA.disease_C},
+            'population_size': CA.population.size,
+            'data_collect': {'num_timesteps': dc.num_timesteps, 'total_infected': dc.total_infected,
+                             'initial_S': dc.initial_S, 'last_bin_avgs': dc.last_bin_avgs,
+                             'lifetime_infected_bin_avgs': list(dc.lifetime_infected_bin_avgs.items())},
+            'seed': CA.seed, 'rng_state': CA.rng.bit_generator.state}
+    if engine == 'object':
+        arrays['ids_social_distance'] = np.array(sorted(CA.ids_social_distance), dtype=np.int64)
+        arrays['ids_not_social_distance'] = np.array(sorted(CA.ids_not_social_distance), dtype=np.int64)
+        arrays['open_positions.cells'] = CA.open_positions.cells
+        arrays['open_positions.slots'] = CA.open_positions.slots
+        info['open_positions_size'] = CA.open_positions.size
+        arrays['calendar.timesteps'], arrays['calendar.ids'] = CA.calendar.to_arrays()
+    for name, array in list(arrays.items()):
+        np.save(os.path.join(path, name + '.npy'), array)
+    with open(os.path.join(path, CHECKPOINT_FILE), 'w') as f:
+        json.dump(info, f)
+
+
+# Load a checkpoint as a new simulation ready to `run` (or `advance`)
+# constants: to fork a scenario with different constants (the grid size and population size can't change)
+# data_collect: to use a new data collector (eg. to save the experiment), its data is replaced by the checkpoint's
+# seed: to continue with a new random generator (eg. a different one for each fork), o.w. continues the checkpoint's
+def load_checkpoint(path, constants=None, data_collect=None, mmap=True, seed=None):
+    with open(os.path.join(path, CHECKPOINT_FILE)) as f:
+        info = json.load(f)
+
+    def load(name):
+        return np.load(os.path.join(path, name + '.npy'), mmap_mode='c' if mmap else None)
+
+    if constants is None:
+        constants = info['constants']
+    for k in ['width', 'height', 'initial_pop_size']:
+        assert constants['grid'][k] == info['constants']['grid'][k], 'Cannot change {} of a checkpoint'.format(k)
+    if data_collect is None:
+        data_collect = DataCollector(constants, save_experiment=False, print_visualizations=False)
+    # Data collector
+    dc_info = info['data_collect']
+    for k in data_collector_arrays:
+        setattr(data_collect, k, np.array(load('data_collect.' + k)))
+    data_collect.num_timesteps = dc_info['num_timesteps']
+    data_collect.total_infected = dc_info['total_infected']
+    data_collect.initial_S = dc_info['initial_S']
+    data_collect.last_bin_avgs = dc_info['last_bin_avgs']
+    data_collect.lifetime_infected_bin_avgs.clear()
+    data_collect.lifetime_infected_bin_avgs.update((int(t), avgs) for t, avgs in dc_info['lifetime_infected_bin_avgs'])
+    data_collect._ensure_rows()
+    # Engine (without initializing a new grid)
+    from main import engine_class
+    CA = engine_class(info['engine']).__new__(engine_class(info['engine']))
+    CA.grid_C, CA.render_C = constants['grid'], constants['render']
+    CA.person_C, CA.disease_C = constants['person'], constants['disease']
+    CA.grid_C = dict(CA.grid_C, engine=info['engine'])
+    CA.data_collect = data_collect
+    CA.timestep = info['timestep']
+    CA.profiler = None
+    CA.seed = info['seed'] if seed is None else seed
+    CA.rng = make_rng(CA.seed)
+    data_collect.set_seed(CA.seed)
+    # Samples new disease course templates, so the generator state is restored after
+    CA.population = Population(info['population_size'], CA.person_C, CA.disease_C, CA.rng)
+    if seed is None:
+        CA.rng.bit_generator.state = info['rng_state']
+        CA.population.uniforms.set_remaining(load('uniforms'))
+    CA.uniforms = CA.population.uniforms
+    for k in Population.array_names:
+        # New disease constants keep the new course templates (people already infected keep their courses)
+        if k == 'course_templates' and CA.disease_C != info['constants']['disease']:
+            continue
+        setattr(CA.population, k, load('population.' + k))
+    CA.population.size = info['population_size']
+    for k in engine_arrays[info['engine']]:
+        setattr(CA, k, load(k))
+    if info['engine'] != 'object':
+        CA.width, CA.height = CA.grid_C['width'], CA.grid_C['height']
+        CA.grid_flat = CA.grid.reshape(-1)
+        CA.infectious_grid_flat = CA.infectious_grid.reshape(-1)
+        # Masks and contact layers are rebuilt from the constants (the groups from the checkpoint's seed)
+        CA._load_structure(info['seed'])
+        # Tiles move the grid and population into new shared memory
+        if info['engine'] == 'tiled': CA._init_tiles()
+    else:
+        CA.ids_social_distance = set(load('ids_social_distance').tolist())
+        CA.ids_not_social_distance = set(load('ids_not_social_distance').tolist())
+        CA.neighbor_tables = {}
+        CA.active_set = None
+        CA.move_draws = np.ones(info['population_size'])
+        CA.open_positions = FreeCells.__new__(FreeCells)
+        CA.open_positions.width, CA.open_positions.height = CA.grid_C['width'], CA.grid_C['height']
+        CA.open_positions.uniforms = CA.uniforms
+        CA.open_positions.cells = load('open_positions.cells')
+        CA.open_positions.slots = load('open_positions.slots')
+        CA.open_positions.size = info['open_positions_size']
+        CA._rebuild_neighbor_counts()
+        CA.calendar = EventCalendar()
+        CA.calendar.from_arrays(load('calendar.timesteps'), load('calendar.ids'))
+        CA.due = np.zeros(info['population_size'], dtype=bool)
+    return CA
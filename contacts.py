@@ -0,0 +1,163 @@
+import numpy as np
+import os
+
+'''
+Notes:
+- Spatial structure on top of the uniform wrapping grid (vectorized engine):
+    - Obstacles: cells nobody can be placed on or move onto (eg. buildings, water)
+    - Zones: a label per cell, people only move between cells of the same zone (eg. neighborhoods, wards)
+    - Both are loaded from a file with one value per cell: an array (.npy, .txt or .csv) or an image (needs PIL),
+      which is resized to the grid (nearest pixel)
+        - Obstacles: nonzero values, or dark pixels of an image
+        - Zones: the values, or one zone per color of an image
+- Contact layers: groups of people in contact wherever they are on the grid (eg. households, workplaces), each with
+  its own transmission probability, checked once at the start of every timestep (before the phases)
+    - Stored as a CSR adjacency matrix (person x person), so the infectious contacts of everyone are one sparse
+      matrix-vector product per layer instead of a loop over people
+    - scipy.sparse is used if installed, o.w. the same product with numpy (`CSRMatrix`)
+    - A layer is either random groups ({"name": "households", "group_size": 4, "transmission_prob": 0.1}, optionally
+      only a "fraction" of people are in one) or read from a .npz file ({"name": ..., "path": ..., "transmission_prob": ...})
+      with either a CSR matrix ("indptr" and "indices") or an edge list ("rows" and "cols")
+    - Contacts are symmetric, people are never their own contact
+    - Groups are drawn from their own generator made from the seed, so they don't change the draws of the simulation
+- Infection probability through the layers: 1 - prod_l (1 - p_l) ^ k_l, k_l -> infectious contacts in layer l
+'''
+
+try:
+    import scipy.sparse
+    SCIPY_AVAILABLE = True
+except ImportError:
+    SCIPY_AVAILABLE = False
+
+# Stream of the seed the contact layers are drawn from (see `rng.py`)
+CONTACT_LAYERS_STREAM = 1
+image_extensions = ['.png', '.bmp', '.gif', '.jpg', '.jpeg']
+
+
+# Grid constants that need the vectorized engine, the ones that are set
+def configured_structure(grid_C):
+    names = [k for k in ['obstacles', 'zones'] if grid_C.get(k) is not None]
+    if grid_C.get('contact_layers'):
+        names.append('contact_layers')
+    return names
+
+
+# Masks ------
+# (height, width) array of the file, or (height, width, 3) pixels of an image
+def _load_grid_file(path, width, height):
+    extension = os.path.splitext(path)[1].lower()
+    if extension in image_extensions:
+        from PIL import Image
+        image = Image.open(path).convert('RGB').resize((width, height), Image.NEAREST)
+        return np.asarray(image)
+    if extension == '.npy':
+        array = np.load(path)
+    else:
+        array = np.loadtxt(path, delimiter=',' if extension == '.csv' else None, ndmin=2)
+    assert array.shape == (height, width), \
+        '{} has shape {}, the grid is {}x{} (height x width)'.format(path, array.shape, height, width)
+    return array
+
+
+# True on every obstacle cell (flat, like the vectorized grid)
+def load_obstacles(path, width, height):
+    array = _load_grid_file(path, width, height)
+    if array.ndim == 3:
+        # Dark pixels
+        return array.astype(np.int64).sum(axis=2).reshape(-1) < 3 * 128
+    return array.reshape(-1) != 0
+
+
+# Zone label of every cell (flat, like the vectorized grid)
+def load_zones(path, width, height):
+    array = _load_grid_file(path, width, height)
+    if array.ndim == 3:
+        array = np.unique(array.reshape(-1, 3), axis=0, return_inverse=True)[1]
+    return np.unique(array.reshape(-1), return_inverse=True)[1].astype(np.int32)
+
+
+# Contact layers ------
+# CSR matrix with numpy only (what the layers need of a scipy.sparse one)
+class CSRMatrix:
+    def __init__(self, indptr, indices, shape):
+        self.indptr = indptr
+        self.indices = indices
+        self.shape = shape
+        # Row of each nonzero
+        self.rows = np.repeat(np.arange(shape[0]), np.diff(indptr))
+
+    def dot(self, x):
+        return np.bincount(self.rows, weights=x[self.indices], minlength=self.shape[0])
+
+
+def csr_matrix(indptr, indices, n):
+    if SCIPY_AVAILABLE:
+        return scipy.sparse.csr_matrix((np.ones(len(indices)), indices, indptr), shape=(n, n))
+    return CSRMatrix(indptr, indices, (n, n))
+
+
+# Symmetric adjacency of an edge list (without duplicates and self contacts)
+def adjacency(rows, cols, n):
+    rows, cols = np.asarray(rows, dtype=np.int64), np.asarray(cols, dtype=np.int64)
+    assert len(rows) == 0 or (min(rows.min(), cols.min()) >= 0 and max(rows.max(), cols.max()) < n), \
+        'Contacts have to be between people 0 to {}'.format(n - 1)
+    keys = np.unique(np.concatenate([rows * n + cols, cols * n + rows]))
+    rows, cols = keys // n, keys % n
+    keep = rows != cols
+    rows, cols = rows[keep], cols[keep]
+    indptr = np.searchsorted(rows, np.arange(n + 1))
+    return csr_matrix(indptr, cols, n)
+
+
+# Everyone (or a fraction of people) split into random groups of group_size, all in contact within a group
+def group_adjacency(n, group_size, rng, fraction=1.):
+    members = rng.permutation(n)
+    members = members[:int(round(fraction * n))]
+    # Position in the list of members of everyone else in the same group
+    positions = np.arange(len(members))
+    starts = positions // group_size * group_size
+    others = starts[:, None] + np.arange(group_size)
+    valid = (others < len(members)) & (others != positions[:, None])
+    rows = np.repeat(members, valid.sum(axis=1))
+    cols = members[others[valid]]
+    return adjacency(rows, cols, n)
+
+
+def load_adjacency(path, n):
+    data = np.load(path)
+    if 'indptr' in data:
+        indptr, indices = data['indptr'], data['indices']
+        assert len(indptr) == n + 1, '{} is not a matrix of {} people'.format(path, n)
+        rows = np.repeat(np.arange(n), np.diff(indptr))
+        return adjacency(rows, indices, n)
+    return adjacency(data['rows'], data['cols'], n)
+
+
+class ContactLayers:
+    # layers_C: the `contact_layers` grid constant, n: number of people, rng: generator of the random groups
+    def __init__(self, layers_C, n, rng):
+        self.names = []
+        self.matrices = []
+        self.transmission_probs = []
+        for layer_C in layers_C:
+            if 'path' in layer_C:
+                matrix = load_adjacency(layer_C['path'], n)
+            else:
+                matrix = group_adjacency(n, layer_C['group_size'], rng, layer_C.get('fraction', 1.))
+            self.names.append(layer_C['name'])
+            self.matrices.append(matrix)
+            self.transmission_probs.append(layer_C['transmission_prob'])
+
+    # Probability of everyone getting infected through the layers given who is infectious (bool per person)
+    def infection_prob(self, infectious):
+        infectious = infectious.astype(np.float64)
+        not_infected = 1.
+        for matrix, p in zip(self.matrices, self.transmission_probs):
+            not_infected = not_infected * (1 - p) ** matrix.dot(infectious)
+        return 1 - not_infected
+
+    # Number of contacts of everyone with the given people (summed over the layers)
+    def contacts_of(self, ids, n):
+        x = np.zeros(n)
+        x[ids] = 1
+        return sum(matrix.dot(x) for matrix in self.matrices)
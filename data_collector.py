@@ -1,13 +1,17 @@
 from collections import OrderedDict
 import numpy as np
-import matplotlib.pyplot as plt
 import os
 from datetime import datetime
 import json
-import pandas as pd
+from population import SUSCEPTIBLE, INFECTED, RECOVERED, SOCIAL_DISTANCE, WEAR_MASK, NO_STAGE, symptom_stages
 
 
 data_options = ['S', 'I', 'R', 'WM', 'SD', 'death', 'mild', 'severe', 'asymptomatic']
+S, I, R, WM, SD, DEATH_COLUMN = range(6)
+symptom_options = ['mild', 'severe', 'asymptomatic']
+adv_infection_options = ['total', 'SD', 'not SD']
+# R0 bin types (a person is binned by whether they were SD and WM for most of their infectious days)
+lifetime_bin_types = ['total', 'SD', 'not SD', 'WM', 'not WM', 'both', 'neither']
 
 # SAR -> Secondary Attack Rate = total # infected people / total # susceptible (overall metric, ie calculated at end)
 # R0 -> Basic Reproductive Number = The number of people an infected person directly infects
@@ -16,113 +20,159 @@ advanced_equations = ['SAR', 'R0', 'R0S']
 
 
 class DataCollector:
-    def __init__(self, constants, save_experiment, print_visualizations):
+    def __init__(self, constants, save_experiment, print_visualizations, stream=None, trajectory=None):
         self.constants = constants
         self.save_experiment = save_experiment
         self.print_visualizations = print_visualizations
+        # Optional `StreamWriter` (see `stream_writer.py`) that gets every finished timestep while running
+        self.stream = stream
+        # Optional `TrajectoryWriter` (see `trajectory.py`) that gets the state of everyone at every timestep
+        self.trajectory = trajectory
+        # Optional `Profiler` (see `profiler.py`), its columns are saved with the basic data
+        self.profiler = None
+        # Seed of the run (set by the simulation, see `rng.py`)
+        self.seed = None
         self.basic_to_print = None
         self.adv_to_print = None
         self.frequency_print = 1
-        self._reset_data_options(hist=True)
+        # Data is kept in preallocated arrays, one row per timestep (plus the initial one) and one column per option
+        # The row of the current timestep is filled in until `reset` moves on to the next one
+        num_rows = constants['grid']['number_iterations'] + 1
+        self.basic_data = np.zeros((num_rows, len(data_options)), dtype=np.int64)
         # Advanced Infection data collection
-        # WM, SD, both, neither, total
-        self.adv_infection_data = {'total': 0, 'SD': 0, 'not SD': 0}
-        self.adv_infection_data_history = OrderedDict({'total': [], 'SD': [], 'not SD': []})
+        self.adv_infection_data = np.zeros((num_rows, len(adv_infection_options)), dtype=np.int64)
+        self.num_timesteps = 0
         # For adv equations
         # For SAR (Secondary Attack Rate) need total number of infected overtime
         self.total_infected = 0
         # And need number of S not including initial infected
         self.initial_S = 0
-        # For R0 need the current number of each infection lifetime for the current bin
+        # For R0 need the sum and count of infection lifetimes (of each bin type) for the current bin
         self.lifetime_infected_bin_size = 5
-        self.current_bin_lifetime_infected = []
+        self.current_bin_sums = np.zeros(len(lifetime_bin_types))
+        self.current_bin_counts = np.zeros(len(lifetime_bin_types), dtype=np.int64)
         # Saves all the bin averages
         self.lifetime_infected_bin_avgs = OrderedDict()
-        self.last_bin_avgs = {'total': None, 'SD': None, 'not SD': None, 'WM': None, 'not WM': None, 'both': None, 'neither': None}
+        self.last_bin_avgs = {k: None for k in lifetime_bin_types}
 
-    def _reset_data_options(self, hist=False):
-        self.current_data = {}
-        if hist: self.data_history = OrderedDict()
-        for k in data_options:
-            self.current_data[k] = 0
-            if hist: self.data_history[k] = []
+    # History of the finished timesteps as {option: list}
+    @property
+    def data_history(self):
+        return OrderedDict((k, self.basic_data[:self.num_timesteps, i].tolist()) for i, k in enumerate(data_options))
+
+    @property
+    def adv_infection_data_history(self):
+        return OrderedDict((k, self.adv_infection_data[:self.num_timesteps, i].tolist())
+                           for i, k in enumerate(adv_infection_options))
+
+    # The data of the current (not yet finished) timestep
+    @property
+    def current_data(self):
+        return dict(zip(data_options, self.basic_data[self.num_timesteps].tolist()))
+
+    # More rows if running past the number of iterations in the constants
+    def _ensure_rows(self):
+        if self.num_timesteps < len(self.basic_data):
+            return
+        self.basic_data = np.concatenate([self.basic_data, np.zeros_like(self.basic_data)])
+        self.adv_infection_data = np.concatenate([self.adv_infection_data, np.zeros_like(self.adv_infection_data)])
+
+    # Seed the simulation resolved (see `rng.py`), also recorded by the stream and trajectory files
+    def set_seed(self, seed):
+        self.seed = seed
+        if self.stream: self.stream.set_seed(seed)
+        if self.trajectory: self.trajectory.set_seed(seed)
 
     def set_print_options(self, basic_to_print='all', adv_to_print='all', frequency=1):
         self.basic_to_print = data_options if basic_to_print == 'all' else basic_to_print
         self.adv_to_print = advanced_equations if adv_to_print == 'all' else adv_to_print
         self.frequency_print = frequency
 
-    def increment_total_infected(self):
-        self.total_infected += 1
+    def increment_total_infected(self, amount=1):
+        self.total_infected += amount
 
-    def increment_initial_S(self):
-        self.initial_S += 1
-
-    def _update_adv_infection_data(self, person):
-        SD = person.social_distance
-        not_SD = not SD
-        self.adv_infection_data['total'] += 1
-        if SD: self.adv_infection_data['SD'] += 1
-        if not_SD: self.adv_infection_data['not SD'] += 1
+    def increment_initial_S(self, amount=1):
+        self.initial_S += amount
 
+    # Add one person to the current timestep
     def update_data(self, person):
-        self.current_data['S'] += person.susceptible
-        self.current_data['I'] += person.infected
+        row = self.basic_data[self.num_timesteps]
+        row[S] += person.susceptible
+        row[I] += person.infected
         if person.infected:
-            self._update_adv_infection_data(person)
-        self.current_data['R'] += person.recovered
-        self.current_data['WM'] += person.wear_mask
-        self.current_data['SD'] += person.social_distance
-        if person.current_symptom_stage == 'mild':
-            self.current_data['mild'] += 1
-        elif person.current_symptom_stage == 'severe':
-            self.current_data['severe'] += 1
-        elif person.current_symptom_stage == 'asymptomatic':
-            self.current_data['asymptomatic'] += 1
-
-    def increment_death_data(self, person):
-        self.current_data['death'] += 1
+            self.adv_infection_data[self.num_timesteps] += [1, person.social_distance, not person.social_distance]
+        row[R] += person.recovered
+        row[WM] += person.wear_mask
+        row[SD] += person.social_distance
+        if person.current_symptom_stage in symptom_options:
+            row[data_options.index(person.current_symptom_stage)] += 1
+
+    # Add everyone alive in a `Population` to the current timestep at once (vectorized version of `update_data`)
+    def update_population(self, population):
+        ids = population.alive_ids()
+        flags = population.flags[ids]
+        infected = (flags & INFECTED) != 0
+        social_distance = (flags & SOCIAL_DISTANCE) != 0
+        row = self.basic_data[self.num_timesteps]
+        row[S] += np.count_nonzero(flags & SUSCEPTIBLE)
+        row[I] += np.count_nonzero(infected)
+        row[R] += np.count_nonzero(flags & RECOVERED)
+        row[WM] += np.count_nonzero(flags & WEAR_MASK)
+        row[SD] += np.count_nonzero(social_distance)
+        symptom_counts = np.bincount(population.symptom_stage[ids] - NO_STAGE, minlength=len(symptom_stages) + 1)
+        for option in symptom_options:
+            row[data_options.index(option)] += symptom_counts[symptom_stages.index(option) - NO_STAGE]
+        infected_SD = np.count_nonzero(infected & social_distance)
+        self.adv_infection_data[self.num_timesteps] += [row[I], infected_SD, row[I] - infected_SD]
+        if self.stream: self.stream.write_snapshot(self.num_timesteps, population)
+        if self.trajectory: self.trajectory.write_step(self.num_timesteps, population)
+
+    def increment_death_data(self, amount=1):
+        self.basic_data[self.num_timesteps, DEATH_COLUMN] += amount
 
     def add_lifetime_infected(self, num_infected, infectious_days_info):
+        self.add_lifetime_infected_batch([num_infected], [infectious_days_info['SD']], [infectious_days_info['not SD']],
+                                         [infectious_days_info['WM']], [infectious_days_info['not WM']])
+
+    # Same as `add_lifetime_infected` for many people at once (arrays)
+    def add_lifetime_infected_batch(self, num_infected, SD_days, not_SD_days, WM_days, not_WM_days):
+        num_infected = np.asarray(num_infected)
         # Bin infectious_days_info into majority SD, minority SD, majority WM, minority WM (ie did they SD more often then not)
-        SD = infectious_days_info['SD'] > infectious_days_info['not SD']
-        WM = infectious_days_info['WM'] > infectious_days_info['not WM']
-        both = SD and WM
-        neither = not SD and not WM
-        self.current_bin_lifetime_infected.append({'total': num_infected, 'SD': SD, 'not SD': not SD, 'WM': WM,
-                                                   'not WM': not WM, 'both': both, 'neither': neither})
+        SD = np.asarray(SD_days) > np.asarray(not_SD_days)
+        WM = np.asarray(WM_days) > np.asarray(not_WM_days)
+        # Note: 'total' only includes people who infected at least one person
+        in_bin = np.stack([num_infected != 0, SD, ~SD, WM, ~WM, SD & WM, ~SD & ~WM])
+        self.current_bin_sums += (in_bin * num_infected).sum(axis=1)
+        self.current_bin_counts += in_bin.sum(axis=1)
 
     def reset(self, timestep, last=False):
-        # Aggregate history data
-        for key, value in list(self.current_data.items()):
-            self.data_history[key].append(value)
-        for key, value in list(self.adv_infection_data.items()):
-            self.adv_infection_data_history[key].append(value)
-            self.adv_infection_data[key] = 0
+        # Finish the current timestep (its row is now part of the history)
+        current_data = self.current_data
+        self.num_timesteps += 1
+        self._ensure_rows()
         # If bin is done in lifetime infected get avg and empty bin
         if timestep % self.lifetime_infected_bin_size == 0 and timestep != 0:
             self.lifetime_infected_bin_avgs[timestep] = {}
-            # If no one infected recovered/died them move on
-            if len(self.current_bin_lifetime_infected) == 0:
-                # Set to the last avgs initially and if new ones then set them
-                for k, last_avg in list(self.last_bin_avgs.items()):
-                    self.lifetime_infected_bin_avgs[timestep][k] = last_avg
-            else:
-                for k in list(self.last_bin_avgs.keys()):
-                    bin_arr = [dic['total'] for dic in self.current_bin_lifetime_infected if dic[k]]
-                    if len(bin_arr) == 0:  # No people with that bin type
-                        self.lifetime_infected_bin_avgs[timestep][k] = self.last_bin_avgs[k]
-                        continue
-                    bin_avg = sum(bin_arr) / len(bin_arr)
-                    self.lifetime_infected_bin_avgs[timestep][k] = bin_avg
-                    self.last_bin_avgs[k] = bin_avg
-            self.current_bin_lifetime_infected = []
+            for i, k in enumerate(lifetime_bin_types):
+                # If no one with that bin type recovered then keep the last avg
+                if self.current_bin_counts[i] == 0:
+                    self.lifetime_infected_bin_avgs[timestep][k] = self.last_bin_avgs[k]
+                    continue
+                bin_avg = float(self.current_bin_sums[i] / self.current_bin_counts[i])
+                self.lifetime_infected_bin_avgs[timestep][k] = bin_avg
+                self.last_bin_avgs[k] = bin_avg
+            self.current_bin_sums[:] = 0
+            self.current_bin_counts[:] = 0
+        if self.stream:
+            row = self.num_timesteps - 1
+            self.stream.write_timestep(timestep, self.basic_data[row], self.adv_infection_data[row],
+                                       self.lifetime_infected_bin_avgs.get(timestep))
         # Print
         if timestep % self.frequency_print == 0 and (self.basic_to_print or self.adv_to_print):
             st = 'At timestep: {} --- '.format(timestep)
             if self.basic_to_print:
                 for i, val in enumerate(self.basic_to_print):
-                    st += '{}: {}'.format(val, self.current_data[val])
+                    st += '{}: {}'.format(val, current_data[val])
                     if i != len(self.basic_to_print)-1:
                         st += ' --- '
             if self.adv_to_print:
@@ -131,100 +181,130 @@ class DataCollector:
                     if 'R0' in self.adv_to_print and total_bin_avg != None:
                         st += '\nBasic Reproduction Number (R0): {:.02f}'.format(total_bin_avg)
                     if 'R0S' in self.adv_to_print and total_bin_avg != None:
-                        st += '\nR0S: {:.02f} x {} = {:.02f}'.format(total_bin_avg, self.current_data['S'], total_bin_avg * self.current_data['S'])
+                        st += '\nR0S: {:.02f} x {} = {:.02f}'.format(total_bin_avg, current_data['S'], total_bin_avg * current_data['S'])
             print(st)
-        # Reset data
-        self._reset_data_options()
         # If last print advanced equations
         if last:
             SAR = self.total_infected / self.initial_S
-            if 'SAR' in self.adv_to_print:
+            self.SAR = SAR
+            if self.stream: self.stream.close()
+            if self.trajectory: self.trajectory.close()
+            if self.adv_to_print and 'SAR' in self.adv_to_print:
                 print('Secondary Attack Rate (SAR): {} / {} = {:.02f}'.format(self.total_infected, self.initial_S, SAR))
             # Convert the lifetime infected bin avgs to a a dict of lists and a list for the x-vals
             self.R0_hist = {'total': [], 'SD': [], 'WM': [], 'not SD': [], 'not WM': [], 'both': [], 'neither': []}
             self.R0S_hist = {'total': [], 'SD': [], 'WM': [], 'not SD': [], 'not WM': [], 'both': [], 'neither': []}
             self.R0_xvals = []
+            S_history = self.basic_data[:self.num_timesteps, S]
             for x_val, info in list(self.lifetime_infected_bin_avgs.items()):
                 self.R0_xvals.append(x_val)
-                S = self.data_history['S'][x_val]
+                S_val = S_history[x_val]
                 for k, y_val in list(info.items()):
                     if not y_val: y_val = np.nan
                     R0 = y_val
-                    R0S = S * y_val
+                    R0S = S_val * y_val
                     self.R0_hist[k].append(R0)
                     self.R0S_hist[k].append(R0S)
-            # Visualizations
-            fig, axs = plt.subplots(2, 2, figsize=(15, 10))
-            # Infections
-            I_xvals = list(range(len(self.adv_infection_data_history['total'])))
-            axs[0, 0].plot(I_xvals, self.adv_infection_data_history['total'], 'C0', label='total')
-            axs[0, 0].plot(I_xvals, self.adv_infection_data_history['SD'], 'C2', label='SD')
-            axs[0, 0].plot(I_xvals, self.adv_infection_data_history['not SD'], 'C3', label='not SD')
-            axs[0, 0].set_title('Infections based on SD')
-            axs[0, 0].legend(loc="upper left")
-
-            # R0
-            R0_xvals = self.R0_xvals
-            axs[1, 0].plot(R0_xvals, self.R0_hist['total'], 'C0', label='total')
-            axs[1, 0].plot(R0_xvals, self.R0_hist['SD'], 'C2', label='SD')
-            axs[1, 0].plot(R0_xvals, self.R0_hist['not SD'], 'C3', label='not SD')
-            axs[1, 0].plot(R0_xvals, self.R0_hist['WM'], 'C4', label='WM')
-            axs[1, 0].plot(R0_xvals, self.R0_hist['not WM'], 'C1', label='not WM')
-            axs[1, 0].plot(R0_xvals, self.R0_hist['both'], 'C5', label='both')
-            axs[1, 0].plot(R0_xvals, self.R0_hist['neither'], 'C6', label='neither')
-            axs[1, 0].set_title('R0 based on SD and WM')
-            axs[1, 0].legend(loc="upper left")
-
-            # R0S
-            axs[1, 1].plot(R0_xvals, self.R0S_hist['total'], 'C0', label='total')
-            axs[1, 1].plot(R0_xvals, self.R0S_hist['SD'], 'C2', label='SD')
-            axs[1, 1].plot(R0_xvals, self.R0S_hist['not SD'], 'C3', label='not SD')
-            axs[1, 1].plot(R0_xvals, self.R0S_hist['WM'], 'C4', label='WM')
-            axs[1, 1].plot(R0_xvals, self.R0S_hist['not WM'], 'C1', label='not WM')
-            axs[1, 1].plot(R0_xvals, self.R0S_hist['both'], 'C5', label='both')
-            axs[1, 1].plot(R0_xvals, self.R0S_hist['neither'], 'C6', label='neither')
-            axs[1, 1].set_title('R0S based on SD and WM')
-            axs[1, 1].legend(loc="upper left")
-
-            # Save
-            if self.save_experiment:
-                # Create new directory (name of current date and time)
-                now = datetime.now()
-                dt_string = now.strftime("%d-%m-%Y_%H-%M-%S")
-                sub_dir = os.path.join('experiments', dt_string)
-                new_dir = os.path.join(os.getcwd(), sub_dir)
-                os.mkdir(new_dir)
-                # Save constants
-                constants_file = os.path.join(sub_dir, 'constants.json')
-                json.dump(self.constants, open(constants_file, 'w'), indent=4)
-                # Save visualizations
-                figure_file = os.path.join(sub_dir, 'plots.png')
-                plt.savefig(figure_file)
-                # Save data as .csv and txt
-                # Basic
-                basic_data_file = os.path.join(sub_dir, 'basic_data.csv')
-                self.data_history['timestep'] = I_xvals
-                basic_data_df = pd.DataFrame(data=self.data_history)
-                basic_data_df.to_csv(basic_data_file, index=False)
-                # Advanced infection
-                adv_I_file = os.path.join(sub_dir, 'infection_data.csv')
-                self.adv_infection_data_history['timestep'] = I_xvals
-                adv_I_df = pd.DataFrame(data=self.adv_infection_data_history)
-                adv_I_df.to_csv(adv_I_file, index=False)
-                # R0
-                R0_file = os.path.join(sub_dir, 'R0_data.csv')
-                self.R0_hist['timestep'] = self.R0_xvals
-                R0_df = pd.DataFrame(data=self.R0_hist)
-                R0_df.to_csv(R0_file, index=False)
-                # R0S
-                R0S_file = os.path.join(sub_dir, 'R0S_data.csv')
-                self.R0S_hist['timestep'] = self.R0_xvals
-                R0S_df = pd.DataFrame(data=self.R0S_hist)
-                R0S_df.to_csv(R0S_file, index=False)
-                # Save SAR to txt file
-                SAR_file = os.path.join(sub_dir, 'SAR.txt')
-                with open(SAR_file, 'w') as f:
-                    f.write(str(SAR))
-
-            if self.print_visualizations:
-                plt.show()
+            # Visualizations and saving (matplotlib and pandas are only loaded if needed, so headless runs skip them)
+            if self.save_experiment or self.print_visualizations:
+                import matplotlib.pyplot as plt
+                fig = self._plot(plt)
+                if self.save_experiment:
+                    self._save(plt, SAR)
+                if self.print_visualizations:
+                    plt.show()
+                plt.close(fig)
+
+    def _plot(self, plt):
+        fig, axs = plt.subplots(2, 2, figsize=(15, 10))
+        # Infections
+        adv_infection_data_history = self.adv_infection_data_history
+        I_xvals = list(range(self.num_timesteps))
+        axs[0, 0].plot(I_xvals, adv_infection_data_history['total'], 'C0', label='total')
+        axs[0, 0].plot(I_xvals, adv_infection_data_history['SD'], 'C2', label='SD')
+        axs[0, 0].plot(I_xvals, adv_infection_data_history['not SD'], 'C3', label='not SD')
+        axs[0, 0].set_title('Infections based on SD')
+        axs[0, 0].legend(loc="upper left")
+
+        # R0
+        R0_xvals = self.R0_xvals
+        axs[1, 0].plot(R0_xvals, self.R0_hist['total'], 'C0', label='total')
+        axs[1, 0].plot(R0_xvals, self.R0_hist['SD'], 'C2', label='SD')
+        axs[1, 0].plot(R0_xvals, self.R0_hist['not SD'], 'C3', label='not SD')
+        axs[1, 0].plot(R0_xvals, self.R0_hist['WM'], 'C4', label='WM')
+        axs[1, 0].plot(R0_xvals, self.R0_hist['not WM'], 'C1', label='not WM')
+        axs[1, 0].plot(R0_xvals, self.R0_hist['both'], 'C5', label='both')
+        axs[1, 0].plot(R0_xvals, self.R0_hist['neither'], 'C6', label='neither')
+        axs[1, 0].set_title('R0 based on SD and WM')
+        axs[1, 0].legend(loc="upper left")
+
+        # R0S
+        axs[1, 1].plot(R0_xvals, self.R0S_hist['total'], 'C0', label='total')
+        axs[1, 1].plot(R0_xvals, self.R0S_hist['SD'], 'C2', label='SD')
+        axs[1, 1].plot(R0_xvals, self.R0S_hist['not SD'], 'C3', label='not SD')
+        axs[1, 1].plot(R0_xvals, self.R0S_hist['WM'], 'C4', label='WM')
+        axs[1, 1].plot(R0_xvals, self.R0S_hist['not WM'], 'C1', label='not WM')
+        axs[1, 1].plot(R0_xvals, self.R0S_hist['both'], 'C5', label='both')
+        axs[1, 1].plot(R0_xvals, self.R0S_hist['neither'], 'C6', label='neither')
+        axs[1, 1].set_title('R0S based on SD and WM')
+        axs[1, 1].legend(loc="upper left")
+        return fig
+
+    # Save data, visualizations and constants in a new directory in experiments
+    def _save(self, plt, SAR):
+        import pandas as pd
+        I_xvals = list(range(self.num_timesteps))
+        # Create new directory (name of current date and time)
+        now = datetime.now()
+        dt_string = now.strftime("%d-%m-%Y_%H-%M-%S")
+        sub_dir = os.path.join('experiments', dt_string)
+        new_dir = os.path.join(os.getcwd(), sub_dir)
+        os.mkdir(new_dir)
+        # Save constants
+        constants_file = os.path.join(sub_dir, 'constants.json')
+        # With the seed that was used so the run can be reproduced
+        constants = dict(self.constants, grid=dict(self.constants['grid'], seed=self.seed))
+        json.dump(constants, open(constants_file, 'w'), indent=4)
+        # Save visualizations
+        figure_file = os.path.join(sub_dir, 'plots.png')
+        plt.savefig(figure_file)
+        # Save data as .csv and txt
+        # Basic
+        basic_data_file = os.path.join(sub_dir, 'basic_data.csv')
+        data_history = self.data_history
+        data_history['timestep'] = I_xvals
+        if self.profiler is not None:
+            data_history.update(self.profiler.columns(self.num_timesteps))
+            self.profiler.save_chrome_trace(os.path.join(sub_dir, 'trace.json'))
+        basic_data_df = pd.DataFrame(data=data_history)
+        basic_data_df.to_csv(basic_data_file, index=False)
+        # Advanced infection
+        adv_I_file = os.path.join(sub_dir, 'infection_data.csv')
+        adv_infection_data_history = self.adv_infection_data_history
+        adv_infection_data_history['timestep'] = I_xvals
+        adv_I_df = pd.DataFrame(data=adv_infection_data_history)
+        adv_I_df.to_csv(adv_I_file, index=False)
+        # R0
+        R0_file = os.path.join(sub_dir, 'R0_data.csv')
+        self.R0_hist['timestep'] = self.R0_xvals
+        R0_df = pd.DataFrame(data=self.R0_hist)
+        R0_df.to_csv(R0_file, index=False)
+        # R0S
+        R0S_file = os.path.join(sub_dir, 'R0S_data.csv')
+        self.R0S_hist['timestep'] = self.R0_xvals
+        R0S_df = pd.DataFrame(data=self.R0S_hist)
+        R0S_df.to_csv(R0S_file, index=False)
+        # Save SAR to txt file
+        SAR_file = os.path.join(sub_dir, 'SAR.txt')
+        with open(SAR_file, 'w') as f:
+            f.write(str(SAR))
+
+    # All the data of a finished run (ie after `reset(last=True)`) as plain lists, eg. to send back from another process
+    def summary(self):
+        return {'SAR': self.SAR,
+                'seed': self.seed,
+                'basic': dict(self.data_history),
+                'infection': dict(self.adv_infection_data_history),
+                'R0_timesteps': list(self.R0_xvals),
+                'R0': {k: list(v) for k, v in list(self.R0_hist.items()) if k != 'timestep'},
+                'R0S': {k: list(v) for k, v in list(self.R0S_hist.items()) if k != 'timestep'}}
@@ -0,0 +1,155 @@
+import numpy as np
+import json
+import copy
+import itertools
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from data_collector import DataCollector
+from rng import spawn_seeds
+
+'''
+Notes:
+- Runs many replicates of many configurations (a parameter grid on top of a `constants.json`) over all CPU cores
+- Every run gets its own seed spawned from one base seed (numpy `SeedSequence`), so an ensemble is reproducible and
+  no two runs share random streams
+- Parameter grid keys are '<section>.<constant>', eg. {'person.policy_type': ['low', 'high'], 'disease.base_infection_prob': [0.1, 0.2]}
+- Results are streamed back as each run finishes (`iter_ensemble`) and aggregated into a mean, std and 95% confidence
+  band (of the mean) for SAR and every history (`aggregate`)
+- Run `python ensemble.py --grid person.policy_type=low,high --replicates 20 --out ensemble.json`
+'''
+
+# Two-sided 95% Student t critical values for 1 to 30 degrees of freedom (bands of the mean of few replicates)
+T_95 = [12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228, 2.201, 2.179, 2.160, 2.145, 2.131,
+        2.120, 2.110, 2.101, 2.093, 2.086, 2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042]
+# z for a 95% confidence band (the t value of many degrees of freedom)
+Z_95 = 1.96
+
+
+# t critical value of each number of degrees of freedom (>= 1), past the table with its expansion in 1 / df
+def t_95(df):
+    df = np.maximum(np.asarray(df, dtype=float), 1)
+    table = np.array(T_95)[np.minimum(df, len(T_95)).astype(np.int64) - 1]
+    expansion = Z_95 + (Z_95 ** 3 + Z_95) / (4 * df) + (5 * Z_95 ** 5 + 16 * Z_95 ** 3 + 3 * Z_95) / (96 * df ** 2)
+    return np.where(df <= len(T_95), table, expansion)
+
+
+# nan -> None (null in JSON, nan isn't valid JSON), for a number or an array
+def _to_list(values):
+    if values.ndim == 0:
+        return None if np.isnan(values) else float(values)
+    return [_to_list(v) for v in values]
+
+
+# All combinations of the parameter grid, as a list of {key: value}
+def expand_grid(param_grid):
+    keys = sorted(param_grid)
+    return [dict(zip(keys, values)) for values in itertools.product(*[param_grid[k] for k in keys])]
+
+
+def apply_params(constants, params):
+    constants = copy.deepcopy(constants)
+    for key, value in list(params.items()):
+        section, name = key.split('.')
+        constants[section][name] = value
+    return constants
+
+
+# Run one (headless) simulation and return its data summary
+def run_single(constants, seed):
+    from main import create_automation
+    constants = apply_params(constants, {'grid.seed': seed})
+    data_collect = DataCollector(constants, save_experiment=False, print_visualizations=False)
+    data_collect.set_print_options(basic_to_print=[], adv_to_print=[])
+    CA = create_automation(constants, data_collect)
+    CA.run(render=False)
+    return data_collect.summary()
+
+
+def _run_job(job):
+    config_index, replicate, constants, seed = job
+    return {'config': config_index, 'replicate': replicate, 'seed': seed, 'summary': run_single(constants, seed)}
+
+
+# Yields each run's result (config index, replicate, seed and summary) as soon as it finishes
+def iter_ensemble(constants, param_grid, replicates, seed=0, workers=None):
+    configs = expand_grid(param_grid)
+    seeds = spawn_seeds(seed, len(configs) * replicates)
+    jobs = [(c, r, apply_params(constants, params), seeds[c * replicates + r])
+            for c, params in enumerate(configs) for r in range(replicates)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_run_job, job) for job in jobs]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+# Mean, sample std and 95% t confidence band of the mean over replicates (axis 0), ignoring nans (eg. R0 bins without
+# data), None where there isn't enough data (no mean without replicates, no std or band with only one)
+def _band(values):
+    values = np.asarray(values, dtype=float)
+    valid = ~np.isnan(values)
+    n = valid.sum(axis=0)
+    safe_n = np.maximum(n, 1)
+    mean = np.where(valid, values, 0.).sum(axis=0) / safe_n
+    std = np.sqrt(np.where(valid, (values - mean) ** 2, 0.).sum(axis=0) / np.maximum(n - 1, 1))
+    mean, std = np.where(n > 0, mean, np.nan), np.where(n > 1, std, np.nan)
+    half_width = t_95(n - 1) * std / np.sqrt(safe_n)
+    return {'mean': _to_list(mean), 'std': _to_list(std), 'low': _to_list(mean - half_width),
+            'high': _to_list(mean + half_width)}
+
+
+def aggregate(results, configs):
+    aggregated = []
+    for c, params in enumerate(configs):
+        runs = sorted([r for r in results if r['config'] == c], key=lambda r: r['replicate'])
+        if len(runs) == 0:
+            continue
+        summaries = [r['summary'] for r in runs]
+        info = {'params': params, 'replicates': len(runs), 'seeds': [r['seed'] for r in runs],
+                'SAR': _band([s['SAR'] for s in summaries]), 'R0_timesteps': summaries[0]['R0_timesteps']}
+        for history in ['basic', 'infection', 'R0', 'R0S']:
+            info[history] = {k: _band([s[history][k] for s in summaries]) for k in summaries[0][history]}
+        aggregated.append(info)
+    return aggregated
+
+
+# Run the whole ensemble and aggregate it, `callback` gets every run's result as it comes in
+def run_ensemble(constants, param_grid, replicates, seed=0, workers=None, callback=None):
+    results = []
+    for result in iter_ensemble(constants, param_grid, replicates, seed, workers):
+        results.append(result)
+        if callback: callback(result)
+    return aggregate(results, expand_grid(param_grid))
+
+
+# 'section.name=v1,v2,...' -> ('section.name', [v1, v2, ...]) (values are json if possible, o.w. strings)
+def _parse_grid_arg(arg):
+    key, values = arg.split('=', 1)
+
+    def parse(value):
+        try:
+            return json.loads(value)
+        except ValueError:
+            return value
+    return key, [parse(v) for v in values.split(',')]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run replicates of a parameter grid in parallel')
+    parser.add_argument('--constants', default='constants.json')
+    parser.add_argument('--grid', action='append', default=[], help="'section.name=v1,v2,...' (can repeat)")
+    parser.add_argument('--replicates', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=None, help='Number of processes (default: all cores)')
+    parser.add_argument('--out', default='ensemble.json')
+    args = parser.parse_args()
+    constants = json.load(open(args.constants))
+    param_grid = dict(_parse_grid_arg(arg) for arg in args.grid)
+    total = len(expand_grid(param_grid)) * args.replicates
+    done = []
+
+    def progress(result):
+        done.append(result)
+        print('Finished run {} / {} (config {}, replicate {}, SAR: {:.02f})'.format(
+            len(done), total, result['config'], result['replicate'], result['summary']['SAR']))
+    aggregated = run_ensemble(constants, param_grid, args.replicates, args.seed, args.workers, progress)
+    json.dump(aggregated, open(args.out, 'w'), indent=4, allow_nan=False)
@@ -0,0 +1,38 @@
+import numpy as np
+
+'''
+Notes:
+- Calendar queue of infection stage events, bucketed by timestep: every infected person is in the bucket of the next
+  timestep where one of their stages starts (infectious, symptoms, severe, death, removed or recovered)
+    - Stages are fully decided when the infection periods are drawn, so nothing happens to an infected person between
+      those timesteps and they don't need to be updated
+- Each timestep only the people in its bucket progress their infection (see `CellularAutomation._update_person`), so the
+  work for disease progression is per event instead of per infected person per timestep
+'''
+
+
+class EventCalendar:
+    def __init__(self):
+        # {timestep: [ids]}
+        self.buckets = {}
+
+    def __len__(self):
+        return sum(len(ids) for ids in self.buckets.values())
+
+    def schedule(self, timestep, id):
+        self.buckets.setdefault(timestep, []).append(id)
+
+    # Ids with an event at a timestep (they are taken out of the calendar)
+    def pop(self, timestep):
+        return np.array(self.buckets.pop(timestep, []), dtype=np.int64)
+
+    # All events as (timesteps, ids) arrays and back (to save and load them, see `checkpoint.py`)
+    def to_arrays(self):
+        timesteps = [t for t, ids in self.buckets.items() for _ in ids]
+        ids = [id for t, ids in self.buckets.items() for id in ids]
+        return np.array(timesteps, dtype=np.int64), np.array(ids, dtype=np.int64)
+
+    def from_arrays(self, timesteps, ids):
+        self.buckets = {}
+        for timestep, id in zip(timesteps.tolist(), ids.tolist()):
+            self.schedule(timestep, id)
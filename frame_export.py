@@ -0,0 +1,154 @@
+import numpy as np
+import os
+import json
+import shutil
+import argparse
+import subprocess
+import threading
+from queue import Queue
+from render import get_palette, get_color_index_grid, get_circle_grid, get_frame_indices
+
+'''
+Notes:
+- Exports the frames of a run to a GIF, an MP4 or a PNG sequence without a display and without slowing the simulation
+  down to the render fps: `CA.run(frames=FrameExporter('run.gif', constants['render'], width, height))`
+- Each step the simulation only pushes a compact frame (uint8 color index per cell, the top bit set if the person is
+  drawn as a circle) into a bounded queue, a background thread turns them into pixels and encodes them
+    - If the encoder falls behind the queue fills up and the simulation waits, so memory stays bounded
+- Formats (from the path): '.gif' (Pillow, palette frames written to the file as they come, so the encoder keeps
+  one frame at a time however long the run), '.mp4' (piped to `ffmpeg`, which has to be on the PATH) or
+  anything else is a directory of numbered PNGs (Pillow)
+- The fps of the animation is `fps` in the render constants (the simulation itself isn't throttled)
+- `python frame_export.py --out high.gif --set person.policy_type=high` makes an animation from `constants.json`
+'''
+
+# Top bit of a compact frame cell: drawn as a circle
+CIRCLE_BIT = np.uint8(0x80)
+DEFAULT_QUEUE_SIZE = 64
+# Animation fps if the render constants have none
+DEFAULT_FPS = 10
+
+
+class FrameExporter:
+    def __init__(self, path, render_C, width, height, queue_size=DEFAULT_QUEUE_SIZE):
+        self.path = path
+        self.render_C = render_C
+        self.width = width
+        self.height = height
+        self.fps = render_C['fps'] or DEFAULT_FPS
+        self.palette = get_palette(render_C['color_model'])
+        extension = os.path.splitext(path)[1].lower()
+        self.format = {'.gif': 'gif', '.mp4': 'mp4'}.get(extension, 'png')
+        if self.format == 'mp4':
+            assert shutil.which('ffmpeg') is not None, 'MP4 export needs ffmpeg on the PATH'
+        self.num_frames = 0
+        self.error = None
+        # Set by the encoder thread once it got the end of the frames (`None`) from the queue
+        self.got_last_frame = False
+        self.queue = Queue(maxsize=queue_size)
+        self.thread = threading.Thread(target=self._encode_all)
+        self.thread.daemon = True
+        self.thread.start()
+
+    # Push the frame of the current state (same call as `Renderer.draw`)
+    def draw(self, population):
+        if self.error is not None:
+            raise self.error
+        frame = get_color_index_grid(population, self.width, self.height)
+        frame[get_circle_grid(population, self.width, self.height, self.render_C['shape_model'])] |= CIRCLE_BIT
+        self.queue.put(frame)
+        self.num_frames += 1
+
+    # Wait for the encoder to finish every frame and write the file
+    def close(self):
+        if self.thread is None:
+            return
+        self.queue.put(None)
+        self.thread.join()
+        self.thread = None
+        if self.error is not None:
+            raise self.error
+
+    # Palette index image of a compact frame
+    def _indices(self, frame):
+        return get_frame_indices(frame & ~CIRCLE_BIT, (frame & CIRCLE_BIT) != 0, self.render_C['cell_size'])
+
+    # Encoder thread ------
+    # Frames from the queue until `close`
+    def _frames(self):
+        frame = self.queue.get()
+        while frame is not None:
+            yield frame
+            frame = self.queue.get()
+        self.got_last_frame = True
+
+    def _encode_all(self):
+        try:
+            encode = {'gif': self._encode_gif, 'mp4': self._encode_mp4, 'png': self._encode_png}[self.format]
+            encode(self._frames())
+        except Exception as error:
+            self.error = error
+            # Keep emptying the queue so the simulation never blocks on a dead encoder (unless it failed after the
+            # last frame, eg. writing the trailer or ffmpeg's exit, then nothing is coming anymore)
+            while not self.got_last_frame:
+                self.got_last_frame = self.queue.get() is None
+
+    # Header (with the palette and looping) before the first frame, then each frame's block, then the trailer
+    def _encode_gif(self, frames):
+        from PIL import Image, GifImagePlugin
+        palette = self.palette.reshape(-1).tolist()
+        duration = int(1000 / self.fps)
+        with open(self.path, 'wb') as f:
+            for i, frame in enumerate(frames):
+                image = Image.fromarray(self._indices(frame), mode='P')
+                image.putpalette(palette)
+                if i == 0:
+                    header, _ = GifImagePlugin.getheader(image, info={'loop': 0, 'duration': duration, 'optimize': False})
+                    f.write(b''.join(header))
+                f.write(b''.join(GifImagePlugin.getdata(image, duration=duration, disposal=1)))
+            f.write(b';')
+
+    def _encode_png(self, frames):
+        from PIL import Image
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        for i, frame in enumerate(frames):
+            Image.fromarray(self.palette[self._indices(frame)]).save(os.path.join(self.path, 'frame_{:05d}.png'.format(i)))
+
+    def _encode_mp4(self, frames):
+        size = '{}x{}'.format(self.width * self.render_C['cell_size'], self.height * self.render_C['cell_size'])
+        command = ['ffmpeg', '-loglevel', 'error', '-y', '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', size,
+                   '-r', str(self.fps), '-i', '-', '-pix_fmt', 'yuv420p', '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2',
+                   self.path]
+        process = subprocess.Popen(command, stdin=subprocess.PIPE)
+        try:
+            for frame in frames:
+                process.stdin.write(self.palette[self._indices(frame)].tobytes())
+        finally:
+            process.stdin.close()
+            assert process.wait() == 0, 'ffmpeg failed'
+
+
+# Run a (headless) simulation and export its frames
+def export_animation(constants, path, data_collect=None):
+    from main import create_automation
+    from data_collector import DataCollector
+    if data_collect is None:
+        data_collect = DataCollector(constants, save_experiment=False, print_visualizations=False)
+        data_collect.set_print_options(basic_to_print=[], adv_to_print=[])
+    CA = create_automation(constants, data_collect)
+    frames = FrameExporter(path, constants['render'], constants['grid']['width'], constants['grid']['height'])
+    CA.run(render=False, frames=frames)
+    return frames.num_frames
+
+
+if __name__ == '__main__':
+    from ensemble import apply_params, _parse_grid_arg
+    parser = argparse.ArgumentParser(description='Run a simulation and export its frames (GIF, MP4 or PNGs)')
+    parser.add_argument('--constants', default='constants.json')
+    parser.add_argument('--set', action='append', default=[], help="'section.name=value' to change (can repeat)")
+    parser.add_argument('--out', default='run.gif')
+    args = parser.parse_args()
+    constants = json.load(open(args.constants))
+    constants = apply_params(constants, {k: v[0] for k, v in [_parse_grid_arg(arg) for arg in args.set]})
+    print('Exported {} frames to {}'.format(export_animation(constants, args.out), args.out))
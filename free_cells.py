@@ -0,0 +1,57 @@
+import numpy as np
+
+'''
+Notes:
+- Keeps track of the open positions (no person on it) of the grid with O(1) add, remove and uniform random choice
+- Index-swap array: the first `size` entries of `cells` are the open cells (as flat index y * width + x) in no order, and
+  `slots` maps each cell to its index in `cells` (-1 if the cell is taken)
+    - Removing a cell moves the last open cell into its slot, so nothing ever shifts
+- Positions going in and out are (x, y) tuples like the rest of `CellularAutomation`
+'''
+class FreeCells:
+    def __init__(self, width, height, uniforms):
+        self.width = width
+        self.height = height
+        # `UniformBuffer` (see `rng.py`) of the simulation
+        self.uniforms = uniforms
+        # All cells start open
+        self.cells = np.arange(width * height, dtype=np.int32)
+        self.slots = np.arange(width * height, dtype=np.int32)
+        self.size = width * height
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, position):
+        return self.slots[position[1] * self.width + position[0]] >= 0
+
+    def _position(self, cell):
+        return cell % self.width, cell // self.width
+
+    # Open a cell
+    def append(self, position):
+        cell = position[1] * self.width + position[0]
+        assert self.slots[cell] < 0, '{} is already open'.format(position)
+        self.cells[self.size] = cell
+        self.slots[cell] = self.size
+        self.size += 1
+
+    # Take a cell
+    def remove(self, position):
+        cell = position[1] * self.width + position[0]
+        slot = self.slots[cell]
+        assert slot >= 0, '{} is not open'.format(position)
+        last_cell = self.cells[self.size - 1]
+        self.cells[slot] = last_cell
+        self.slots[last_cell] = slot
+        self.slots[cell] = -1
+        self.size -= 1
+
+    # Uniformly random open position
+    def random_position(self):
+        return self._position(int(self.cells[self.uniforms.randrange(self.size)]))
+
+    # All the open positions (in no particular order)
+    def positions(self):
+        cells = self.cells[:self.size]
+        return list(zip((cells % self.width).tolist(), (cells // self.width).tolist()))
@@ -0,0 +1,233 @@
+import numpy as np
+import json
+import copy
+import argparse
+from vectorized import VectorizedCellularAutomation
+from population import ALIVE, SUSCEPTIBLE, INFECTED, SOCIAL_DISTANCE, LATENT, INCUBATION
+
+'''
+Notes:
+- Compiled kernels for the sequential part of a phase: each person in random order checks if they get infected and
+  then moves with the object engine rules (`_check_neighbors_SD` and `_check_neighbors_not_SD` in `main.py`)
+    - SD people move if their cell isn't safe (only one step then) or intentionally, to a random empty neighbor whose
+      3x3 is empty too (candidates are tried in random order until a safe one is found)
+    - Non SD people random walk into empty neighbors (not the cell they just left) up to `move_length` times
+    - Every move is done on the grid right away, so the next person sees it (no conflicts to settle)
+- Compiled with Numba in nopython mode if it is installed, otherwise the same functions run as plain Python (same
+  results, just slow)
+- Every draw comes from the run's numpy `Generator` (Numba uses the same bit generator), so a run is reproducible from
+  its seed with or without Numba
+- `JitCellularAutomation` ('jit' engine) is the vectorized engine (batched infection progression, data collection)
+  with its phases run by the kernel
+- Checkpoints of a jit run (see `checkpoint.py`) are loaded as the jit engine
+- `python kernels.py --seeds 10` compares the distributions of the 'jit' and 'object' engines over many seeds
+  (`tests/test_engines.py` does it for fixed seeds on a small grid)
+'''
+
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+    # Fallback: run the kernels as plain Python
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda function: function
+
+# Flags and codes as plain ints for the kernels
+SD_FLAG, SUSCEPTIBLE_FLAG, INFECTED_FLAG = int(SOCIAL_DISTANCE), int(SUSCEPTIBLE), int(INFECTED)
+LATENT_STAGE, INCUBATION_STAGE = int(LATENT), int(INCUBATION)
+# Kernel counters (same names as the profiler's)
+counter_names = ['moves_attempted', 'moves_succeeded', 'safe_cell_checks', 'infections_evaluated']
+MOVES_ATTEMPTED, MOVES_SUCCEEDED, SAFE_CELL_CHECKS, INFECTIONS_EVALUATED = range(len(counter_names))
+
+
+@njit(cache=True)
+def _check_infection(id, x, y, grid, codes, flags, infection_stage, symptom_stage, infection_step,
+                     num_people_infected, base_infection_prob, mask_decrease, rng, counters):
+    if not (flags[id] & SUSCEPTIBLE_FLAG):
+        return False
+    height, width = grid.shape
+    r = 0
+    masks = 0
+    for dy in range(-1, 2):
+        for dx in range(-1, 2):
+            if dx == 0 and dy == 0:
+                continue
+            code = codes[(y + dy) % height, (x + dx) % width]
+            if code != 0:
+                r += 1
+                if code == 2:
+                    masks += 1
+    if r == 0:
+        return False
+    counters[INFECTIONS_EVALUATED] += 1
+    # Kermack-McKendrick Model of infection probability: 1 - (1 - p) ^ r
+    p = base_infection_prob - (masks * mask_decrease) / r
+    if rng.random() >= 1. - (1. - p) ** r:
+        return False
+    flags[id] = (flags[id] | INFECTED_FLAG) & ~SUSCEPTIBLE_FLAG
+    infection_stage[id] = LATENT_STAGE
+    symptom_stage[id] = INCUBATION_STAGE
+    infection_step[id] = 0
+    # Add to the num of people infected to each infectious neighbor for calc. Ro
+    for dy in range(-1, 2):
+        for dx in range(-1, 2):
+            if (dx != 0 or dy != 0) and codes[(y + dy) % height, (x + dx) % width] != 0:
+                num_people_infected[grid[(y + dy) % height, (x + dx) % width]] += 1
+    return True
+
+
+# Safe if no one but the mover is in the 3x3 around a cell
+@njit(cache=True)
+def _is_safe(id, x, y, grid):
+    height, width = grid.shape
+    for dy in range(-1, 2):
+        for dx in range(-1, 2):
+            occupant = grid[(y + dy) % height, (x + dx) % width]
+            if occupant >= 0 and occupant != id:
+                return False
+    return True
+
+
+@njit(cache=True)
+def _move(id, new_x, new_y, x, y, grid, codes):
+    code = codes[y[id], x[id]]
+    grid[y[id], x[id]] = -1
+    codes[y[id], x[id]] = 0
+    grid[new_y, new_x] = id
+    codes[new_y, new_x] = code
+    x[id] = new_x
+    y[id] = new_y
+
+
+# One phase: every person of `order` in that order, returns the number of people infected (their ids are the start of
+# `infected_ids`)
+@njit(cache=True)
+def phase_kernel(order, move_draws, grid, codes, x, y, flags, movement_prob, move_length, infection_stage,
+                 symptom_stage, infection_step, num_people_infected, base_infection_prob, mask_decrease, rng,
+                 infected_ids, counters):
+    height, width = grid.shape
+    num_infected = 0
+    nx, ny = 0, 0
+    candidates_x = np.empty(8, dtype=np.int64)
+    candidates_y = np.empty(8, dtype=np.int64)
+    for i in range(len(order)):
+        id = order[i]
+        if _check_infection(id, x[id], y[id], grid, codes, flags, infection_stage, symptom_stage, infection_step,
+                            num_people_infected, base_infection_prob, mask_decrease, rng, counters):
+            infected_ids[num_infected] = id
+            num_infected += 1
+        social_distance = (flags[id] & SD_FLAG) != 0
+        if social_distance:
+            # Move it if its own cell is not safe OR its moving intentionally (only one time if just moving cuz unsafe)
+            unsafe = not _is_safe(id, x[id], y[id], grid)
+            if not unsafe and move_draws[i] >= movement_prob[i]:
+                continue
+            length = 1 if unsafe else move_length
+        else:
+            if move_draws[i] >= movement_prob[i]:
+                continue
+            length = move_length
+        last_x, last_y = -1, -1
+        for m in range(length):
+            counters[MOVES_ATTEMPTED] += 1
+            # Empty neighbors that aren't the last position
+            k = 0
+            for dy in range(-1, 2):
+                for dx in range(-1, 2):
+                    if dx == 0 and dy == 0:
+                        continue
+                    nx, ny = (x[id] + dx) % width, (y[id] + dy) % height
+                    if grid[ny, nx] < 0 and not (nx == last_x and ny == last_y):
+                        candidates_x[k] = nx
+                        candidates_y[k] = ny
+                        k += 1
+            moved = False
+            if social_distance:
+                # Try the candidates in random order, move to the first safe one
+                while k > 0:
+                    j = int(rng.random() * k)
+                    nx, ny = candidates_x[j], candidates_y[j]
+                    candidates_x[j], candidates_y[j] = candidates_x[k - 1], candidates_y[k - 1]
+                    k -= 1
+                    counters[SAFE_CELL_CHECKS] += 1
+                    if _is_safe(id, nx, ny, grid):
+                        moved = True
+                        break
+            elif k > 0:
+                j = int(rng.random() * k)
+                nx, ny = candidates_x[j], candidates_y[j]
+                moved = True
+            # End if it did not move
+            if not moved:
+                break
+            counters[MOVES_SUCCEEDED] += 1
+            last_x, last_y = x[id], y[id]
+            _move(id, nx, ny, x, y, grid, codes)
+            if _check_infection(id, x[id], y[id], grid, codes, flags, infection_stage, symptom_stage, infection_step,
+                                num_people_infected, base_infection_prob, mask_decrease, rng, counters):
+                infected_ids[num_infected] = id
+                num_infected += 1
+    return num_infected
+
+
+class JitCellularAutomation(VectorizedCellularAutomation):
+    # The kernels move people on the plain grid, contact layers are checked by the inherited step (see `contacts.py`)
+    structure_support = ['contact_layers']
+
+    # Run a phase sequentially in the kernel (random order, every move seen by the next person)
+    def _update_phase(self, ids):
+        pop = self.population
+        ids = ids[pop.has(ALIVE, ids)]
+        self._refresh_infectious_grid()
+        order = self.rng.permutation(ids)
+        move_draws = self.rng.random(len(order))
+        infected_ids = np.empty(len(order), dtype=np.int64)
+        counters = np.zeros(len(counter_names), dtype=np.int64)
+        num_infected = phase_kernel(order, move_draws, self.grid, self.infectious_grid, pop.x, pop.y, pop.flags,
+                                    pop.movement_prob(order), self.person_C['move_length'], pop.infection_stage,
+                                    pop.symptom_stage, pop.infection_step, pop.num_people_infected,
+                                    self.disease_C['base_infection_prob'], self.disease_C['mask_infection_prob_decrease'],
+                                    self.rng, infected_ids, counters)
+        pop.assign_courses(infected_ids[:num_infected])
+        self.data_collect.increment_total_infected(num_infected)
+        if self.profiler is not None:
+            for name, amount in zip(counter_names, counters.tolist()):
+                self.profiler.count(name, amount)
+
+
+# Final S, I, R, deaths and peak I of runs of an engine (one per seed)
+def run_engine(constants, engine, seeds):
+    from main import create_automation
+    from data_collector import DataCollector
+    results = []
+    for seed in seeds:
+        C = copy.deepcopy(constants)
+        C['grid']['engine'] = engine
+        C['grid']['seed'] = seed
+        data_collect = DataCollector(C, save_experiment=False, print_visualizations=False)
+        data_collect.set_print_options(basic_to_print=[], adv_to_print=[])
+        create_automation(C, data_collect).run()
+        history = data_collect.data_history
+        results.append([history['S'][-1], history['I'][-1], history['R'][-1], sum(history['death']), max(history['I'])])
+    return np.array(results, dtype=float)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the distributions of the jit and object engines')
+    parser.add_argument('--constants', default='constants.json')
+    parser.add_argument('--seeds', type=int, default=10)
+    args = parser.parse_args()
+    constants = json.load(open(args.constants))
+    print('Numba available: {}'.format(NUMBA_AVAILABLE))
+    jit = run_engine(constants, 'jit', range(args.seeds))
+    obj = run_engine(constants, 'object', range(args.seeds, 2 * args.seeds))
+    for i, name in enumerate(['S', 'I', 'R', 'death', 'peak I']):
+        # Difference of the means in standard errors
+        se = np.sqrt(jit[:, i].var(ddof=1) / len(jit) + obj[:, i].var(ddof=1) / len(obj))
+        z = (jit[:, i].mean() - obj[:, i].mean()) / se if se > 0 else 0.
+        print('{}: jit {:.1f} +- {:.1f} --- object {:.1f} +- {:.1f} --- z = {:.2f}'.format(
+            name, jit[:, i].mean(), jit[:, i].std(), obj[:, i].mean(), obj[:, i].std(), z))
@@ -1,16 +1,16 @@
 import numpy as np
-import random
 from person import Person
-import pygame
+from population import Population, ALIVE, WEAR_MASK, INFECTIOUS, NOT_INFECTIOUS, INFECTIOUS_NO_MASK, INFECTIOUS_MASK, \
+    infection_prob_table
+from free_cells import FreeCells
+from active_set import ActiveSet
+from event_calendar import EventCalendar
 from data_collector import DataCollector
+from rng import resolve_seed, make_rng
+from contacts import configured_structure
 import json
 
 
-# Different color models (only one right now)
-color_models = {'SIR': {'susceptible': (204, 255, 204), 'infected': (255, 204, 204), 'recovered': (204, 204, 255)}}
-# Different shape models (if you care about SD or WM more)
-shape_models = {'SD': {True: 'circle', False: 'rect'},
-                'WM': {True: 'circle', False: 'rect'}}
 # Policies that define overall safety level of the population
 policies_safety = {
     'very high': {'social_distance_prob': 0.75, 'wear_mask_prob': 0.75},
@@ -27,22 +27,49 @@ class CellularAutomation:
         self.person_C = constants['person']
         self.disease_C = constants['disease']
         self.data_collect = data_collect
+        assert not configured_structure(self.grid_C), \
+            'Obstacles, zones and contact layers need the vectorized engine (see `contacts.py`)'
+        # Every random draw comes from one generator made from the seed (see `rng.py`)
+        self.seed = resolve_seed(self.grid_C.get('seed'))
+        self.rng = make_rng(self.seed)
+        self.data_collect.set_seed(self.seed)
         # Need two sets of ids (correspond uniquely to a person)
         # 1) Those who practice social distancing
         # 2) Those who do not practice social distancing
         self.ids_social_distance = set()
         self.ids_not_social_distance = set()
-        # The person objects
-        # id (int): person (object)
-        self.id_person = {}
-        # Grid stores the person IDs in a 2D structure
-        self.grid = np.empty(shape=(self.grid_C['height'], self.grid_C['width']), dtype=np.object)
-        self.next_id = 0
+        # All the people are stored in arrays, `Person` objects are just views of an id
+        self.population = Population(self.grid_C['initial_pop_size'], self.person_C, self.disease_C, self.rng)
+        # Single draws of the per-person updates come from pre-generated uniforms
+        self.uniforms = self.population.uniforms
+        # Grid stores the person IDs in a 2D structure (-1 if empty)
+        self.grid = np.full((self.grid_C['height'], self.grid_C['width']), -1, dtype=np.int32)
+        # Precomputed wrapped positions of neighborhoods, by side length (see `_get_neighbor_tables`)
+        self.neighbor_tables = {}
         # The currently open positions (no person on it)
-        self.open_positions = []
-        for y in range(self.grid_C['height']):
-            for x in range(self.grid_C['width']):
-                self.open_positions.append((x, y))
+        self.open_positions = FreeCells(self.grid_C['width'], self.grid_C['height'], self.uniforms)
+        # Number of people in the 3x3 around each cell (including the cell itself), kept up to date on every move so a
+        # cell is safe for an SD person next to it if its count is 1 (just them)
+        self.neighbor_counts = np.zeros((self.grid_C['height'], self.grid_C['width']), dtype=np.int16)
+        # Infectious code of the person on each cell (see `population.py`) and the number of infectious people without
+        # and with a mask in the 3x3 around each cell, kept up to date when infectious people move, change stage or mask
+        self.infectious_grid = np.zeros((self.grid_C['height'], self.grid_C['width']), dtype=np.int8)
+        self.infectious_counts = np.zeros((2, self.grid_C['height'], self.grid_C['width']), dtype=np.int8)
+        # Infection probability by those two counts, so an infection check is a lookup
+        self.infection_probs = infection_prob_table(self.disease_C['base_infection_prob'],
+                                                    self.disease_C['mask_infection_prob_decrease'])
+        # Number of timesteps done so far (a run can start later if resumed from a checkpoint)
+        self.timestep = 0
+        # Optional `Profiler` (see `profiler.py`), set while a profiled run is running
+        self.profiler = None
+        # Timesteps where the infection stages of infected people start (see `event_calendar.py`) and who has one in the
+        # current timestep
+        self.calendar = EventCalendar()
+        self.due = np.zeros(self.grid_C['initial_pop_size'], dtype=bool)
+        # Only the people that can change are updated in a step (see `active_set.py`), it is set while a phase runs
+        self.active_set = None
+        # Movement draw of each person in the current phase (made at once at the start of the phase)
+        self.move_draws = np.ones(self.grid_C['initial_pop_size'])
         # Initialize the grid
         self._initialize_grid()
 
@@ -52,45 +79,102 @@ class CellularAutomation:
 
     # Env wraps - so get correct pos
     def _get_cell_pos(self, x, y):
-        def corrected(val, max_val):
-            if val < 0:
-                 return max_val + val
-            elif val >= max_val:
-                return max_val - val
-            else:
-                return val
-        corrected_x = corrected(x, self.grid_C['width'])
-        corrected_y = corrected(y, self.grid_C['height'])
-        return corrected_x, corrected_y
+        return x % self.grid_C['width'], y % self.grid_C['height']
+
+    # For each x (and y) the wrapped xs (and ys) of the neighborhood around it, plus the relative positions in the
+    # neighborhood in the same order as they are yielded (row by row)
+    def _get_neighbor_tables(self, side_length):
+        if side_length not in self.neighbor_tables:
+            mid = side_length // 2
+            rel = np.arange(side_length) - mid
+            xs = (np.arange(self.grid_C['width'])[:, None] + rel) % self.grid_C['width']
+            ys = (np.arange(self.grid_C['height'])[:, None] + rel) % self.grid_C['height']
+            rel_positions = [((i % side_length) - mid, (i // side_length) - mid) for i in range(side_length ** 2)]
+            self.neighbor_tables[side_length] = (xs, ys, xs.tolist(), ys.tolist(), rel_positions)
+        return self.neighbor_tables[side_length]
 
     # Is the cell empty
     def _is_empty(self, x=None, y=None, position=None):
-        if x and y:
-            return self.grid[y, x] is None
-        return self.grid[position[1], position[0]] is None
+        if position is None:
+            return self.grid[y, x] < 0
+        return self.grid[position[1], position[0]] < 0
+
+    def _get_person(self, id):
+        return Person(self.population, id)
+
+    def _is_alive(self, id):
+        return self.population.has(ALIVE, id)
 
     # A person can die from the disease
     def _kill_person(self, id, social_distance):
-        person = self.id_person[id]
+        if self.profiler is not None: self.profiler.count('deaths')
+        person = self._get_person(id)
         if social_distance: self.ids_social_distance.remove(id)
         else: self.ids_not_social_distance.remove(id)
         position = person.position
         self._clear_cell(position)
         assert person.infected
-        self.data_collect.increment_death_data(person)
+        self.data_collect.increment_death_data()
         # todo: Not sure if I should keep this because if someone dies early then they dont really get a full infectious lifetime
         # self.data_collect.add_lifetime_infected(person.num_people_infected, person.infectious_days_info)
-        del self.id_person[id]
+        self.population.kill(id)
 
     def _clear_cell(self, position):
-        self.grid[position[1], position[0]] = None
+        self.grid[position[1], position[0]] = -1
         self.open_positions.append(position)
+        self._update_neighbor_counts(self.neighbor_counts, position, -1)
+        if self.infectious_grid[position[1], position[0]]: self._set_infectious_code(position, NOT_INFECTIOUS)
 
     def _add_to_cell(self, id, position):
         assert self._is_empty(position=position)
-        self.id_person[id].position = position
+        self._get_person(id).set_position(position)
         self.grid[position[1], position[0]] = id
         self.open_positions.remove(position)
+        self._update_neighbor_counts(self.neighbor_counts, position, 1)
+        code = self._infectious_code(id)
+        if code: self._set_infectious_code(position, code)
+
+    # Someone left (-1) or entered (1) a cell, so the count of every cell in the 3x3 around it changes
+    def _update_neighbor_counts(self, counts, position, amount):
+        x, y = position
+        # A plain slice away from the edges (much cheaper than the wrapped fancy index)
+        if 0 < x < self.grid_C['width'] - 1 and 0 < y < self.grid_C['height'] - 1:
+            counts[y - 1:y + 2, x - 1:x + 2] += amount
+        else:
+            xs, ys, _, _, _ = self._get_neighbor_tables(3)
+            counts[ys[y][:, None], xs[x]] += amount
+
+    def _infectious_code(self, id):
+        if self.population.infection_stage[id] != INFECTIOUS:
+            return NOT_INFECTIOUS
+        return INFECTIOUS_MASK if self.population.has(WEAR_MASK, id) else INFECTIOUS_NO_MASK
+
+    # Change the infectious code of a cell and the infectious counts around it
+    def _set_infectious_code(self, position, code):
+        x, y = position
+        old_code = self.infectious_grid[y, x]
+        if old_code == code:
+            return
+        self.infectious_grid[y, x] = code
+        if old_code != NOT_INFECTIOUS: self._update_neighbor_counts(self.infectious_counts[old_code - 1], position, -1)
+        if code != NOT_INFECTIOUS: self._update_neighbor_counts(self.infectious_counts[code - 1], position, 1)
+
+    # Number of nonzero cells in the 3x3 (wrapped) around each cell, including the cell itself
+    def _neighborhood_count(self, grid_bool):
+        arr = grid_bool.astype(np.int16)
+        rows = arr + np.roll(arr, 1, axis=0) + np.roll(arr, -1, axis=0)
+        return rows + np.roll(rows, 1, axis=1) + np.roll(rows, -1, axis=1)
+
+    # Counts and infectious codes from scratch (eg. after loading a checkpoint)
+    def _rebuild_neighbor_counts(self):
+        self.neighbor_counts = self._neighborhood_count(self.grid >= 0)
+        ids = self.grid[self.grid >= 0]
+        self.infectious_grid = np.zeros(self.grid.shape, dtype=np.int8)
+        self.infectious_grid[self.grid >= 0] = [self._infectious_code(id) for id in ids.tolist()]
+        self.infectious_counts = np.stack([self._neighborhood_count(self.infectious_grid == code)
+                                           for code in [INFECTIOUS_NO_MASK, INFECTIOUS_MASK]]).astype(np.int8)
+        self.infection_probs = infection_prob_table(self.disease_C['base_infection_prob'],
+                                                    self.disease_C['mask_infection_prob_decrease'])
 
     def _move_person(self, id, person, new_position):
         current_position = person.position
@@ -99,105 +183,94 @@ class CellularAutomation:
         # Place person in new cell
         self._add_to_cell(id, new_position)
         person.set_position(new_position)
+        if self.active_set is not None: self.active_set.moved(id, new_position)
 
     # Grid initialization ------
-    def _create_person(self, position):
-        assert self._is_empty(position=position)
-        age = np.random.randint(self.person_C['age_range'][0], self.person_C['age_range'][1]+1)
-        policy = policies_safety[self.person_C['policy_type']]
-        SD_prob = policy['social_distance_prob']
-        SD = True if np.random.random() < SD_prob else False
-        WM_prob = policy['wear_mask_prob']
-        WM = True if np.random.random() < WM_prob else False
-        infected = np.random.random() < self.person_C['initial_infection_prob']
-
-        if not infected: self.data_collect.increment_initial_S()
-
-        person = Person(position, age, SD, WM, self.person_C['movement_prob'], self.person_C['altruistic_movement_prob'],
-                        self.person_C['altruistic_prob'], infected,
-                        self.disease_C['total_length_infection'], self.disease_C['incubation_period_duration_range'],
-                        self.disease_C['infectious_start_before_symptoms_range'],
-                        self.disease_C['infectious_period_duration_range'],
-                        self.disease_C['severe_symptoms_start_range'],
-                        self.disease_C['death_occurrence_range'], self.disease_C['asymptomatic_prob'],
-                        self.disease_C['severity_prob'], self.disease_C['death_prob'])
-
-        self.id_person[self.next_id] = person
-        data_collect.update_data(person)
-        if SD: self.ids_social_distance.add(self.next_id)
-        else: self.ids_not_social_distance.add(self.next_id)
-        self._add_to_cell(self.next_id, position)
-        self.next_id += 1
-
-    # Create all the people
+    # Create all the people: their positions (unique) and attributes are drawn at once and they are added to the
+    # population in one call (like the vectorized engine), then placed on the grid one by one
     def _initialize_grid(self):
-        for p in range(self.grid_C['initial_pop_size']):
-            # Select random position
-            position = random.choice(self.open_positions)
-            # Create person
-            self._create_person(position)
+        n = self.grid_C['initial_pop_size']
+        width, height = self.grid_C['width'], self.grid_C['height']
+        assert n <= width * height, 'More people ({}) than cells'.format(n)
+        policy = policies_safety[self.person_C['policy_type']]
+        cells = self.rng.choice(width * height, size=n, replace=False)
+        age = self.rng.integers(self.person_C['age_range'][0], self.person_C['age_range'][1] + 1, size=n)
+        SD = self.rng.random(n) < policy['social_distance_prob']
+        WM = self.rng.random(n) < policy['wear_mask_prob']
+        altruistic = self.rng.random(n) < self.person_C['altruistic_prob']
+        infected = self.rng.random(n) < self.person_C['initial_infection_prob']
+        ids = self.population.add(cells % width, cells // width, age, SD, WM, altruistic, infected)
+        self.data_collect.increment_initial_S(int((~infected).sum()))
+        for id, cell, social_distance in zip(ids.tolist(), cells.tolist(), SD.tolist()):
+            if social_distance: self.ids_social_distance.add(id)
+            else: self.ids_not_social_distance.add(id)
+            self._add_to_cell(id, (cell % width, cell // width))
+        # Initially infected people start their infection in the first timestep
+        for id in ids[infected].tolist():
+            self._schedule_infection(id)
+        self.data_collect.update_population(self.population)
+
+    # IDs in the neighborhood around a position (side_length x side_length array, -1 if empty), one fancy index
+    def _get_neighborhood_ids(self, position, side_length):
+        xs, ys, _, _, _ = self._get_neighbor_tables(side_length)
+        return self.grid[ys[position[1]][:, None], xs[position[0]]]
+
+    # Infectious codes in the 3x3 around a position (same layout as `_get_neighborhood_ids`)
+    def _get_infectious_codes(self, position):
+        xs, ys, _, _, _ = self._get_neighbor_tables(3)
+        return self.infectious_grid[ys[position[1]][:, None], xs[position[0]]]
 
     # Yield neighbors
     # Return Neighbor (or None), neighbor_position absolute and relative
     def _yield_neighbors(self, position, side_length):
-        x, y = position[0], position[1]
-        for i in range(side_length ** 2):
-            cluster_mid = side_length // 2
-            rel_x = (i % side_length) - cluster_mid
-            rel_y = (i // side_length) - cluster_mid
-            abs_x = x + rel_x
-            abs_y = y + rel_y
-            correct_x, correct_y = self._get_cell_pos(abs_x, abs_y)
-            located_id = self.grid[correct_y, correct_x]  # Might be None if no person there
-            if located_id == None:
-                yield None, (correct_x, correct_y), (rel_x, rel_y)
+        _, _, xs, ys, rel_positions = self._get_neighbor_tables(side_length)
+        xs, ys = xs[position[0]], ys[position[1]]
+        located_ids = self._get_neighborhood_ids(position, side_length).ravel().tolist()  # -1 if no person there
+        for i, located_id in enumerate(located_ids):
+            neighbor_pos = (xs[i % side_length], ys[i // side_length])
+            if located_id < 0:
+                yield None, neighbor_pos, rel_positions[i]
             else:
-                yield self.id_person[located_id], (correct_x, correct_y), (rel_x, rel_y)
+                yield self._get_person(located_id), neighbor_pos, rel_positions[i]
 
     # This decides movement and num of infected neighbors FOR SD people
     def _check_neighbors_SD(self, id, person):
         def check_neighbors(last_position=None):
             safe_cells = {(-1, -1): None, (0, -1): None, (1, -1): None, (-1, 0): None, (1, 0): None, (-1, 1): None, (0, 1): None, (1, 1): None}
-            infected_neighbors = []
-            for neighbor, neighbor_pos, neighbor_pos_rel in self._yield_neighbors(person.position, 3):
-                if neighbor_pos == person.position:
+            position = person.position
+            for neighbor, neighbor_pos, neighbor_pos_rel in self._yield_neighbors(position, 3):
+                if neighbor_pos == position:
                     continue
                 # Get abs pos
                 safe_cells[neighbor_pos_rel] = neighbor_pos
-                # Add to infected if infectious neighbor
-                if neighbor and neighbor.is_infectious():
-                    infected_neighbors.append(neighbor)
                 # Remove from safe cell if cell contains a person or it was the last pos
                 if neighbor or last_position == neighbor_pos:
                     del safe_cells[neighbor_pos_rel]
-            return infected_neighbors, safe_cells
-        # First get number of infected around this and check if it gets infected
-        infected_neighbors, safe_cells = check_neighbors()
-        # Check if infected
-        self._check_infection(person, infected_neighbors)
+            return safe_cells
+        # First check if it gets infected
+        self._check_infection(person)
+        safe_cells = check_neighbors()
         # Then Moving
         # Move it if its own cell is not safe OR its moving intenionally
         move_length_SD = 1 if len(safe_cells) < 8 else self.person_C['move_length']  # Move only one time if just moving cuz its unsafe
-        if len(safe_cells) < 8 or np.random.random() < person.movement_prob:
+        if len(safe_cells) < 8 or self.move_draws[id] < person.movement_prob:
             for m in range(move_length_SD):
+                if self.profiler is not None: self.profiler.count('moves_attempted')
                 last_position = person.position
                 did_move = False
-                # Shuffle the safe positions and choose the first actually safe one by checking a 3x3 around it (not including the person.position)
-                for safe_cell_rel_pos in random.sample(list(safe_cells.keys()), len(list(safe_cells.keys()))):
+                # Shuffle the safe positions and choose the first actually safe one: no one in the 3x3 around it but the
+                # person (who is always in it, so a count of 1)
+                safe_cell_rel_positions = list(safe_cells.keys())
+                self.rng.shuffle(safe_cell_rel_positions)
+                for safe_cell_rel_pos in safe_cell_rel_positions:
                     safe_cell_abs_pos = safe_cells[safe_cell_rel_pos]
-                    # Check if its safe (dont check the person.position)
-                    safe = True
-                    for neighbor, neighbor_pos, _ in self._yield_neighbors(safe_cell_abs_pos, 3):
-                        if neighbor_pos == person.position:
-                            continue
-                        if neighbor:
-                            safe = False
-                            break
+                    if self.profiler is not None: self.profiler.count('safe_cell_checks')
                     # First one that is safe: move there
-                    if safe:
+                    if self.neighbor_counts[safe_cell_abs_pos[1], safe_cell_abs_pos[0]] == 1:
+                        if self.profiler is not None: self.profiler.count('moves_succeeded')
                         self._move_person(id, person, safe_cell_abs_pos)
-                        infected_neighbors, safe_cells = check_neighbors(last_position)
-                        self._check_infection(person, infected_neighbors)
+                        safe_cells = check_neighbors(last_position)
+                        self._check_infection(person)
                         did_move = True
                         break
                 # End if it did not move
@@ -208,132 +281,158 @@ class CellularAutomation:
     def _check_neighbors_not_SD(self, id, person):
         def check_neighbors(last_position=None):
             empty_spots = []
-            infected_neighbors = []
-            for neighbor, neighbor_pos, _ in self._yield_neighbors(person.position, 3):
-                if neighbor_pos == person.position:
+            position = person.position
+            for neighbor, neighbor_pos, _ in self._yield_neighbors(position, 3):
+                if neighbor_pos == position:
                     continue
-                # Add to infected if infectious neighbor
-                if neighbor and neighbor.is_infectious():
-                    infected_neighbors.append(neighbor)
                 # Add empty spot (also if not the last position the person was at if moving more than once)
                 if not neighbor and neighbor_pos != last_position:
                     empty_spots.append(neighbor_pos)
-            return infected_neighbors, empty_spots
-        # First get number of infected around this and check if it gets infected
-        infected_neighbors, empty_spots = check_neighbors()
-        # Check if infected
-        self._check_infection(person, infected_neighbors)
+            return empty_spots
+        # First check if it gets infected
+        self._check_infection(person)
+        empty_spots = check_neighbors()
         # Then Moving
-        if np.random.random() < person.movement_prob:
+        if self.move_draws[id] < person.movement_prob:
             for m in range(self.person_C['move_length']):
+                if self.profiler is not None: self.profiler.count('moves_attempted')
                 # if somewhere to move
                 if len(empty_spots) > 0:
-                    new_spot = random.choice(empty_spots)
+                    if self.profiler is not None: self.profiler.count('moves_succeeded')
+                    new_spot = self.uniforms.choice(empty_spots)
                     last_position = person.position
                     self._move_person(id, person, new_spot)
-                    infected_neighbors, empty_spots = check_neighbors(last_position)
-                    self._check_infection(person, infected_neighbors)
+                    empty_spots = check_neighbors(last_position)
+                    self._check_infection(person)
                 else:
                     break
 
-    def _check_infection(self, person, infected_neighbors):
-        newly_infected = person.gets_infected(infected_neighbors, self.disease_C['base_infection_prob'],
-                                              self.disease_C['mask_infection_prob_decrease'],
-                                              self.data_collect)
+    # Infection probability from the infectious people around a person is a lookup by their counts
+    def _check_infection(self, person):
+        if not person.susceptible:
+            return
+        x, y = person.position
+        I_prob = self.infection_probs[self.infectious_counts[0, y, x], self.infectious_counts[1, y, x]]
+        if self.profiler is not None and I_prob > 0:
+            self.profiler.count('infections_evaluated')
+        newly_infected = person.gets_infected(I_prob, self.data_collect)
         # If this person was just infected then add to the num of people infected to each neighbor for calc. Ro
         if newly_infected:
-            for person in infected_neighbors:
-                person.num_people_infected += 1
+            self.population.infection_timestep[person.id] = self.timestep
+            self._schedule_infection(person.id)
+            infectious = self._get_neighborhood_ids((x, y), 3)[self._get_infectious_codes((x, y)) != NOT_INFECTIOUS]
+            self.population.num_people_infected[infectious] += 1
+
+    # Put the next timestep where one of an infected person's stages starts in the calendar
+    def _schedule_infection(self, id):
+        step = self.population.next_stage_step(id)
+        if step is not None: self.calendar.schedule(int(self.population.infection_timestep[id]) + step, id)
 
     def _update_person(self, id):
-        person = self.id_person[id]
-        # Progress Infection (if infected)
-        dead, new_SD = person.progress_infection(self.data_collect)
-        if dead:
-            self._kill_person(id, person.social_distance)
-            return None # Continue to next person
+        person = self._get_person(id)
+        new_SD = None
+        # Progress Infection (if one of its stages starts now)
+        if self.due[id]:
+            step = self.timestep - int(self.population.infection_timestep[id])
+            dead, new_SD = person.progress_infection(self.data_collect, step)
+            if dead:
+                self._kill_person(id, person.social_distance)
+                return None # Continue to next person
+            self._schedule_infection(id)
+            # Their stage or mask might have changed
+            self._set_infectious_code(person.position, self._infectious_code(id))
+            # Susceptible neighbors of someone that just got infectious get an infection check
+            if self.active_set is not None and person.is_infectious(): self.active_set.infectious(person.position)
         # At the start figure out where the person is going to move AND the number of infected persons around them
         self._check_neighbors_SD(id, person) if person.social_distance else self._check_neighbors_not_SD(id, person)
         return new_SD
 
-    # For rendering
-    def _get_person_color(self, person):
-        if self.render_C['color_model'] == 'SIR':
-            colors = color_models['SIR']
-            if person.susceptible: return colors['susceptible']
-            if person.infected: return colors['infected']
-            return colors['recovered']
-
-    def _render(self, id, screen):
-        person = self.id_person[id]
-        shape_model = self.render_C['shape_model']
-        if shape_model == 'SD':
-            shape = shape_models[shape_model][person.social_distance]
-        else:
-            shape = shape_models[shape_model][person.wear_mask]
-        color = self._get_person_color(person)
-        cell_size = self.render_C['cell_size']
-        if shape == 'rect':
-            pygame.draw.rect(screen, color,
-                             [person.position[0] * cell_size, person.position[1] * cell_size, cell_size, cell_size])
-        else:
-            radius = cell_size // 2
-            center_x = (person.position[0] * cell_size) + radius
-            center_y = (person.position[1] * cell_size) + radius
-            pygame.draw.circle(screen, color, (center_x, center_y), radius)
-
-    def run(self, render=False):
-        if render:
-            # Initialize the game engine
-            pygame.init()
-            # Set the height and width and title of the screen
-            screen_width = self.render_C['cell_size'] * self.grid_C['width']
-            screen_height = self.render_C['cell_size'] * self.grid_C['height']
-            screen = pygame.display.set_mode((screen_width, screen_height))
-            pygame.display.set_caption("Population Dynamics")
-            clock = pygame.time.Clock()
-            # Initially set the screen to all black
-            screen.fill((0, 0, 0))
-        for t in range(self.grid_C['number_iterations']):
-            self.data_collect.reset(t)
-            def loop_through_ids(ids):
-                # Keep track of any switches between SD lists
-                new_SD_list = []
-                new_not_SD_list = []
-                # Shuffle - Random order
-                lis = list(ids)
-                random.shuffle(lis)
-                for id in lis:
-                    new_SD = self._update_person(id)
-                    # If dead then continue
-                    if id not in self.id_person: continue
-                    if new_SD is True: new_SD_list.append(id)
-                    elif new_SD is False: new_not_SD_list.append(id)
-                    # Update data collection
-                    self.data_collect.update_data(self.id_person[id])
-                    # Render
-                    if render: self._render(id, screen)
-                return new_SD_list, new_not_SD_list
-            # Update (in random order) those who do NOT practice social distancing
-            new_SD, new_not_SD_list = loop_through_ids(self.ids_not_social_distance)
-            assert len(new_not_SD_list) == 0
-            # Next update (in random order) those who DO practice social distancing, so they get to be at a safe dist.
-            # from others at the end of the iteration
-            new_SD_list, new_not_SD = loop_through_ids(self.ids_social_distance)
-            assert len(new_SD_list) == 0
-            # Switch people
-            for id in new_SD:
-                self.ids_not_social_distance.remove(id)
-                self.ids_social_distance.add(id)
-            for id in new_not_SD:
-                self.ids_social_distance.remove(id)
-                self.ids_not_social_distance.add(id)
+    # One timestep
+    def step(self):
+        due_ids = self.calendar.pop(self.timestep)
+        self.due[due_ids] = True
+
+        def loop_through_ids(ids, social_distance):
+            # Keep track of any switches between SD lists
+            new_SD_list = []
+            new_not_SD_list = []
+            # Random order, only the people that can change (or everyone if 'active_set' is off)
+            self.active_set = ActiveSet(self, ids, social_distance, skip_inactive=self.grid_C.get('active_set', True))
+            for id in self.active_set:
+                new_SD = self._update_person(id)
+                # If dead then continue
+                if not self._is_alive(id): continue
+                if new_SD is True: new_SD_list.append(id)
+                elif new_SD is False: new_not_SD_list.append(id)
+            self.active_set = None
+            return new_SD_list, new_not_SD_list
+        # Update (in random order) those who do NOT practice social distancing
+        new_SD, new_not_SD_list = loop_through_ids(self.ids_not_social_distance, False)
+        assert len(new_not_SD_list) == 0
+        # Next update (in random order) those who DO practice social distancing, so they get to be at a safe dist.
+        # from others at the end of the iteration
+        new_SD_list, new_not_SD = loop_through_ids(self.ids_social_distance, True)
+        assert len(new_SD_list) == 0
+        # Switch people
+        for id in new_SD:
+            self.ids_not_social_distance.remove(id)
+            self.ids_social_distance.add(id)
+        for id in new_not_SD:
+            self.ids_social_distance.remove(id)
+            self.ids_not_social_distance.add(id)
+        self.due[due_ids] = False
+        # Update data collection (everyone at once)
+        self.data_collect.update_population(self.population)
+
+    # profiler: optional `Profiler` (see `profiler.py`) to time the phases of every timestep
+    # frames: optional `FrameExporter` (see `frame_export.py`) that gets a frame after every step (no display needed)
+    def run(self, render=False, profiler=None, frames=None):
+        if profiler is not None: profiler.attach(self)
+        # Detached even if the run fails, o.w. the profiler's wrappers stay on (and `Person.progress_infection` stays
+        # patched for every later simulation)
+        try:
+            # Rendering (and pygame) is only loaded if needed, the whole frame is drawn from the population after each
+            # step
             if render:
-                pygame.display.flip()
-                screen.fill((0, 0, 0))
-                # Frames per second
-                if self.render_C['fps']: clock.tick(self.render_C['fps'])
-        self.data_collect.reset(t+1, last=True)
+                from render import Renderer
+                renderer = Renderer(self.render_C, self.grid_C['width'], self.grid_C['height'])
+                if profiler is not None: renderer.draw = profiler.wrap('render', renderer.draw)
+            if frames is not None and profiler is not None: frames.draw = profiler.wrap('render', frames.draw)
+            while self.timestep < self.grid_C['number_iterations']:
+                self.advance(1)
+                if render: renderer.draw(self.population)
+                if frames is not None: frames.draw(self.population)
+            self.data_collect.reset(self.timestep, last=True)
+            if frames is not None: frames.close()
+        finally:
+            if profiler is not None: profiler.detach()
+
+    # Run some timesteps without finishing the run (eg. a warm-up to checkpoint, see `checkpoint.py`)
+    def advance(self, num_timesteps):
+        for t in range(self.timestep, self.timestep + num_timesteps):
+            self.data_collect.reset(t)
+            self.step()
+            self.timestep = t + 1
+
+
+# Class of an engine by its name ('object', 'vectorized', 'tiled' or 'jit', the `engine` grid constant)
+def engine_class(engine):
+    if engine == 'vectorized':
+        from vectorized import VectorizedCellularAutomation
+        return VectorizedCellularAutomation
+    if engine == 'tiled':
+        from tiled import TiledCellularAutomation
+        return TiledCellularAutomation
+    if engine == 'jit':
+        from kernels import JitCellularAutomation
+        return JitCellularAutomation
+    assert engine == 'object', '{} is not a valid engine'.format(engine)
+    return CellularAutomation
+
+
+# Create the simulation with the engine chosen in the constants
+def create_automation(constants, data_collect):
+    return engine_class(constants['grid'].get('engine', 'object'))(constants, data_collect)
 
 
 if __name__ == '__main__':
@@ -342,6 +441,6 @@ if __name__ == '__main__':
     data_collect = DataCollector(constants, save_experiment=True, print_visualizations=True)
     # Can print data (look at `data_options` at top of `data_collector.py` for options) and how often to print
     data_collect.set_print_options(basic_to_print=['S', 'I', 'R', 'death'], frequency=1)
-    CA = CellularAutomation(constants, data_collect)
+    CA = create_automation(constants, data_collect)
     # Can render each timestep with pygame
     CA.run(render=True)
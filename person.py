@@ -1,4 +1,7 @@
-import numpy as np
+from population import ALIVE, SUSCEPTIBLE, INFECTED, RECOVERED, SOCIAL_DISTANCE, SOCIAL_DISTANCE_BEFORE_SYMPTOMS, \
+    WEAR_MASK, WEAR_MASK_BEFORE_SYMPTOMS, ALTRUISTIC, infection_stages, symptom_stages, LATENT, INFECTIOUS, \
+    RECOVER, INCUBATION, MILD, SEVERE, DEATH, NO_STAGE, NORMAL_MOVEMENT, LOW_MOVEMENT, NO_MOVEMENT, DAYS_SD, \
+    DAYS_NOT_SD, DAYS_WM, DAYS_NOT_WM
 
 '''
 Notes:
@@ -9,183 +12,176 @@ Notes:
     - It also says whether someone will intentionally move at a low rate
 - People who experience severe symptoms will automatically wear masks and social distance and no longer intentionally move
   but just move defensively
+- A person is a view of one id in a `Population` (see `population.py`) which stores everything in arrays, this class
+  just gives the same attributes and per-person logic as before
 '''
 class Person:
-    def __init__(self, position, age, social_distance, wear_mask, movement_prob, low_movement_prob, altruistic_prob, infected,
-                 total_length_infection, incubation_period_duration_range, infectious_start_before_symptoms_range,
-                 infectious_period_duration_range, severe_symptoms_start_range, fatality_occur_range,
-                 asymptomatic_prob, severe_prob, fatality_prob):
-        self.set_position(position)
-        self.age = age
-        self.social_distance = social_distance
-        self.social_distance_before_symptoms = social_distance
-        self.wear_mask = wear_mask
-        self.wear_mask_before_symptoms = wear_mask
-        self.movement_prob = movement_prob
-        self.low_movement_prob = low_movement_prob
-        self.movement_prob_before_symptoms = movement_prob
-        self.altruistic = np.random.random() < altruistic_prob
-
-        self.susceptible = not infected
-        self.infected = infected
-        # Most literature says that prob. of reinfection is very low of nonexistent at least in a short period of time
-        # But scientists are still not sure
-        self.recovered = False
-        self.infection_step = -1
-        # Keeps track of num of people that this person has infected (or contributed to the infection of)
-        self.num_people_infected = 0
-        # Also for R0 keep track of number of days during infectious phase they were SD and WM
-        self.infectious_days_info = {'SD': 0, 'not SD': 0, 'WM': 0, 'not WM': 0}
-
-        # CREATE INFECTION PERIODS -----
-        incubation_period_duration = np.random.randint(incubation_period_duration_range[0],
-                                                       incubation_period_duration_range[1] + 1)
-        infectious_start_before_symptoms = np.random.randint(infectious_start_before_symptoms_range[0],
-                                                             infectious_start_before_symptoms_range[1] + 1)
-        infectious_period_duration = np.random.randint(infectious_period_duration_range[0],
-                                                       infectious_period_duration_range[1] + 1)
-        severe_symptoms_start = np.random.randint(severe_symptoms_start_range[0], severe_symptoms_start_range[1] + 1)
-        fatality_occur = np.random.randint(fatality_occur_range[0], fatality_occur_range[1] + 1)
-
-        # Create Infection periods
-        infectious_period_start = incubation_period_duration - infectious_start_before_symptoms
-        assert infectious_period_start >= 1, \
-            '{} is wrong: infectious period start should be greater than 0 because latent period is at least one day'.format(
-                infectious_period_start)
-        removed_period_start = infectious_period_duration + infectious_period_start
-        assert removed_period_start < total_length_infection, \
-            '{} is wrong: removal should be less than the total length of infection'.format(removed_period_start)
-        # total_length = total_length_infection if removed_period_start < total_length_infection else removed_period_start + 1
-        total_length = total_length_infection
-        self.infectious_periods = [('latent', 0),
-                                   ('infectious', infectious_period_start),
-                                   ('remove', removed_period_start),
-                                   ('recover', total_length)]
-
-        # Symptoms is more complicated
-        self.symptoms_periods = [('incubation', 0)]
-        symptoms_start = incubation_period_duration
-        assert symptoms_start > infectious_period_start, \
-            'Symptoms ({}) start during infectious stage (starts {})'.format(symptoms_start, infectious_period_start)
-        assert symptoms_start < removed_period_start, \
-            'Symptoms ({}) start during infectious stage (starts {})'.format(symptoms_start, infectious_period_start)
-        # 1) Some people are asymptomatic (and have no mild or severe symptoms, and also cant die)
-        if np.random.random() < asymptomatic_prob:
-            self.symptoms_periods.append(('asymptomatic', symptoms_start))
-        # 2) If they arent asymptomatic they start with mild
-        else:
-            self.symptoms_periods.append(('mild', symptoms_start))
-            # 3) Can have severe (or not)
-            if np.random.random() < severe_prob:
-                severe_start_abs = severe_symptoms_start + symptoms_start
-                assert severe_start_abs <= total_length, \
-                    'severe symptoms should start ({}) before end of infection'.format(severe_start_abs)
-                self.symptoms_periods.append(('severe', severe_start_abs))
-                # 4) Can die (or not)
-                if np.random.random() < fatality_prob:
-                    fatality_start_abs = fatality_occur + severe_symptoms_start + symptoms_start
-                    assert fatality_start_abs <= total_length, \
-                        'fatality should occur ({}) before end of infection'.format(fatality_start_abs)
-                    self.symptoms_periods.append(('death', fatality_start_abs))
-        # 5) If didnt die then recover
-        if self.symptoms_periods[-1][0] != 'death':
-            self.symptoms_periods.append(('recover', total_length))
-        # Make sure the symptoms periods is one of 4 diff combinations
-        possible_permutations = [['incubation', 'asymptomatic', 'recover'],
-                                 ['incubation', 'mild', 'recover'],
-                                 ['incubation', 'mild', 'severe', 'death'],
-                                 ['incubation', 'mild', 'severe', 'recover']]
-        assert [item[0] for item in self.symptoms_periods] in possible_permutations, \
-            '{} not a possible symptoms stages permutation'.format(possible_permutations)
-
-        self.current_symptom_stage = None
-        self.current_infection_stage = None
+    __slots__ = ('population', 'id')
+
+    def __init__(self, population, id):
+        self.population = population
+        self.id = id
+
+    def _flag(self, flag):
+        return bool(self.population.flags[self.id] & flag)
+
+    def _set_flag(self, flag, value):
+        self.population.set_flag(flag, self.id, value)
+
+    @property
+    def position(self):
+        return int(self.population.x[self.id]), int(self.population.y[self.id])
 
     def set_position(self, position):
-        self.position = position
+        self.population.x[self.id] = position[0]
+        self.population.y[self.id] = position[1]
+
+    @property
+    def age(self):
+        return int(self.population.age[self.id])
+
+    @property
+    def alive(self):
+        return self._flag(ALIVE)
+
+    @property
+    def susceptible(self):
+        return self._flag(SUSCEPTIBLE)
+
+    @property
+    def infected(self):
+        return self._flag(INFECTED)
+
+    # Most literature says that prob. of reinfection is very low of nonexistent at least in a short period of time
+    # But scientists are still not sure
+    @property
+    def recovered(self):
+        return self._flag(RECOVERED)
+
+    @property
+    def social_distance(self):
+        return self._flag(SOCIAL_DISTANCE)
+
+    @property
+    def wear_mask(self):
+        return self._flag(WEAR_MASK)
+
+    @property
+    def altruistic(self):
+        return self._flag(ALTRUISTIC)
+
+    @property
+    def movement_prob(self):
+        return float(self.population.movement_probs[self.population.movement[self.id]])
+
+    @property
+    def infection_step(self):
+        return int(self.population.infection_step[self.id])
+
+    # Keeps track of num of people that this person has infected (or contributed to the infection of)
+    @property
+    def num_people_infected(self):
+        return int(self.population.num_people_infected[self.id])
+
+    @num_people_infected.setter
+    def num_people_infected(self, value):
+        self.population.num_people_infected[self.id] = value
+
+    # Also for R0 keep track of number of days during infectious phase they were SD and WM
+    @property
+    def infectious_days_info(self):
+        return self.population.infectious_days_info(self.id)
+
+    @property
+    def current_infection_stage(self):
+        stage = self.population.infection_stage[self.id]
+        return None if stage == NO_STAGE else infection_stages[stage]
+
+    @property
+    def current_symptom_stage(self):
+        stage = self.population.symptom_stage[self.id]
+        return None if stage == NO_STAGE else symptom_stages[stage]
 
     # Not just infected but infectious
     def is_infectious(self):
-        return self.current_infection_stage == 'infectious'
+        return self.population.infection_stage[self.id] == INFECTIOUS
 
-    # Progress the infection of an infected person in both infectiousness and symptoms
-    def progress_infection(self, data_collector):
+    # Progress the infection of an infected person in both infectiousness and symptoms to an infection step, only called
+    # at the steps where a stage starts (see `event_calendar.py`)
+    def progress_infection(self, data_collector, step):
         if not self.infected:
             return False, None
-        if self.is_infectious():
-            if self.social_distance: self.infectious_days_info['SD'] += 1
-            else: self.infectious_days_info['not SD'] += 1
-            if self.wear_mask: self.infectious_days_info['WM'] += 1
-            else: self.infectious_days_info['not WM'] += 1
-        self.infection_step += 1
+        pop, id = self.population, self.id
+        social_distance, wear_mask = self.social_distance, self.wear_mask
+        # Infectious days since the last update (SD and WM only change when a stage starts)
+        days = pop.infectious_days_between(id, pop.infection_step[id], step)
+        if days > 0:
+            pop.infectious_days[id, DAYS_SD if social_distance else DAYS_NOT_SD] += days
+            pop.infectious_days[id, DAYS_WM if wear_mask else DAYS_NOT_WM] += days
+        pop.infection_step[id] = step
         new_infection_stage = False
         new_symptoms_stage = False
-        # If gets to new stage then pop off first
-        if self.infection_step == self.infectious_periods[0][1]:
-            self.current_infection_stage = self.infectious_periods[0][0]
-            self.infectious_periods.pop(0)
+        # If gets to the start of the next stage then move on to it
+        next_stage = pop.infection_stage[id] + 1
+        if next_stage < len(infection_stages) and step == pop.infection_stage_day(id, next_stage):
+            pop.infection_stage[id] = next_stage
             new_infection_stage = True
 
-        if self.infection_step == self.symptoms_periods[0][1]:
-            self.current_symptom_stage = self.symptoms_periods[0][0]
-            self.symptoms_periods.pop(0)
+        next_symptom_stage, next_symptom_day = pop.next_symptom_stage(id)
+        if next_symptom_stage is not None and step == next_symptom_day:
+            pop.symptom_stage[id] = next_symptom_stage
             new_symptoms_stage = True
 
         # If dead then return true
-        if self.current_symptom_stage == 'death':
+        symptom_stage = pop.symptom_stage[id]
+        if symptom_stage == DEATH:
             return True, None
 
         new_SD = None
         # If mild symptoms check altruistic prob to see what happens
-        if self.current_symptom_stage == 'mild' and self.altruistic and new_symptoms_stage:
-            self.movement_prob = self.low_movement_prob
-            self.wear_mask = True
-            new_SD = True if not self.social_distance else None
-            self.social_distance = True
-        elif self.current_symptom_stage == 'severe' and new_symptoms_stage:
+        if symptom_stage == MILD and self.altruistic and new_symptoms_stage:
+            pop.movement[id] = LOW_MOVEMENT
+            self._set_flag(WEAR_MASK, True)
+            new_SD = True if not social_distance else None
+            self._set_flag(SOCIAL_DISTANCE, True)
+        elif symptom_stage == SEVERE and new_symptoms_stage:
             # Severe means SD and WM and NO non-defensive movement
             # todo: Might turn off ALL movement at this stage
-            self.movement_prob = 0.
-            self.wear_mask = True
-            new_SD = True if not self.social_distance else None
-            self.social_distance = True
+            pop.movement[id] = NO_MOVEMENT
+            self._set_flag(WEAR_MASK, True)
+            new_SD = True if not social_distance else None
+            self._set_flag(SOCIAL_DISTANCE, True)
 
         # If not dead and end of infection then recovered
-        if self.current_infection_stage == 'recover' and new_infection_stage:
-            self.recovered = True
-            self.infected = False
-            self.susceptible = False
-            self.wear_mask = self.wear_mask_before_symptoms
-            new_SD = self.social_distance_before_symptoms if self.social_distance != self.social_distance_before_symptoms else None
-            self.social_distance = self.social_distance_before_symptoms
-            self.movement_prob = self.movement_prob_before_symptoms
-            self.current_symptom_stage = None
+        if pop.infection_stage[id] == RECOVER and new_infection_stage:
+            self._set_flag(RECOVERED, True)
+            self._set_flag(INFECTED, False)
+            self._set_flag(SUSCEPTIBLE, False)
+            self._set_flag(WEAR_MASK, self._flag(WEAR_MASK_BEFORE_SYMPTOMS))
+            social_distance_before_symptoms = self._flag(SOCIAL_DISTANCE_BEFORE_SYMPTOMS)
+            new_SD = social_distance_before_symptoms if self.social_distance != social_distance_before_symptoms else None
+            self._set_flag(SOCIAL_DISTANCE, social_distance_before_symptoms)
+            pop.movement[id] = NORMAL_MOVEMENT
+            pop.symptom_stage[id] = NO_STAGE
             data_collector.add_lifetime_infected(self.num_people_infected, self.infectious_days_info)
 
         return False, new_SD
 
-    # Check if person is infected given the number of infected (and in infectious phase) people
-    # in its immediate neighborhood
-    def gets_infected(self, infectious_neighbors, base_infection_prob, mask_infection_prob_decrease, data_collector):
+    # Check if person is infected given the infection probability from the infectious people in its immediate
+    # neighborhood (looked up in `infection_prob_table` by how many of them wear a mask, see `population.py`)
+    def gets_infected(self, I_prob, data_collector):
         # Skip if already infected or recovered
-        if self.infected or self.recovered or len(infectious_neighbors) == 0:
+        if self.infected or self.recovered or I_prob == 0:
             return False
-        # Use Kermack-McKendrick Model of infection probability
-        # 1 - (1 - p) ^ r; p -> infection prob of one person; r -> number of infectious people
-        # If an infectious person is wearing a mask then the probability of infecting this susceptible person goes down
-        p = [base_infection_prob + (-1. * (neighbor.wear_mask * mask_infection_prob_decrease)) for neighbor in infectious_neighbors]
-        p = sum(p) / len(p)
-        r = len(infectious_neighbors)
-        I_prob = 1 - (1 - p) ** r
-
-        if np.random.random() < I_prob:
-            self.infected = True
-            self.susceptible = False
-            self.current_symptom_stage = self.symptoms_periods[0][0]
-            self.current_infection_stage = self.infectious_periods[0][0]
-            self.infectious_periods.pop(0)
-            self.symptoms_periods.pop(0)
-            self.infection_step = 0
+
+        if self.population.uniforms.random() < I_prob:
+            pop, id = self.population, self.id
+            self._set_flag(INFECTED, True)
+            self._set_flag(SUSCEPTIBLE, False)
+            pop.symptom_stage[id] = INCUBATION
+            pop.infection_stage[id] = LATENT
+            pop.infection_step[id] = 0
+            pop.assign_course(id)
             data_collector.increment_total_infected()
             return True
         return False
@@ -0,0 +1,256 @@
+import numpy as np
+from rng import UniformBuffer
+
+'''
+Notes:
+- Stores every person as one entry in typed numpy arrays (struct-of-arrays) instead of one `Person` object each
+    - Booleans are bit-packed into `flags` (see flag bits below)
+    - Infection and symptom stages are int8 codes and the days they start are int16 infection steps
+- `Person` in `person.py` is a thin view of one entry, so per-person code (data collection, rendering) still works
+- Ids are indices into the arrays and never get reused (dead people just lose their ALIVE flag)
+- Disease courses (when each stage starts, asymptomatic, severe, death) are only given to people when they get infected
+  (or are initially infected), as a random row of a table of course templates sampled once at the start
+  (`course_templates` in the disease constants), so creating people doesn't sample anything for the majority that
+  never get infected
+'''
+
+# Flag bits
+ALIVE, SUSCEPTIBLE, INFECTED, RECOVERED, SOCIAL_DISTANCE, SOCIAL_DISTANCE_BEFORE_SYMPTOMS, WEAR_MASK, \
+    WEAR_MASK_BEFORE_SYMPTOMS, ALTRUISTIC, ASYMPTOMATIC = [np.uint16(1 << i) for i in range(10)]
+
+# Stage codes (-1 means no stage, ie not infected)
+infection_stages = ['latent', 'infectious', 'remove', 'recover']
+symptom_stages = ['incubation', 'asymptomatic', 'mild', 'severe', 'death', 'recover']
+LATENT, INFECTIOUS, REMOVE, RECOVER = range(len(infection_stages))
+INCUBATION, ASYMPTOMATIC_STAGE, MILD, SEVERE, DEATH, RECOVER_SYMPTOMS = range(len(symptom_stages))
+NO_STAGE = -1
+
+# Movement codes (index into `Population.movement_probs`): normal, altruistic with symptoms, severe symptoms
+NORMAL_MOVEMENT, LOW_MOVEMENT, NO_MOVEMENT = 0, 1, 2
+
+# Infectious days columns (for R0)
+DAYS_SD, DAYS_NOT_SD, DAYS_WM, DAYS_NOT_WM = range(4)
+
+# Infectious code of a cell: no infectious person, infectious person w/o mask, infectious person with mask
+NOT_INFECTIOUS, INFECTIOUS_NO_MASK, INFECTIOUS_MASK = 0, 1, 2
+# Most infectious neighbors someone can have
+MAX_NEIGHBORS = 8
+
+# Course template columns
+COURSE_INFECTIOUS_START, COURSE_REMOVE_START, COURSE_SYMPTOMS_START, COURSE_SEVERE_START, COURSE_DEATH_START, \
+    COURSE_ASYMPTOMATIC = range(6)
+DEFAULT_COURSE_TEMPLATES = 4096
+
+
+# Infection probability of a susceptible person by the number of infectious neighbors without and with a mask
+# Kermack-McKendrick Model of infection probability: 1 - (1 - p) ^ r; p -> avg infection prob of one person (lower if
+# they wear a mask); r -> number of infectious people
+def infection_prob_table(base_infection_prob, mask_infection_prob_decrease):
+    table = np.zeros((MAX_NEIGHBORS + 1, MAX_NEIGHBORS + 1))
+    for no_mask in range(MAX_NEIGHBORS + 1):
+        for mask in range(1 if no_mask == 0 else 0, MAX_NEIGHBORS + 1 - no_mask):
+            r = no_mask + mask
+            p = (no_mask * base_infection_prob + mask * (base_infection_prob - mask_infection_prob_decrease)) / r
+            table[no_mask, mask] = 1 - (1 - p) ** r
+    return table
+
+
+class Population:
+    # Every array (eg. to save and load them, see `checkpoint.py`)
+    array_names = ['x', 'y', 'flags', 'age', 'movement', 'infection_step', 'infection_timestep', 'infection_stage',
+                   'symptom_stage',
+                   'infectious_start', 'remove_start', 'symptoms_start', 'severe_start', 'death_start',
+                   'num_people_infected', 'infectious_days', 'course_templates']
+
+    def __init__(self, capacity, person_C, disease_C, rng):
+        self.person_C = person_C
+        self.disease_C = disease_C
+        # Random generator of the simulation (see `rng.py`) and a buffer of its uniforms for single draws
+        self.rng = rng
+        self.uniforms = UniformBuffer(rng)
+        self.capacity = capacity
+        self.size = 0
+        self.total_length = disease_C['total_length_infection']
+        self.movement_probs = np.array([person_C['movement_prob'], person_C['altruistic_movement_prob'], 0.],
+                                       dtype=np.float32)
+        self.x = np.zeros(capacity, dtype=np.int32)
+        self.y = np.zeros(capacity, dtype=np.int32)
+        self.flags = np.zeros(capacity, dtype=np.uint16)
+        self.age = np.zeros(capacity, dtype=np.int8)
+        self.movement = np.zeros(capacity, dtype=np.int8)
+        self.infection_step = np.full(capacity, -1, dtype=np.int16)
+        # Timestep of infection step 0 (object engine: `infection_step` is only updated when a stage starts, see
+        # `event_calendar.py`)
+        self.infection_timestep = np.zeros(capacity, dtype=np.int32)
+        self.infection_stage = np.full(capacity, NO_STAGE, dtype=np.int8)
+        self.symptom_stage = np.full(capacity, NO_STAGE, dtype=np.int8)
+        # Infection steps where each stage starts (-1 if it never happens)
+        self.infectious_start = np.zeros(capacity, dtype=np.int16)
+        self.remove_start = np.zeros(capacity, dtype=np.int16)
+        self.symptoms_start = np.zeros(capacity, dtype=np.int16)
+        self.severe_start = np.full(capacity, -1, dtype=np.int16)
+        self.death_start = np.full(capacity, -1, dtype=np.int16)
+        # Keeps track of num of people that this person has infected (or contributed to the infection of)
+        self.num_people_infected = np.zeros(capacity, dtype=np.int32)
+        # Also for R0 keep track of number of days during infectious phase they were SD and WM (see columns above)
+        self.infectious_days = np.zeros((capacity, 4), dtype=np.int16)
+        # Disease courses given to newly infected people (see course template columns above)
+        self.course_templates = self._sample_courses(disease_C.get('course_templates', DEFAULT_COURSE_TEMPLATES))
+
+    # Add people (all arguments are arrays of the same length), returns their ids
+    def add(self, x, y, age, social_distance, wear_mask, altruistic, infected):
+        n = len(x)
+        assert self.size + n <= self.capacity, 'Population is full ({} people)'.format(self.capacity)
+        ids = np.arange(self.size, self.size + n)
+        self.x[ids] = x
+        self.y[ids] = y
+        self.age[ids] = age
+        infected = np.asarray(infected, dtype=bool)
+        self.flags[ids] = ALIVE
+        self.set_flag(SUSCEPTIBLE, ids, ~infected)
+        self.set_flag(INFECTED, ids, infected)
+        self.set_flag(SOCIAL_DISTANCE, ids, social_distance)
+        self.set_flag(SOCIAL_DISTANCE_BEFORE_SYMPTOMS, ids, social_distance)
+        self.set_flag(WEAR_MASK, ids, wear_mask)
+        self.set_flag(WEAR_MASK_BEFORE_SYMPTOMS, ids, wear_mask)
+        self.set_flag(ALTRUISTIC, ids, altruistic)
+        self.size += n
+        self.assign_courses(ids[infected])
+        return ids
+
+    # Sample n disease courses (same sampling and checks that used to be in `Person.__init__`), shape (n, 6)
+    # C: disease constants to sample with (the population's if None)
+    def _sample_courses(self, n, C=None):
+        C = self.disease_C if C is None else C
+
+        def randint(rng):
+            return self.rng.integers(rng[0], rng[1] + 1, size=n)
+
+        incubation_period_duration = randint(C['incubation_period_duration_range'])
+        infectious_start_before_symptoms = randint(C['infectious_start_before_symptoms_range'])
+        infectious_period_duration = randint(C['infectious_period_duration_range'])
+        severe_symptoms_start = randint(C['severe_symptoms_start_range'])
+        fatality_occur = randint(C['death_occurrence_range'])
+
+        infectious_period_start = incubation_period_duration - infectious_start_before_symptoms
+        assert np.all(infectious_period_start >= 1), \
+            'infectious period start should be greater than 0 because latent period is at least one day'
+        removed_period_start = infectious_period_duration + infectious_period_start
+        assert np.all(removed_period_start < self.total_length), \
+            'removal should be less than the total length of infection'
+        symptoms_start = incubation_period_duration
+        assert np.all(symptoms_start > infectious_period_start), 'Symptoms start before the infectious stage'
+        assert np.all(symptoms_start < removed_period_start), 'Symptoms start after the infectious stage'
+        # 1) Some people are asymptomatic (and have no mild or severe symptoms, and also cant die)
+        asymptomatic = self.rng.random(n) < C['asymptomatic_prob']
+        # 2) If they arent asymptomatic they start with mild, 3) can have severe (or not), 4) can die (or not)
+        severe = ~asymptomatic & (self.rng.random(n) < C['severity_prob'])
+        death = severe & (self.rng.random(n) < C['death_prob'])
+        severe_start = np.where(severe, severe_symptoms_start + symptoms_start, -1)
+        assert np.all(severe_start <= self.total_length), 'severe symptoms should start before end of infection'
+        death_start = np.where(death, fatality_occur + severe_start, -1)
+        assert np.all(death_start <= self.total_length), 'fatality should occur before end of infection'
+
+        return np.stack([infectious_period_start, removed_period_start, symptoms_start, severe_start, death_start,
+                         asymptomatic], axis=1).astype(np.int16)
+
+    # Give people that just got infected a disease course, `templates` are the rows of the course templates to use
+    # (random ones if None)
+    def assign_courses(self, ids, templates=None):
+        if templates is None:
+            templates = self.rng.integers(len(self.course_templates), size=len(ids))
+        courses = self.course_templates[templates]
+        self.infectious_start[ids] = courses[:, COURSE_INFECTIOUS_START]
+        self.remove_start[ids] = courses[:, COURSE_REMOVE_START]
+        self.symptoms_start[ids] = courses[:, COURSE_SYMPTOMS_START]
+        self.severe_start[ids] = courses[:, COURSE_SEVERE_START]
+        self.death_start[ids] = courses[:, COURSE_DEATH_START]
+        self.set_flag(ASYMPTOMATIC, ids, courses[:, COURSE_ASYMPTOMATIC] != 0)
+
+    # Same for one person (object engine), the template is drawn from the buffered uniforms
+    def assign_course(self, id):
+        course = self.course_templates[self.uniforms.randrange(len(self.course_templates))]
+        self.infectious_start[id] = course[COURSE_INFECTIOUS_START]
+        self.remove_start[id] = course[COURSE_REMOVE_START]
+        self.symptoms_start[id] = course[COURSE_SYMPTOMS_START]
+        self.severe_start[id] = course[COURSE_SEVERE_START]
+        self.death_start[id] = course[COURSE_DEATH_START]
+        self.set_flag(ASYMPTOMATIC, id, bool(course[COURSE_ASYMPTOMATIC]))
+
+    # Flags ------
+    # Works with a single id (returns a bool) or an array of ids (returns a bool array), all people if no ids
+    def has(self, flag, ids=None):
+        if ids is None:
+            return (self.flags[:self.size] & flag) != 0
+        return (self.flags[ids] & flag) != 0
+
+    def set_flag(self, flag, ids, value=True):
+        flags = self.flags[ids]
+        self.flags[ids] = np.where(value, flags | flag, flags & ~flag)
+
+    def alive_ids(self):
+        return np.flatnonzero(self.has(ALIVE))
+
+    def kill(self, ids):
+        self.set_flag(ALIVE, ids, False)
+
+    def movement_prob(self, ids):
+        return self.movement_probs[self.movement[ids]]
+
+    # Stages ------
+    # Infection step where a person starts the given infection stage
+    def infection_stage_day(self, id, stage):
+        if stage == LATENT:
+            return 0
+        if stage == INFECTIOUS:
+            return self.infectious_start[id]
+        if stage == REMOVE:
+            return self.remove_start[id]
+        return self.total_length
+
+    # Next infection step after the current one where a stage of a person starts (None if there are no more)
+    def next_stage_step(self, id):
+        step = self.infection_step[id]
+        later = [s for s in (0, self.infectious_start[id], self.remove_start[id], self.symptoms_start[id],
+                             self.severe_start[id], self.death_start[id], self.total_length) if s > step]
+        return int(min(later)) if later else None
+
+    # Number of days a person was infectious after infection step `start` up to `end` (a day is counted at the step
+    # after it, like in `Person.progress_infection`)
+    def infectious_days_between(self, id, start, end):
+        return max(0, min(end, self.remove_start[id]) - max(start, self.infectious_start[id]))
+
+    # Next symptom stage of a person and the infection step it starts (None if there is no next stage)
+    def next_symptom_stage(self, id):
+        stage = self.symptom_stage[id]
+        if stage == NO_STAGE:
+            return INCUBATION, 0
+        if stage == INCUBATION:
+            return (ASYMPTOMATIC_STAGE if self.has(ASYMPTOMATIC, id) else MILD), self.symptoms_start[id]
+        if stage == MILD and self.severe_start[id] >= 0:
+            return SEVERE, self.severe_start[id]
+        if stage == SEVERE and self.death_start[id] >= 0:
+            return DEATH, self.death_start[id]
+        if stage in (ASYMPTOMATIC_STAGE, MILD, SEVERE):
+            return RECOVER_SYMPTOMS, self.total_length
+        return None, None
+
+    # Infection and symptom stages of many people at the given infection steps (stages are fully decided by the step)
+    def stages_at(self, ids, steps):
+        infection_stage = np.full(len(ids), LATENT, dtype=np.int8)
+        infection_stage[steps >= self.infectious_start[ids]] = INFECTIOUS
+        infection_stage[steps >= self.remove_start[ids]] = REMOVE
+        infection_stage[steps >= self.total_length] = RECOVER
+        symptom_stage = np.full(len(ids), INCUBATION, dtype=np.int8)
+        symptoms = steps >= self.symptoms_start[ids]
+        symptom_stage[symptoms] = np.where(self.has(ASYMPTOMATIC, ids[symptoms]), ASYMPTOMATIC_STAGE, MILD)
+        severe_start, death_start = self.severe_start[ids], self.death_start[ids]
+        symptom_stage[(severe_start >= 0) & (steps >= severe_start)] = SEVERE
+        symptom_stage[(death_start >= 0) & (steps >= death_start)] = DEATH
+        symptom_stage[(symptom_stage != DEATH) & (steps >= self.total_length)] = RECOVER_SYMPTOMS
+        return infection_stage, symptom_stage
+
+    def infectious_days_info(self, id):
+        days = self.infectious_days[id]
+        return {'SD': int(days[DAYS_SD]), 'not SD': int(days[DAYS_NOT_SD]), 'WM': int(days[DAYS_WM]),
+                'not WM': int(days[DAYS_NOT_WM])}
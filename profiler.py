@@ -0,0 +1,158 @@
+import time
+import json
+import sys
+import resource
+from person import Person
+
+'''
+Notes:
+- Opt-in profiling of a run: `CA.run(profiler=Profiler())`, nothing is timed or counted if no profiler is given
+- Records per timestep (same rows as the data collector's data, ie row 0 is the initial data):
+    - Wall time of each phase (self time, so nested phases aren't counted twice): infection progression, neighbor
+      scanning, infection, movement, data collection, render and other (the rest of a step)
+    - Counters: moves attempted and succeeded, safe cell checks (SD people), infections evaluated and deaths
+    - RSS (MB) at the end of the timestep
+- Phases are timed by wrapping the engine's methods while attached, counters are counted by the engines themselves
+  (only if `profiler` is set)
+- Exports:
+    - As columns of `basic_data.csv` when the experiment is saved (and a `trace.json` next to it)
+    - As a Chrome trace (open in chrome://tracing or Perfetto): calls up to `trace_depth` deep are events, and every
+      phase and counter is a counter track
+'''
+
+# Phase of each timed method of each engine
+engine_phases = {
+    'object': {'step': 'other', '_check_neighbors_SD': 'neighbor_scanning', '_check_neighbors_not_SD': 'neighbor_scanning',
+               '_get_neighborhood_ids': 'neighbor_scanning', '_check_infection': 'infection', '_move_person': 'movement',
+               '_update_neighbor_counts': 'movement', '_set_infectious_code': 'movement', '_kill_person': 'infection_progression'},
+    'vectorized': {'step': 'other', '_update_phase': 'other', '_progress_infection': 'infection_progression',
+                   '_refresh_infectious_grid': 'neighbor_scanning', '_neighborhood_count': 'neighbor_scanning',
+                   '_check_infection': 'infection', '_movement': 'movement', '_resolve_conflicts': 'movement',
+                   '_move_people': 'movement', '_check_layer_infection': 'infection'},
+    'jit': {'step': 'other', '_update_phase': 'movement', '_progress_infection': 'infection_progression',
+            '_refresh_infectious_grid': 'neighbor_scanning', '_check_layer_infection': 'infection'}}
+data_collector_phases = {'update_population': 'data_collection', 'reset': 'data_collection'}
+phases = ['infection_progression', 'neighbor_scanning', 'infection', 'movement', 'data_collection', 'render', 'other']
+counters = ['moves_attempted', 'moves_succeeded', 'safe_cell_checks', 'infections_evaluated', 'deaths']
+
+
+# Current RSS in MB (peak RSS if the current one isn't available)
+def get_rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize() / 1024. ** 2
+    except (IOError, OSError):
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss / (1024. ** 2 if sys.platform == 'darwin' else 1024.)
+
+
+class Profiler:
+    def __init__(self, memory=True, trace_depth=1):
+        self.memory = memory
+        self.trace_depth = trace_depth
+        self.CA = None
+        self.data_collect = None
+        # One {column: value} per timestep
+        self.rows = []
+        # Time of the children of each running timed call (for self time)
+        self.stack = []
+        self.trace_events = []
+        self.start_time = time.perf_counter()
+        self.wrapped = []
+        self.progress_infection = None
+
+    def _row(self):
+        row_index = self.data_collect.num_timesteps if self.data_collect is not None else 0
+        while len(self.rows) <= row_index:
+            self.rows.append({})
+        return self.rows[row_index]
+
+    def count(self, name, amount=1):
+        row = self._row()
+        row[name] = row.get(name, 0) + amount
+
+    # Time every call of a function as a phase
+    def wrap(self, phase, function, name=None):
+        name = name or getattr(function, '__name__', phase)
+
+        def timed(*args, **kwargs):
+            row = self._row()
+            self.stack.append(0.)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                children = self.stack.pop()
+                row[phase] = row.get(phase, 0.) + elapsed - children
+                if self.stack: self.stack[-1] += elapsed
+                if len(self.stack) < self.trace_depth:
+                    self.trace_events.append({'name': name, 'cat': phase, 'ph': 'X', 'pid': 0, 'tid': 0,
+                                              'ts': (start - self.start_time) * 1e6, 'dur': elapsed * 1e6})
+        return timed
+
+    def _wrap_methods(self, obj, method_phases):
+        for method, phase in list(method_phases.items()):
+            setattr(obj, method, self.wrap(phase, getattr(obj, method), method))
+            self.wrapped.append((obj, method))
+
+    # Start profiling a simulation (and its data collector)
+    def attach(self, CA):
+        from vectorized import VectorizedCellularAutomation
+        from kernels import JitCellularAutomation
+        if isinstance(CA, JitCellularAutomation): engine = 'jit'
+        else: engine = 'vectorized' if isinstance(CA, VectorizedCellularAutomation) else 'object'
+        self.CA = CA
+        self.data_collect = CA.data_collect
+        self._wrap_methods(CA, engine_phases[engine])
+        self._wrap_methods(CA.data_collect, data_collector_phases)
+        # The end of a timestep is when the data collector finishes it
+        reset = CA.data_collect.reset
+
+        def reset_with_memory(*args, **kwargs):
+            if self.memory: self._row()['rss_mb'] = get_rss_mb()
+            return reset(*args, **kwargs)
+        CA.data_collect.reset = reset_with_memory
+        if engine == 'object':
+            self.progress_infection = Person.progress_infection
+            Person.progress_infection = self.wrap('infection_progression', Person.progress_infection)
+        CA.profiler = self
+        CA.data_collect.profiler = self
+
+    # Stop profiling (the recorded data is kept)
+    def detach(self):
+        for obj, method in self.wrapped:
+            delattr(obj, method)
+        self.wrapped = []
+        self.CA.profiler = None
+        if self.progress_infection is not None:
+            Person.progress_infection = self.progress_infection
+            self.progress_infection = None
+
+    # {column: list} with one value per timestep, for the first `num_rows` timesteps
+    def columns(self, num_rows=None):
+        num_rows = len(self.rows) if num_rows is None else num_rows
+        rows = self.rows[:num_rows] + [{}] * (num_rows - len(self.rows))
+        columns = {'seconds ' + phase: [row.get(phase, 0.) for row in rows] for phase in phases}
+        columns.update({name: [row.get(name, 0) for row in rows] for name in counters})
+        if self.memory: columns['rss_mb'] = [row.get('rss_mb') for row in rows]
+        return columns
+
+    def chrome_trace(self):
+        events = list(self.trace_events)
+        # One counter sample per timestep at the time it ended (or at the start if it never did)
+        ends = {}
+        for event in self.trace_events:
+            if event['name'] == 'reset': ends[len(ends)] = event['ts']
+        for i, row in enumerate(self.rows):
+            ts = ends.get(i, 0.)
+            events.append({'name': 'seconds', 'ph': 'C', 'pid': 0, 'ts': ts,
+                           'args': {phase: row.get(phase, 0.) for phase in phases}})
+            events.append({'name': 'counters', 'ph': 'C', 'pid': 0, 'ts': ts,
+                           'args': {name: row.get(name, 0) for name in counters}})
+            if self.memory and 'rss_mb' in row:
+                events.append({'name': 'rss_mb', 'ph': 'C', 'pid': 0, 'ts': ts, 'args': {'rss_mb': row['rss_mb']}})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def save_chrome_trace(self, path):
+        json.dump(self.chrome_trace(), open(path, 'w'))
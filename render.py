@@ -0,0 +1,89 @@
+import numpy as np
+from population import SUSCEPTIBLE, INFECTED, SOCIAL_DISTANCE, WEAR_MASK
+
+'''
+Notes:
+- Draws a whole frame at once from the `Population` arrays instead of one pygame draw call per person
+    - Each cell gets a color index (see below) and a shape, which are turned into a pixel array and blitted with
+      `pygame.surfarray` in one go
+- pygame is only imported when a `Renderer` is created, so headless runs never import it
+'''
+
+# Different color models (only one right now)
+color_models = {'SIR': {'susceptible': (204, 255, 204), 'infected': (255, 204, 204), 'recovered': (204, 204, 255)}}
+# Different shape models (if you care about SD or WM more)
+shape_models = {'SD': {True: 'circle', False: 'rect'},
+                'WM': {True: 'circle', False: 'rect'}}
+# Color index of each cell (index into a palette)
+EMPTY, SUSCEPTIBLE_COLOR, INFECTED_COLOR, RECOVERED_COLOR = range(4)
+BACKGROUND = (0, 0, 0)
+
+
+# Palette of a color model, in color index order
+def get_palette(color_model):
+    colors = color_models[color_model]
+    return np.array([BACKGROUND, colors['susceptible'], colors['infected'], colors['recovered']], dtype=np.uint8)
+
+
+# Color index (uint8) of every cell of the grid
+def get_color_index_grid(population, width, height):
+    ids = population.alive_ids()
+    color_index = np.full((height, width), EMPTY, dtype=np.uint8)
+    color_index[population.y[ids], population.x[ids]] = np.where(
+        population.has(SUSCEPTIBLE, ids), SUSCEPTIBLE_COLOR,
+        np.where(population.has(INFECTED, ids), INFECTED_COLOR, RECOVERED_COLOR))
+    return color_index
+
+
+# Whether the person on every cell is drawn as a circle (o.w. a rect, or nothing if empty)
+def get_circle_grid(population, width, height, shape_model):
+    ids = population.alive_ids()
+    attribute = population.has(SOCIAL_DISTANCE if shape_model == 'SD' else WEAR_MASK, ids)
+    circle = np.zeros((height, width), dtype=bool)
+    shapes = shape_models[shape_model]
+    circle[population.y[ids], population.x[ids]] = np.where(attribute, shapes[True] == 'circle', shapes[False] == 'circle')
+    return circle
+
+
+# Color index of every pixel (height * cell_size, width * cell_size) of a frame
+def get_frame_indices(color_index, circle, cell_size):
+    height, width = color_index.shape
+    # Same circle as `pygame.draw.circle` with the center in the middle of the cell
+    radius = cell_size // 2
+    offsets = np.arange(cell_size) - radius + 0.5
+    circle_tile = offsets[:, None] ** 2 + offsets[None, :] ** 2 <= radius ** 2
+    # (height, cell_size, width, cell_size) mask of the pixels that get the cell's color
+    mask = np.where(circle[:, None, :, None], circle_tile[None, :, None, :], True)
+    indices = np.where(mask, color_index[:, None, :, None], np.uint8(EMPTY))
+    return indices.reshape(height * cell_size, width * cell_size)
+
+
+# Pixels (height * cell_size, width * cell_size, 3) of a frame
+def get_frame_pixels(color_index, circle, cell_size, palette):
+    return palette[get_frame_indices(color_index, circle, cell_size)]
+
+
+class Renderer:
+    def __init__(self, render_C, width, height):
+        import pygame
+        self.pygame = pygame
+        self.render_C = render_C
+        self.width = width
+        self.height = height
+        self.palette = get_palette(render_C['color_model'])
+        # Initialize the game engine
+        pygame.init()
+        # Set the height and width and title of the screen
+        self.screen = pygame.display.set_mode((render_C['cell_size'] * width, render_C['cell_size'] * height))
+        pygame.display.set_caption("Population Dynamics")
+        self.clock = pygame.time.Clock()
+
+    def draw(self, population):
+        color_index = get_color_index_grid(population, self.width, self.height)
+        circle = get_circle_grid(population, self.width, self.height, self.render_C['shape_model'])
+        pixels = get_frame_pixels(color_index, circle, self.render_C['cell_size'], self.palette)
+        # surfarray is (x, y)
+        self.pygame.surfarray.blit_array(self.screen, pixels.transpose(1, 0, 2))
+        self.pygame.display.flip()
+        # Frames per second
+        if self.render_C['fps']: self.clock.tick(self.render_C['fps'])
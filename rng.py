@@ -0,0 +1,63 @@
+import numpy as np
+
+'''
+Notes:
+- Every random draw of a simulation comes from one explicit numpy `Generator` (PCG64) made from the run's seed, instead
+  of the global `random` and `np.random` states, so a run is reproducible from its seed alone
+    - The seed is `seed` in the grid constants, if it is null a fresh one is drawn (and saved with the experiment)
+- Parallel runs (see `ensemble.py`) get child seeds spawned from one base seed (numpy `SeedSequence`), so no two runs
+  share random streams
+- Per-person code draws single uniforms from a `UniformBuffer`, which pre-generates them in one call instead of one
+  numpy call per draw
+'''
+
+# Size of the pre-generated uniforms of a `UniformBuffer`
+UNIFORM_BUFFER_SIZE = 4096
+
+
+# The seed to use (a fresh 32 bit one if None)
+def resolve_seed(seed=None):
+    if seed is None:
+        return int(np.random.SeedSequence().generate_state(1)[0])
+    return int(seed)
+
+
+def make_rng(seed):
+    return np.random.Generator(np.random.PCG64(seed))
+
+
+# One independent 32 bit seed per child (eg. per run or per worker)
+def spawn_seeds(seed, num_children):
+    return [int(child.generate_state(1)[0]) for child in np.random.SeedSequence(seed).spawn(num_children)]
+
+
+class UniformBuffer:
+    def __init__(self, rng, size=UNIFORM_BUFFER_SIZE):
+        self.rng = rng
+        self.size = size
+        self.values = []
+        self.index = 0
+
+    # One uniform in [0, 1)
+    def random(self):
+        if self.index == len(self.values):
+            self.values = self.rng.random(self.size).tolist()
+            self.index = 0
+        value = self.values[self.index]
+        self.index += 1
+        return value
+
+    # Random int in [0, n)
+    def randrange(self, n):
+        return int(self.random() * n)
+
+    def choice(self, lis):
+        return lis[self.randrange(len(lis))]
+
+    # Unused uniforms (to save and restore the buffer, see `checkpoint.py`)
+    def remaining(self):
+        return np.array(self.values[self.index:], dtype=np.float64)
+
+    def set_remaining(self, values):
+        self.values = list(values.tolist())
+        self.index = 0
@@ -0,0 +1,449 @@
+import json
+import copy
+import time
+import argparse
+import threading
+import traceback
+import multiprocessing
+from itertools import count
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from data_collector import DataCollector, data_options, adv_infection_options
+from ensemble import apply_params, aggregate
+from rng import resolve_seed, spawn_seeds
+
+'''
+Notes:
+- Long-lived local service that runs simulations for notebooks and dashboards over HTTP, instead of starting a new
+  python (and importing numpy, pandas, matplotlib...) for every run
+- A job is a spec (JSON): constants overrides and seeds, which is split into one run per seed
+    {"params": {"person.policy_type": "high"}, "replicates": 10, "seed": 0}
+    - "constants": full constants to start from (default: the service's `constants.json`)
+    - "params": '<section>.<constant>' overrides (like `ensemble.py`)
+    - "seeds": the seed of each run, or "replicates" runs with seeds spawned from "seed" (a fresh one if not given)
+    - "every": send the data of every `every`th timestep (default 1), "save_experiment": also save each run in `experiments/`
+- Runs are queued on a pool of worker processes that is started once with the simulation modules (and pandas and
+  matplotlib if installed) already imported, in the order the jobs came in, so the workers are always busy while
+  there are runs left
+- Every run sends its progress back while it runs: the `DataCollector` of a run gets a `ProgressStream` (same interface
+  as a `StreamWriter`, see `stream_writer.py`) which puts each finished timestep's data on a queue that a thread of
+  the service reads into the job's list of events
+- API:
+    - POST /jobs: queue a job, returns its id
+    - GET /jobs: status of every job
+    - GET /jobs/<id>: status, progress and (once done) the summary of every run and their aggregate (see `ensemble.py`)
+    - GET /jobs/<id>/events?since=n: the job's events as JSON lines (from the nth), kept open until the job is done
+    - DELETE /jobs/<id>: cancel the runs of a job that haven't started
+    - If a worker dies (killed, out of memory...) its pool can't run anything anymore: the pool's runs fail and a new
+      pool is started (a POST that hits the broken pool gets a 503)
+    - GET /health: number of workers and runs left
+- Memory stays bounded however long the service runs:
+    - A job keeps at most `max_events` events, and the ones every open event stream has already sent are dropped
+      (events keep their number, a stream from an older one starts at the first kept one)
+    - Finished jobs are dropped `job_ttl` seconds after they finish, and past `max_jobs` finished jobs the oldest ones
+- Run `python service.py --port 8000 --workers 4`
+'''
+
+DEFAULT_PORT = 8000
+DEFAULT_MAX_EVENTS = 10000
+DEFAULT_JOB_TTL = 3600
+DEFAULT_MAX_JOBS = 100
+# Statuses of a job (and of each of its runs)
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = 'queued', 'running', 'done', 'failed', 'cancelled'
+finished_statuses = [DONE, FAILED, CANCELLED]
+
+# Queue of the events of a worker (set by `_warm_up`)
+_events = None
+# Modules a worker imports when it starts (kept so they're used)
+_warm_modules = ()
+
+
+# Worker ------
+# Runs once in every worker when the pool starts
+def _warm_up(events, constants):
+    global _events, _warm_modules
+    _events = events
+    # Imported only so the runs don't have to (the engines are imported by `create_automation`)
+    import main, vectorized, tiled, kernels, contacts
+    _warm_modules = (main, vectorized, tiled, kernels, contacts)
+    # Only needed to save experiments, but loading them is the slow part of starting a run
+    try:
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot
+        import pandas
+        _warm_modules += (matplotlib.pyplot, pandas)
+    except ImportError:
+        pass
+    # Compile the jit engine's kernels now instead of in the first run
+    if kernels.NUMBA_AVAILABLE:
+        constants = copy.deepcopy(constants)
+        constants['grid'].update({'width': 10, 'height': 10, 'initial_pop_size': 10, 'number_iterations': 2,
+                                  'engine': 'jit', 'seed': 0})
+        data_collect = DataCollector(constants, save_experiment=False, print_visualizations=False)
+        data_collect.set_print_options(basic_to_print=[], adv_to_print=[])
+        main.create_automation(constants, data_collect).run()
+
+
+# Sends the data of the finished timesteps of a run to the service (as a `StreamWriter` of its data collector)
+class ProgressStream:
+    def __init__(self, job_id, run, every=1):
+        self.job_id = job_id
+        self.run = run
+        self.every = every
+
+    def write_timestep(self, timestep, basic, infection, R0):
+        if timestep % self.every != 0:
+            return
+        _events.put({'job': self.job_id, 'run': self.run, 'event': 'timestep', 'timestep': timestep,
+                     'basic': dict(zip(data_options, basic.tolist())),
+                     'infection': dict(zip(adv_infection_options, infection.tolist())), 'R0': R0})
+
+    # The seed is in the job's events already
+    def set_seed(self, seed):
+        pass
+
+    def write_snapshot(self, timestep, population):
+        pass
+
+    def close(self):
+        pass
+
+
+# One run of a job, its end (summary or error) is sent after its progress so they arrive in order
+def _run_job(job_id, run, constants, seed, every, save_experiment):
+    from main import create_automation
+    try:
+        _events.put({'job': job_id, 'run': run, 'event': 'started', 'seed': seed})
+        constants = apply_params(constants, {'grid.seed': seed})
+        data_collect = DataCollector(constants, save_experiment=save_experiment, print_visualizations=False,
+                                     stream=ProgressStream(job_id, run, every))
+        data_collect.set_print_options(basic_to_print=[], adv_to_print=[])
+        CA = create_automation(constants, data_collect)
+        CA.run(render=False)
+        _events.put({'job': job_id, 'run': run, 'event': DONE, 'seed': seed, 'summary': data_collect.summary()})
+    except Exception:
+        _events.put({'job': job_id, 'run': run, 'event': FAILED, 'seed': seed, 'error': traceback.format_exc()})
+
+
+# Service ------
+class SimulationService:
+    def __init__(self, constants, workers=None, max_events=DEFAULT_MAX_EVENTS, job_ttl=DEFAULT_JOB_TTL,
+                 max_jobs=DEFAULT_MAX_JOBS):
+        self.constants = constants
+        self.workers = workers or multiprocessing.cpu_count()
+        self.max_events = max_events
+        self.job_ttl = job_ttl
+        self.max_jobs = max_jobs
+        self.jobs = {}
+        self.job_ids = count(1)
+        # Guards the jobs, and wakes up the event streams when something happens
+        self.lock = threading.Condition()
+        self._start_pool()
+
+    # Every pool has its own queue of events (and thread reading it), a worker killed while sending an event can only
+    # break the queue of its pool
+    def _start_pool(self):
+        self.events = multiprocessing.Queue()
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_warm_up,
+                                        initargs=(self.events, self.constants))
+        self.reader = threading.Thread(target=self._read_events, args=(self.events,), daemon=True)
+        self.reader.start()
+
+    # A pool whose worker died (killed, out of memory...) can't run anything anymore: its runs fail and a new pool
+    # takes its place (once, however many of its runs or submits notice)
+    def _restart_pool(self, broken_pool):
+        with self.lock:
+            if self.pool is broken_pool:
+                broken_pool.shutdown(wait=False, cancel_futures=True)
+                self.events.put(None)
+                self._start_pool()
+
+    # Checks a spec and makes the constants and seeds of its runs
+    def _runs(self, spec):
+        constants = copy.deepcopy(spec.get('constants') or self.constants)
+        params = spec.get('params', {})
+        for key in params:
+            section, _, name = key.partition('.')
+            if section not in constants or name not in constants[section]:
+                raise ValueError('{} is not a constant'.format(key))
+        constants = apply_params(constants, params)
+        if 'seeds' in spec:
+            seeds = [int(seed) for seed in spec['seeds']]
+        else:
+            seeds = spawn_seeds(resolve_seed(spec.get('seed')), int(spec.get('replicates', 1)))
+        if len(seeds) == 0:
+            raise ValueError('A job needs at least one run')
+        return params, constants, seeds
+
+    # Queues every run of a job, returns the job (raises `BrokenProcessPool` if the pool broke, the runs that were not
+    # queued fail)
+    def submit(self, spec):
+        params, constants, seeds = self._runs(spec)
+        every = max(int(spec.get('every', 1)), 1)
+        with self.lock:
+            job_id = str(next(self.job_ids))
+            self._evict()
+            # first_event: number of the first kept event, readers: next event of each open event stream
+            job = {'id': job_id, 'status': QUEUED, 'params': params, 'seeds': seeds, 'runs': [QUEUED] * len(seeds),
+                   'timesteps': [0] * len(seeds), 'summaries': [None] * len(seeds), 'errors': {}, 'events': [],
+                   'first_event': 0, 'readers': {}, 'futures': [], 'aggregate': None, 'finished': None}
+            self.jobs[job_id] = job
+        pool = self.pool
+        try:
+            for run, seed in enumerate(seeds):
+                future = pool.submit(_run_job, job_id, run, constants, seed, every, bool(spec.get('save_experiment')))
+                future.add_done_callback(self._callback(job_id, run, pool))
+                with self.lock:
+                    job['futures'].append(future)
+        except BrokenProcessPool:
+            for run in range(len(job['futures']), len(seeds)):
+                self._add_event({'job': job_id, 'run': run, 'event': FAILED, 'error': 'The worker pool broke'})
+            self._restart_pool(pool)
+            raise
+        return job
+
+    # Runs that never got to send their end (cancelled, or their worker died)
+    def _callback(self, job_id, run, pool):
+        def callback(future):
+            if future.cancelled():
+                self._add_event({'job': job_id, 'run': run, 'event': CANCELLED})
+            elif future.exception() is not None:
+                self._add_event({'job': job_id, 'run': run, 'event': FAILED, 'error': repr(future.exception())})
+                if isinstance(future.exception(), BrokenProcessPool):
+                    self._restart_pool(pool)
+        return callback
+
+    def _read_events(self, events):
+        while True:
+            try:
+                event = events.get()
+            except Exception:
+                # Broken by a killed worker, the runs of its pool fail anyway
+                return
+            if event is None:
+                return
+            self._add_event(event)
+
+    def _add_event(self, event):
+        with self.lock:
+            job = self.jobs.get(event.pop('job'))
+            if job is None:
+                return
+            run = event['run']
+            if event['event'] == 'started':
+                job['runs'][run] = RUNNING
+                if job['status'] == QUEUED: job['status'] = RUNNING
+            elif event['event'] == 'timestep':
+                job['timesteps'][run] = event['timestep']
+            elif job['runs'][run] not in finished_statuses:
+                job['runs'][run] = event['event']
+                if event['event'] == DONE:
+                    job['summaries'][run] = event['summary']
+                    event = {'run': run, 'event': DONE, 'seed': event['seed'], 'SAR': event['summary']['SAR']}
+                elif event['event'] == FAILED:
+                    job['errors'][run] = event['error']
+                if all(status in finished_statuses for status in job['runs']):
+                    self._finish(job)
+            else:
+                return
+            job['events'].append(event)
+            self._trim_events(job)
+            self.lock.notify_all()
+
+    # Drops the events every open stream has sent, and the oldest ones past `max_events`
+    def _trim_events(self, job):
+        end = job['first_event'] + len(job['events'])
+        keep_from = max(min(list(job['readers'].values()) or [job['first_event']]), end - self.max_events)
+        if keep_from > job['first_event']:
+            del job['events'][:keep_from - job['first_event']]
+            job['first_event'] = keep_from
+
+    # Drops finished jobs older than `job_ttl`, and the oldest finished ones past `max_jobs`
+    def _evict(self):
+        now = time.time()
+        finished = sorted([job for job in self.jobs.values() if job['finished'] is not None],
+                          key=lambda job: job['finished'])
+        for i, job in enumerate(finished):
+            if now - job['finished'] > self.job_ttl or len(finished) - i > self.max_jobs:
+                del self.jobs[job['id']]
+
+    def _finish(self, job):
+        job['finished'] = time.time()
+        job['futures'] = []
+        if FAILED in job['runs']:
+            job['status'] = FAILED
+        elif CANCELLED in job['runs']:
+            job['status'] = CANCELLED
+        else:
+            job['status'] = DONE
+        results = [{'config': 0, 'replicate': run, 'seed': seed, 'summary': summary}
+                   for run, (seed, summary) in enumerate(zip(job['seeds'], job['summaries'])) if summary is not None]
+        if results:
+            job['aggregate'] = aggregate(results, [job['params']])[0]
+
+    def cancel(self, job_id):
+        with self.lock:
+            futures = list(self.jobs[job_id]['futures'])
+        # Outside the lock: the callback of a cancelled run takes it
+        for future in futures:
+            future.cancel()
+
+    # Status of a job (with the results once it's finished)
+    def info(self, job_id, results=True):
+        with self.lock:
+            job = self.jobs[job_id]
+            info = {k: job[k] for k in ['id', 'status', 'params', 'seeds', 'runs', 'timesteps', 'errors']}
+            info['runs_done'] = sum(status in finished_statuses for status in job['runs'])
+            info['first_event'] = job['first_event']
+            info['num_events'] = job['first_event'] + len(job['events'])
+            if results and job['status'] in finished_statuses:
+                info['summaries'] = job['summaries']
+                info['aggregate'] = job['aggregate']
+            return info
+
+    # Yields the events of a job from the since-th one (or the first kept one), waiting for new ones until the job is
+    # finished, events it has sent can be dropped
+    def iter_events(self, job_id, since=0, timeout=None):
+        reader = object()
+        with self.lock:
+            job = self.jobs[job_id]
+            job['readers'][reader] = since = max(since, job['first_event'])
+        try:
+            while True:
+                with self.lock:
+                    job['readers'][reader] = since = max(since, job['first_event'])
+                    self._trim_events(job)
+                    if since >= job['first_event'] + len(job['events']) and job['status'] not in finished_statuses:
+                        self.lock.wait(timeout)
+                    since = max(since, job['first_event'])
+                    events = job['events'][since - job['first_event']:]
+                    finished = job['status'] in finished_statuses
+                for event in events:
+                    yield dict(event, number=since)
+                    since += 1
+                if finished and not events:
+                    return
+        finally:
+            with self.lock:
+                del job['readers'][reader]
+
+    def health(self):
+        with self.lock:
+            self._evict()
+            runs_left = sum(status not in finished_statuses for job in self.jobs.values() for status in job['runs'])
+        return {'workers': self.workers, 'jobs': len(self.jobs), 'runs_left': runs_left}
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        self.events.put(None)
+
+
+# HTTP ------
+class ServiceHandler(BaseHTTPRequestHandler):
+    def _send_json(self, data, code=200):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # ('jobs', id or None, sub path or None) and the query
+    def _route(self):
+        url = urlparse(self.path)
+        parts = [part for part in url.path.split('/') if part]
+        parts += [None] * (3 - len(parts))
+        return parts[:3], parse_qs(url.query)
+
+    def _job_id(self, job_id):
+        service = self.server.service
+        with service.lock:
+            found = job_id in service.jobs
+        if not found:
+            self._send_json({'error': 'No job {}'.format(job_id)}, 404)
+            return None
+        return job_id
+
+    def do_POST(self):
+        (resource, job_id, _), _ = self._route()
+        if resource != 'jobs' or job_id is not None:
+            return self._send_json({'error': 'Not found'}, 404)
+        try:
+            spec = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            job = self.server.service.submit(spec)
+        except (ValueError, TypeError, KeyError) as e:
+            return self._send_json({'error': str(e)}, 400)
+        except BrokenProcessPool:
+            return self._send_json({'error': 'A worker died, the pool was restarted: submit the job again'}, 503)
+        self._send_json({'id': job['id'], 'runs': len(job['seeds']), 'seeds': job['seeds']}, 202)
+
+    def do_GET(self):
+        service = self.server.service
+        (resource, job_id, sub), query = self._route()
+        if resource == 'health':
+            return self._send_json(service.health())
+        if resource != 'jobs':
+            return self._send_json({'error': 'Not found'}, 404)
+        if job_id is None:
+            with service.lock:
+                service._evict()
+                job_ids = list(service.jobs)
+            return self._send_json([service.info(job_id, results=False) for job_id in job_ids])
+        if self._job_id(job_id) is None:
+            return
+        if sub is None:
+            return self._send_json(service.info(job_id))
+        if sub != 'events':
+            return self._send_json({'error': 'Not found'}, 404)
+        # One JSON event per line, the connection is closed at the end of the job
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.end_headers()
+        try:
+            for event in service.iter_events(job_id, int(query.get('since', [0])[0])):
+                self.wfile.write((json.dumps(event) + '\n').encode('utf-8'))
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def do_DELETE(self):
+        (resource, job_id, _), _ = self._route()
+        if resource != 'jobs' or job_id is None:
+            return self._send_json({'error': 'Not found'}, 404)
+        if self._job_id(job_id) is None:
+            return
+        self.server.service.cancel(job_id)
+        self._send_json(self.server.service.info(job_id, results=False))
+
+
+def serve(constants, host='127.0.0.1', port=DEFAULT_PORT, workers=None, max_events=DEFAULT_MAX_EVENTS,
+          job_ttl=DEFAULT_JOB_TTL, max_jobs=DEFAULT_MAX_JOBS):
+    server = ThreadingHTTPServer((host, port), ServiceHandler)
+    server.daemon_threads = True
+    server.service = SimulationService(constants, workers, max_events, job_ttl, max_jobs)
+    print('Serving simulations on http://{}:{} with {} workers'.format(host, server.server_address[1],
+                                                                        server.service.workers))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.service.shutdown()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run simulations as a local HTTP service')
+    parser.add_argument('--constants', default='constants.json')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--workers', type=int, default=None, help='Number of processes (default: all cores)')
+    parser.add_argument('--max-events', type=int, default=DEFAULT_MAX_EVENTS, help='Events kept per job')
+    parser.add_argument('--job-ttl', type=float, default=DEFAULT_JOB_TTL, help='Seconds finished jobs are kept')
+    parser.add_argument('--max-jobs', type=int, default=DEFAULT_MAX_JOBS, help='Finished jobs kept')
+    args = parser.parse_args()
+    serve(json.load(open(args.constants)), args.host, args.port, args.workers, args.max_events, args.job_ttl,
+          args.max_jobs)
@@ -0,0 +1,157 @@
+import numpy as np
+import json
+from data_collector import data_options, adv_infection_options, lifetime_bin_types
+
+'''
+Notes:
+- Streams the data of a run to a columnar file while it is running (one row per timestep), instead of only writing
+  CSVs at the end, so a crashed run keeps everything up to the last flushed chunk
+- Two formats (needs pyarrow):
+    - 'arrow': Arrow IPC stream, every chunk is a record batch flushed to disk right away and a partially written file
+      can still be read (see `read_stream`)
+    - 'parquet': smaller files, every chunk is a row group, but the file is only readable after `close`
+- The constants and seed of the run are embedded as schema metadata (the seed the simulation resolved, the files are
+  opened at the first write)
+- Optional per-person snapshots (position, flags and stages of everyone alive) go to a second file every
+  `snapshot_every` timesteps
+- Use it through the data collector: `DataCollector(..., stream=StreamWriter('run.arrow', constants))`
+'''
+
+# Columns of a timestep row
+infection_columns = ['I ' + k for k in adv_infection_options]
+R0_columns = ['R0 ' + k for k in lifetime_bin_types]
+timestep_columns = ['timestep'] + data_options + infection_columns + R0_columns
+snapshot_columns = ['timestep', 'id', 'x', 'y', 'flags', 'infection_stage', 'symptom_stage']
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError('Streaming experiment output needs pyarrow (pip install pyarrow)')
+    return pyarrow
+
+
+class _Sink:
+    def __init__(self, path, schema, file_format):
+        pa = _import_pyarrow()
+        self.file_format = file_format
+        if file_format == 'arrow':
+            self.file = pa.OSFile(path, 'wb')
+            self.writer = pa.ipc.new_stream(self.file, schema)
+        else:
+            assert file_format == 'parquet', '{} is not a valid format'.format(file_format)
+            self.file = None
+            self.writer = pa.parquet.ParquetWriter(path, schema)
+
+    def write(self, batch):
+        if self.file_format == 'arrow':
+            self.writer.write_batch(batch)
+            self.file.flush()
+        else:
+            self.writer.write_batch(batch)
+
+    def close(self):
+        self.writer.close()
+        if self.file is not None: self.file.close()
+
+
+class StreamWriter:
+    def __init__(self, path, constants, seed=None, chunk_size=10, file_format='arrow', snapshot_path=None,
+                 snapshot_every=1):
+        pa = _import_pyarrow()
+        self.pa = pa
+        self.path = path
+        self.file_format = file_format
+        self.chunk_size = chunk_size
+        self.constants = constants
+        self.seed = seed
+        fields = [pa.field('timestep', pa.int32())] + [pa.field(k, pa.int64()) for k in data_options + infection_columns] + \
+                 [pa.field(k, pa.float64()) for k in R0_columns]
+        self.schema = pa.schema(fields)
+        self.rows = {k: [] for k in timestep_columns}
+        # Files are opened at the first write, so the metadata has the seed the simulation resolved (see `set_seed`)
+        self.sink = None
+        self.snapshot_sink = None
+        # Snapshots of everyone
+        self.snapshot_path = snapshot_path
+        self.snapshot_every = snapshot_every
+        self.snapshot_schema = pa.schema([pa.field('timestep', pa.int32()), pa.field('id', pa.int32()),
+                                          pa.field('x', pa.int32()), pa.field('y', pa.int32()),
+                                          pa.field('flags', pa.uint16()), pa.field('infection_stage', pa.int8()),
+                                          pa.field('symptom_stage', pa.int8())])
+
+    # Seed the run actually uses (also in the constants, so the run can be reproduced from the metadata)
+    def set_seed(self, seed):
+        assert self.sink is None, 'The seed has to be set before the first timestep is written'
+        self.seed = seed
+
+    def _open(self):
+        if self.sink is not None:
+            return
+        constants = dict(self.constants, grid=dict(self.constants['grid'], seed=self.seed))
+        metadata = {'constants': json.dumps(constants), 'seed': json.dumps(self.seed)}
+        self.schema = self.schema.with_metadata(metadata)
+        self.snapshot_schema = self.snapshot_schema.with_metadata(metadata)
+        self.sink = _Sink(self.path, self.schema, self.file_format)
+        if self.snapshot_path:
+            self.snapshot_sink = _Sink(self.snapshot_path, self.snapshot_schema, self.file_format)
+
+    # Add one finished timestep (basic data, infection data and R0 avgs, None if not a bin timestep)
+    def write_timestep(self, timestep, basic, infection, R0):
+        self.rows['timestep'].append(timestep)
+        for k, value in zip(data_options, basic):
+            self.rows[k].append(int(value))
+        for k, value in zip(infection_columns, infection):
+            self.rows[k].append(int(value))
+        for k, bin_type in zip(R0_columns, lifetime_bin_types):
+            self.rows[k].append(R0.get(bin_type) if R0 else None)
+        if len(self.rows['timestep']) >= self.chunk_size:
+            self.flush()
+
+    # Everyone alive in a population at a timestep (only every `snapshot_every` timesteps)
+    def write_snapshot(self, timestep, population):
+        if not self.snapshot_path or timestep % self.snapshot_every != 0:
+            return
+        self._open()
+        ids = population.alive_ids()
+        columns = [np.full(len(ids), timestep, dtype=np.int32), ids.astype(np.int32), population.x[ids],
+                   population.y[ids], population.flags[ids], population.infection_stage[ids],
+                   population.symptom_stage[ids]]
+        self.snapshot_sink.write(self.pa.RecordBatch.from_arrays(columns, schema=self.snapshot_schema))
+
+    def flush(self):
+        if len(self.rows['timestep']) == 0:
+            return
+        self._open()
+        self.sink.write(self.pa.RecordBatch.from_pydict(self.rows, schema=self.schema))
+        self.rows = {k: [] for k in timestep_columns}
+
+    def close(self):
+        self.flush()
+        self._open()
+        self.sink.close()
+        if self.snapshot_sink is not None: self.snapshot_sink.close()
+
+
+# Read a streamed file back as a pyarrow Table (for 'arrow' files, stops at the last complete chunk if the run crashed)
+# and its metadata (constants and seed)
+def read_stream(path):
+    pa = _import_pyarrow()
+    with open(path, 'rb') as f:
+        magic = f.read(4)
+    if magic == b'PAR1':
+        table = pa.parquet.read_table(path)
+    else:
+        batches = []
+        reader = pa.ipc.open_stream(pa.memory_map(path, 'r'))
+        try:
+            for batch in reader:
+                batches.append(batch)
+        except (pa.ArrowInvalid, OSError):
+            pass
+        table = pa.Table.from_batches(batches, schema=reader.schema)
+    metadata = {k.decode(): json.loads(v) for k, v in (table.schema.metadata or {}).items()}
+    return table, metadata
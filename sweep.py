@@ -0,0 +1,288 @@
+import numpy as np
+import json
+import os
+import copy
+import csv
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from data_collector import DataCollector
+from ensemble import apply_params, expand_grid, _parse_grid_arg
+from rng import make_rng, spawn_seeds
+
+'''
+Notes:
+- Sweep / calibration driver over variants of a `constants.json`, with a result cache so a configuration (constants
+  plus seed) is only ever run once
+    - The cache is content addressed: a run's key is the hash of its canonical constants (sorted keys, 1.0 == 1, render
+      constants and `workers` left out since they don't change the results) and seed, one JSON file per run
+    - Points already in the cache are skipped, so rerunning or extending a sweep only runs the new points
+    - The key also has a fingerprint of the code (hash of the modules of the repo, but the ones that only output or
+      drive runs), so a change to the simulation never returns stale results; `CACHE_VERSION` can still be bumped by
+      hand (eg. a change in a dependency)
+- Loss against a target `basic_data.csv` (eg. observed curves): RMSE (in people) over some of its columns, on the
+  timesteps both have
+- Early stopping: with a target and `early_stop`, a run stops once its loss so far is above it (every `check_every`
+  timesteps), its loss is then the loss of the part it ran
+- Calibration (`calibrate`): Latin hypercube samples of the parameter bounds, then rounds of refinement with Latin
+  hypercube samples in a shrinking box around the best points so far
+- Every point uses the same replicate seeds (spawned from one base seed), so points are compared on the same random
+  streams and a rerun of the same calibration is all cache hits
+- eg. `python sweep.py --target experiments/low/basic_data.csv --param disease.base_infection_prob=0.05,0.4
+  --param disease.severity_prob=0.1,0.3 --samples 20 --rounds 3 --early-stop 60`, or `--grid` (same as
+  `ensemble.py`) to run a fixed grid
+'''
+
+CACHE_VERSION = 2
+# Modules that don't change the results of a run, left out of the code fingerprint
+fingerprint_excluded = ['benchmark.py', 'frame_export.py', 'profiler.py', 'render.py', 'service.py', 'stream_writer.py',
+                        'trajectory.py']
+_fingerprint = []
+# Columns of the basic data the loss is over by default
+default_loss_columns = ['S', 'I', 'R']
+
+
+# Same value for equal constants written differently (key order, 1.0 vs 1, tuples vs lists)
+def canonical(value):
+    if isinstance(value, dict):
+        return {k: canonical(v) for k, v in list(value.items())}
+    if isinstance(value, (list, tuple)):
+        return [canonical(v) for v in value]
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+# Hash of the source of every module next to this one (computed once)
+def code_fingerprint():
+    if not _fingerprint:
+        directory = os.path.dirname(os.path.abspath(__file__))
+        digest = hashlib.sha256()
+        for name in sorted(os.listdir(directory)):
+            if name.endswith('.py') and name not in fingerprint_excluded:
+                with open(os.path.join(directory, name), 'rb') as f:
+                    digest.update(name.encode('utf-8') + b'\0' + f.read())
+        _fingerprint.append(digest.hexdigest())
+    return _fingerprint[0]
+
+
+def cache_key(constants, seed):
+    constants = copy.deepcopy(constants)
+    constants.pop('render', None)
+    constants['grid'].pop('workers', None)
+    constants['grid']['seed'] = seed
+    text = json.dumps({'version': CACHE_VERSION, 'code': code_fingerprint(), 'constants': canonical(constants)},
+                      sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    def __init__(self, directory):
+        self.directory = directory
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + '.json')
+
+    # The cached result of a key (None if it was never run)
+    def get(self, key):
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def put(self, key, result):
+        path = self._path(key)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        # Written to a temporary file first so a crash or another sweep never sees half a result
+        temp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(temp_path, 'w') as f:
+            json.dump(result, f)
+        os.replace(temp_path, path)
+
+
+# {column: array} of a `basic_data.csv`
+def load_target(path):
+    with open(path) as f:
+        rows = list(csv.DictReader(f))
+    return {k: np.array([float(row[k]) for row in rows]) for k in rows[0]}
+
+
+# RMSE between a run's basic data history and the target over some columns (on the timesteps both have)
+def curve_loss(history, target, columns):
+    errors = []
+    for column in columns:
+        n = min(len(history[column]), len(target[column]))
+        errors.append(np.asarray(history[column][:n], dtype=float) - target[column][:n])
+    errors = np.concatenate(errors)
+    return float(np.sqrt(np.mean(errors ** 2))) if len(errors) > 0 else 0.
+
+
+# Basic data history including the timestep that just finished (same as the summary once the run is finished)
+def _history_so_far(data_collect):
+    current = data_collect.current_data
+    return {k: v + [current[k]] for k, v in list(data_collect.data_history.items())}
+
+
+# Run one simulation (stops early if its loss so far goes above `early_stop`)
+def run_point(job):
+    from main import create_automation
+    constants, seed, target, columns, early_stop, check_every = job
+    constants = apply_params(constants, {'grid.seed': seed})
+    data_collect = DataCollector(constants, save_experiment=False, print_visualizations=False)
+    data_collect.set_print_options(basic_to_print=[], adv_to_print=[])
+    CA = create_automation(constants, data_collect)
+    stopped_at = None
+    if early_stop is None or target is None:
+        CA.run(render=False)
+    else:
+        while CA.timestep < constants['grid']['number_iterations']:
+            CA.advance(1)
+            if CA.timestep % check_every == 0 and curve_loss(_history_so_far(data_collect), target, columns) > early_stop:
+                stopped_at = CA.timestep
+                break
+        data_collect.reset(CA.timestep, last=True)
+        if hasattr(CA, 'close'): CA.close()
+    return {'summary': data_collect.summary(), 'stopped_at': stopped_at}
+
+
+# Run (or take from the cache) every replicate of every point
+# points: list of {'section.name': value}, returns one {'params', 'loss', 'stopped', 'cached', 'results'} per point
+def evaluate(constants, points, seeds, cache, target=None, columns=default_loss_columns, early_stop=None,
+             check_every=5, workers=None, callback=None):
+    keys = [[cache_key(apply_params(constants, params), seed) for seed in seeds] for params in points]
+    results = {}
+    cached = set()
+    jobs = {}
+    for params, point_keys in zip(points, keys):
+        for seed, key in zip(seeds, point_keys):
+            if key in results or key in jobs:
+                continue
+            result = cache.get(key)
+            # A run that stopped early is only good enough if it is still clearly off
+            if result is not None and result['stopped_at'] is not None:
+                usable = early_stop is not None and target is not None and \
+                    curve_loss(result['summary']['basic'], target, columns) > early_stop
+                if not usable: result = None
+            if result is not None:
+                results[key] = result
+                cached.add(key)
+            else:
+                jobs[key] = (apply_params(constants, params), seed, target, columns, early_stop, check_every)
+    if jobs:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(run_point, job): key for key, job in list(jobs.items())}
+            for future in as_completed(futures):
+                key = futures[future]
+                results[key] = future.result()
+                cache.put(key, results[key])
+                if callback: callback(key, results[key])
+    evaluated = []
+    for params, point_keys in zip(points, keys):
+        point_results = [results[key] for key in point_keys]
+        info = {'params': params, 'seeds': list(seeds), 'keys': point_keys, 'loss': None,
+                'stopped': any(r['stopped_at'] is not None for r in point_results),
+                'cached': sum(key in cached for key in point_keys), 'results': point_results}
+        if target is not None:
+            info['loss'] = float(np.mean([curve_loss(r['summary']['basic'], target, columns) for r in point_results]))
+        evaluated.append(info)
+    return evaluated
+
+
+# n points spread over the bounds ({'section.name': (low, high)}): each parameter gets one value in each of n strata
+def latin_hypercube(bounds, n, rng):
+    keys = sorted(bounds)
+    strata = rng.permuted(np.tile(np.arange(n), (len(keys), 1)), axis=1).T
+    u = (strata + rng.random((n, len(keys)))) / n
+    low = np.array([bounds[k][0] for k in keys], dtype=float)
+    high = np.array([bounds[k][1] for k in keys], dtype=float)
+    values = low + u * (high - low)
+    return [{k: float(v) for k, v in zip(keys, row)} for row in values]
+
+
+# Latin hypercube over the bounds, then `rounds - 1` rounds of samples around the `top` best points (in a box `shrink`
+# times smaller each round), returns every evaluated point sorted by loss
+def calibrate(constants, bounds, target, cache, samples=20, rounds=3, top=3, shrink=0.5, replicates=1, seed=0,
+              columns=default_loss_columns, early_stop=None, check_every=5, workers=None, decimals=None, callback=None):
+    rng = make_rng(seed)
+    seeds = spawn_seeds(seed, replicates)
+
+    def sample(box, n):
+        points = latin_hypercube(box, n, rng)
+        if decimals is not None:
+            points = [{k: round(v, decimals) for k, v in list(p.items())} for p in points]
+        return points
+    evaluated = []
+    points = sample(bounds, samples)
+    for r in range(rounds):
+        evaluated += evaluate(constants, points, seeds, cache, target, columns, early_stop, check_every, workers,
+                              callback)
+        best = sorted(evaluated, key=lambda e: e['loss'])[:top]
+        scale = shrink ** (r + 1)
+        points = []
+        for b in best:
+            box = {}
+            for k, (low, high) in list(bounds.items()):
+                half_width = (high - low) * scale / 2.
+                center = b['params'][k]
+                box[k] = (max(low, center - half_width), min(high, center + half_width))
+            points += sample(box, max(1, samples // len(best)))
+    return sorted(evaluated, key=lambda e: e['loss'])
+
+
+# 'section.name=low,high' -> ('section.name', (low, high))
+def _parse_bounds_arg(arg):
+    key, values = arg.split('=', 1)
+    low, high = [float(v) for v in values.split(',')]
+    return key, (low, high)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Parameter sweeps and calibration with a result cache')
+    parser.add_argument('--constants', default='constants.json')
+    parser.add_argument('--target', default=None, help='basic_data.csv to fit')
+    parser.add_argument('--columns', default=','.join(default_loss_columns), help='Columns the loss is over')
+    parser.add_argument('--param', action='append', default=[], help="'section.name=low,high' to calibrate (can repeat)")
+    parser.add_argument('--grid', action='append', default=[], help="'section.name=v1,v2,...' to sweep (can repeat)")
+    parser.add_argument('--samples', type=int, default=20, help='Samples per calibration round')
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--top', type=int, default=3, help='Best points refined around each round')
+    parser.add_argument('--shrink', type=float, default=0.5)
+    parser.add_argument('--decimals', type=int, default=None, help='Round sampled values (more cache hits)')
+    parser.add_argument('--replicates', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--early-stop', type=float, default=None, help='Stop runs whose loss goes above this')
+    parser.add_argument('--check-every', type=int, default=5)
+    parser.add_argument('--cache', default='sweep_cache')
+    parser.add_argument('--workers', type=int, default=None, help='Number of processes (default: all cores)')
+    parser.add_argument('--out', default='sweep.json')
+    args = parser.parse_args()
+    constants = json.load(open(args.constants))
+    target = load_target(args.target) if args.target else None
+    columns = args.columns.split(',')
+    cache = ResultCache(args.cache)
+    ran = []
+
+    def progress(key, result):
+        ran.append(key)
+        print('Finished run {} ({}{})'.format(len(ran), key[:12],
+                                              ', stopped at {}'.format(result['stopped_at']) if result['stopped_at'] else ''))
+    if args.param:
+        assert target is not None, 'Calibration needs a --target'
+        bounds = dict(_parse_bounds_arg(arg) for arg in args.param)
+        evaluated = calibrate(constants, bounds, target, cache, args.samples, args.rounds, args.top, args.shrink,
+                              args.replicates, args.seed, columns, args.early_stop, args.check_every, args.workers,
+                              args.decimals, progress)
+    else:
+        points = expand_grid(dict(_parse_grid_arg(arg) for arg in args.grid))
+        evaluated = evaluate(constants, points, spawn_seeds(args.seed, args.replicates), cache, target, columns,
+                             args.early_stop, args.check_every, args.workers, progress)
+        if target is not None: evaluated.sort(key=lambda e: e['loss'])
+    print('{} runs, {} from the cache'.format(sum(len(e['keys']) for e in evaluated), sum(e['cached'] for e in evaluated)))
+    for e in evaluated[:5]:
+        print('loss: {} --- {}{}'.format(e['loss'], e['params'], ' (stopped early)' if e['stopped'] else ''))
+    # Summaries are in the cache, the output only has the points
+    json.dump([{k: v for k, v in list(e.items()) if k != 'results'} for e in evaluated], open(args.out, 'w'), indent=4)
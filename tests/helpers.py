@@ -0,0 +1,34 @@
+import os
+import json
+import numpy as np
+from data_collector import DataCollector
+from main import create_automation
+
+constants_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'constants.json')
+
+
+# `constants.json` with some grid constants changed (eg. engine, seed, width...)
+def make_constants(policy=None, **grid):
+    with open(constants_path) as f:
+        constants = json.load(f)
+    constants['grid'].update(grid)
+    if policy is not None: constants['person']['policy_type'] = policy
+    return constants
+
+
+def make_data_collector(constants, **kwargs):
+    data_collect = DataCollector(constants, save_experiment=False, print_visualizations=False, **kwargs)
+    data_collect.set_print_options(basic_to_print=[], adv_to_print=[])
+    return data_collect
+
+
+# A headless simulation of the constants
+def make_automation(constants, **kwargs):
+    return create_automation(constants, make_data_collector(constants, **kwargs))
+
+
+# Difference of the means of two samples (along the first axis) in standard errors
+def welch_z(a, b):
+    se = np.sqrt(a.var(axis=0, ddof=1) / len(a) + b.var(axis=0, ddof=1) / len(b))
+    difference = np.abs(a.mean(axis=0) - b.mean(axis=0))
+    return np.where(se > 0, difference / np.where(se > 0, se, 1), np.where(difference > 0, np.inf, 0.))
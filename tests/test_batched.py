@@ -0,0 +1,55 @@
+import copy
+import numpy as np
+from batched import BatchedCellularAutomation
+from population import ALIVE
+from helpers import make_constants, make_data_collector, make_automation, welch_z
+
+'''
+Notes:
+- A batch of K identical scenarios gives the same distribution of SAR and final S, I, R and deaths as K separate runs
+  of the vectorized engine (within `Z_TOLERANCE` standard errors), and scenarios never see each other
+'''
+
+small_grid = {'width': 30, 'height': 30, 'initial_pop_size': 80, 'number_iterations': 30}
+NUM_SCENARIOS = 60
+Z_TOLERANCE = 3.5
+
+
+def results(data_collect):
+    history = data_collect.data_history
+    return [data_collect.SAR, history['S'][-1], history['I'][-1], history['R'][-1], sum(history['death'])]
+
+
+def test_identical_scenarios_match_separate_runs():
+    constants = make_constants(engine='vectorized', seed=0, **small_grid)
+    scenario_constants = [copy.deepcopy(constants) for _ in range(NUM_SCENARIOS)]
+    data_collects = [make_data_collector(C) for C in scenario_constants]
+    CA = BatchedCellularAutomation(scenario_constants, data_collects)
+    CA.run()
+    batched = np.array([results(data_collect) for data_collect in data_collects], dtype=float)
+    separate = []
+    for seed in range(100, 100 + NUM_SCENARIOS):
+        single = make_automation(make_constants(engine='vectorized', seed=seed, **small_grid))
+        single.run()
+        separate.append(results(single.data_collect))
+    separate = np.array(separate, dtype=float)
+    assert separate[:, 0].mean() > 0.1
+    # Scenarios of a batch are different runs
+    assert len(np.unique(batched[:, 1])) > 1
+    z = welch_z(batched, separate)
+    assert (z <= Z_TOLERANCE).all(), 'z of SAR, S, I, R, deaths: {}'.format(z)
+
+
+# Everyone stays on the grid of their own scenario
+def test_scenarios_are_separate():
+    scenario_constants = [make_constants(engine='vectorized', seed=0, **dict(small_grid, initial_pop_size=n))
+                          for n in [40, 80, 120]]
+    CA = BatchedCellularAutomation(scenario_constants, [make_data_collector(C) for C in scenario_constants])
+    CA.advance(10)
+    pop = CA.population
+    ids = np.flatnonzero(pop.has(ALIVE))
+    grid = CA.grid.reshape(len(scenario_constants), small_grid['height'], small_grid['width'])
+    assert np.array_equal(grid[pop.scenario[ids], pop.y[ids], pop.x[ids]], ids)
+    assert (grid >= 0).sum() == len(ids)
+    for s, C in enumerate(scenario_constants):
+        assert (pop.scenario[:pop.size] == s).sum() == C['grid']['initial_pop_size']
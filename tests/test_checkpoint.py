@@ -0,0 +1,56 @@
+import json
+import numpy as np
+import pytest
+from population import Population
+from checkpoint import save_checkpoint, load_checkpoint
+from helpers import make_constants, make_automation
+
+'''
+Notes:
+- A run checkpointed after some timesteps and resumed gives exactly (bit for bit) the run without the checkpoint, for
+  every engine: same data collected, grid, population and random generator state at the end
+'''
+
+small_grid = {'width': 30, 'height': 30, 'initial_pop_size': 80, 'number_iterations': 8}
+CHECKPOINT_AT = 4
+engines = [('object', {}), ('vectorized', {}), ('jit', {}), ('tiled', {'tiles': 2, 'workers': 1})]
+
+
+def summary_text(data_collect):
+    # nan (eg. R0 of an empty bin) has to compare equal to itself
+    return json.dumps(data_collect.summary(), sort_keys=True, default=float)
+
+
+@pytest.mark.parametrize('engine, grid', engines, ids=[engine for engine, _ in engines])
+def test_resume_is_identical(engine, grid, tmp_path):
+    constants = make_constants(engine=engine, seed=3, **dict(small_grid, **grid))
+    uninterrupted = make_automation(constants)
+    uninterrupted.run()
+    interrupted = make_automation(constants)
+    interrupted.advance(CHECKPOINT_AT)
+    save_checkpoint(interrupted, str(tmp_path))
+    if engine == 'tiled': interrupted.close()
+    resumed = load_checkpoint(str(tmp_path))
+    assert type(resumed) is type(uninterrupted)
+    assert resumed.timestep == CHECKPOINT_AT
+    resumed.run()
+    assert summary_text(resumed.data_collect) == summary_text(uninterrupted.data_collect)
+    assert np.array_equal(resumed.grid, uninterrupted.grid)
+    size = uninterrupted.population.size
+    assert resumed.population.size == size
+    for k in Population.array_names:
+        assert np.array_equal(getattr(resumed.population, k)[:size], getattr(uninterrupted.population, k)[:size]), k
+    assert resumed.rng.bit_generator.state == uninterrupted.rng.bit_generator.state
+
+
+# A new seed forks the run: same state at the checkpoint, different afterwards
+def test_fork_with_new_seed(tmp_path):
+    constants = make_constants(engine='vectorized', seed=3, **small_grid)
+    CA = make_automation(constants)
+    CA.advance(CHECKPOINT_AT)
+    save_checkpoint(CA, str(tmp_path))
+    forks = [load_checkpoint(str(tmp_path), seed=seed) for seed in [10, 11]]
+    for fork in forks:
+        assert np.array_equal(fork.grid, CA.grid)
+        fork.run()
+    assert not np.array_equal(forks[0].population.x[:CA.population.size], forks[1].population.x[:CA.population.size])
@@ -0,0 +1,126 @@
+import numpy as np
+import pytest
+from contacts import CSRMatrix, ContactLayers, adjacency, group_adjacency
+from population import ALIVE
+from rng import make_rng
+from helpers import make_constants, make_automation
+
+'''
+Notes:
+- Obstacle cells are never occupied (at the start and after every step) and people never leave their zone, with few and
+  many SD people
+- Contact layers are symmetric without self contacts, and their infection probability is the one of the notes of
+  `contacts.py` (checked against dense matrices)
+'''
+
+WIDTH, HEIGHT = 30, 30
+small_grid = {'width': WIDTH, 'height': HEIGHT, 'initial_pop_size': 150, 'number_iterations': 25}
+policies = ['low', 'very high']
+
+
+# Random obstacles plus a wall with a gap, saved as a .npy
+def write_obstacles(tmp_path):
+    obstacles = make_rng(0).random((HEIGHT, WIDTH)) < 0.3
+    obstacles[:, WIDTH // 2] = True
+    obstacles[:3, WIDTH // 2] = False
+    path = str(tmp_path / 'obstacles.npy')
+    np.save(path, obstacles.astype(np.int8))
+    return path, obstacles.reshape(-1)
+
+
+# Flat cell of every alive person
+def alive_cells(CA):
+    ids = np.flatnonzero(CA.population.has(ALIVE))
+    return ids, CA.population.y[ids] * WIDTH + CA.population.x[ids]
+
+
+@pytest.mark.parametrize('policy', policies)
+def test_obstacles_never_occupied(policy, tmp_path):
+    path, obstacles = write_obstacles(tmp_path)
+    CA = make_automation(make_constants(policy, engine='vectorized', seed=3, obstacles=path, **small_grid))
+    assert np.array_equal(CA.obstacles, obstacles)
+    moved = False
+    for _ in range(small_grid['number_iterations']):
+        ids, cells = alive_cells(CA)
+        assert not obstacles[cells].any()
+        assert not (CA.grid_flat[obstacles] >= 0).any()
+        assert np.array_equal(CA.grid_flat[cells], ids)
+        CA.advance(1)
+        moved = moved or not np.array_equal(alive_cells(CA)[1], cells[np.isin(ids, alive_cells(CA)[0])])
+    # People did move around the obstacles
+    assert moved
+
+
+@pytest.mark.parametrize('policy', policies)
+def test_zones_never_left(policy, tmp_path):
+    # Four zones: the quadrants of the grid
+    zones = np.add.outer(np.arange(HEIGHT) >= HEIGHT // 2, 2 * (np.arange(WIDTH) >= WIDTH // 2)).astype(np.int64)
+    path = str(tmp_path / 'zones.npy')
+    np.save(path, zones)
+    CA = make_automation(make_constants(policy, engine='vectorized', seed=3, zones=path, **small_grid))
+    zone_of = zones.reshape(-1)[alive_cells(CA)[1]]
+    moved = False
+    for _ in range(small_grid['number_iterations']):
+        before = alive_cells(CA)
+        CA.advance(1)
+        ids, cells = alive_cells(CA)
+        assert np.array_equal(zones.reshape(-1)[cells], zone_of[ids])
+        moved = moved or not np.array_equal(cells, before[1][np.isin(before[0], ids)])
+    assert moved
+
+
+@pytest.mark.parametrize('engine, grid', [('object', {}), ('tiled', {'tiles': 2, 'workers': 1})])
+def test_unsupported_engines(engine, grid, tmp_path):
+    path, _ = write_obstacles(tmp_path)
+    with pytest.raises(AssertionError):
+        make_automation(make_constants(engine=engine, seed=3, obstacles=path, **dict(small_grid, **grid)))
+
+
+def dense(matrix):
+    n = matrix.shape[0]
+    return np.array([matrix.dot(np.eye(n)[i]) for i in range(n)]).T
+
+
+@pytest.mark.parametrize('fraction', [1., 0.5])
+def test_group_adjacency(fraction):
+    n, group_size = 50, 4
+    M = dense(group_adjacency(n, group_size, make_rng(5), fraction))
+    assert np.array_equal(M, M.T)
+    assert (np.diag(M) == 0).all()
+    assert set(np.unique(M)) <= {0, 1}
+    # Groups: cliques of at most group_size people, `fraction` of everyone in one
+    in_group = M.sum(axis=1) > 0
+    assert in_group.sum() <= int(round(fraction * n)) and M.sum(axis=1).max() == group_size - 1
+    for i in np.flatnonzero(in_group):
+        group = np.append(np.flatnonzero(M[i]), i)
+        assert (M[np.ix_(group, group)] + np.eye(len(group)) == 1).all()
+
+
+def test_csr_dot_matches_dense():
+    rng = make_rng(6)
+    n = 40
+    rows, cols = rng.integers(n, size=200), rng.integers(n, size=200)
+    # Duplicates and self contacts are dropped
+    expected = np.zeros((n, n))
+    expected[rows, cols] = expected[cols, rows] = 1
+    np.fill_diagonal(expected, 0)
+    matrix = adjacency(rows, cols, n)
+    x = rng.random(n)
+    assert np.allclose(matrix.dot(x), expected @ x)
+    numpy_matrix = CSRMatrix(matrix.indptr, matrix.indices, matrix.shape)
+    assert np.allclose(numpy_matrix.dot(x), expected @ x)
+
+
+def test_layer_infection_prob():
+    n = 60
+    layers_C = [{'name': 'households', 'group_size': 4, 'transmission_prob': 0.3},
+                {'name': 'work', 'group_size': 10, 'fraction': 0.5, 'transmission_prob': 0.05}]
+    layers = ContactLayers(layers_C, n, make_rng(7))
+    infectious = make_rng(8).random(n) < 0.3
+    expected = np.ones(n)
+    for matrix, layer_C in zip(layers.matrices, layers_C):
+        k = dense(matrix) @ infectious
+        expected *= (1 - layer_C['transmission_prob']) ** k
+    assert np.allclose(layers.infection_prob(infectious), 1 - expected)
+    ids = np.flatnonzero(infectious)
+    assert np.allclose(layers.contacts_of(ids, n), sum(dense(matrix) @ infectious for matrix in layers.matrices))
@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+from helpers import make_constants, make_automation, welch_z
+
+'''
+Notes:
+- Seeded multi replicate comparisons of the engines with the object engine: each engine runs its own fixed seeds on
+  a small grid and its mean S, I, R and cumulative death curves (every `CURVE_EVERY` timesteps) and mean SAR have to
+  be within `Z_TOLERANCE` standard errors of the difference of the means (Welch) of the object engine's
+- Seeds are fixed, so the tests are deterministic. The tolerance is about the sampling noise of that many replicates
+  on a small grid, so only a bias of a few standard errors fails (small biases need more seeds on the default grid,
+  eg. `python kernels.py --seeds 100`)
+'''
+
+# Same density as the default constants, small enough for the object engine to do many seeds
+small_grid = {'width': 30, 'height': 30, 'initial_pop_size': 80, 'number_iterations': 30}
+curves = ['S', 'I', 'R', 'death']
+CURVE_EVERY = 5
+# Above the usual 3 since every curve is compared at many timesteps
+Z_TOLERANCE = 3.5
+OBJECT_SEEDS = range(40)
+VECTORIZED_SEEDS = range(1000, 1080)
+# Fewer seeds: without Numba the jit kernels run as plain Python
+JIT_SEEDS = range(2000, 2012)
+
+
+# SAR (one per seed) and S, I, R and cumulative death curves (seed x timestep x curve) of runs of an engine
+def run_engine(engine, seeds, policy='medium'):
+    SARs, histories = [], []
+    for seed in seeds:
+        CA = make_automation(make_constants(policy, engine=engine, seed=seed, **small_grid))
+        CA.run()
+        data_collect = CA.data_collect
+        history = data_collect.data_history
+        SARs.append(data_collect.SAR)
+        histories.append([history['S'], history['I'], history['R'], np.cumsum(history['death'])])
+    return np.array(SARs, dtype=float), np.array(histories, dtype=float).transpose(0, 2, 1)
+
+
+def assert_equivalent(runs, object_runs):
+    SARs, histories = runs
+    object_SARs, object_histories = object_runs
+    # The epidemic has to spread for the comparison to mean anything
+    assert object_SARs.mean() > 0.1
+    z = welch_z(SARs, object_SARs)
+    assert z <= Z_TOLERANCE, 'SAR: {:.3f} vs object {:.3f} (z = {:.2f})'.format(SARs.mean(), object_SARs.mean(), z)
+    timesteps = np.arange(0, histories.shape[1], CURVE_EVERY)
+    z = welch_z(histories[:, timesteps], object_histories[:, timesteps])
+    for t, i in zip(*np.nonzero(z > Z_TOLERANCE)):
+        raise AssertionError('{} at timestep {}: {:.1f} vs object {:.1f} (z = {:.2f})'.format(
+            curves[i], timesteps[t], histories[:, timesteps[t], i].mean(), object_histories[:, timesteps[t], i].mean(),
+            z[t, i]))
+
+
+@pytest.fixture(scope='module')
+def object_runs():
+    return run_engine('object', OBJECT_SEEDS)
+
+
+def test_vectorized_matches_object(object_runs):
+    assert_equivalent(run_engine('vectorized', VECTORIZED_SEEDS), object_runs)
+
+
+def test_jit_matches_object(object_runs):
+    assert_equivalent(run_engine('jit', JIT_SEEDS), object_runs)
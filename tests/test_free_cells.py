@@ -0,0 +1,70 @@
+import numpy as np
+from free_cells import FreeCells
+from rng import make_rng, UniformBuffer
+from helpers import make_constants, make_automation
+
+'''
+Notes:
+- `FreeCells` against a plain set of open positions under random takes, opens and samples: the slots stay the index
+  of every open cell in the list (-1 for taken cells) and samples are only ever open cells
+'''
+
+WIDTH, HEIGHT = 7, 5
+
+
+def check_invariants(free, open_positions):
+    assert len(free) == len(open_positions)
+    cells = free.cells[:free.size]
+    assert set(free.positions()) == open_positions
+    # Every open cell once, at the slot the index map says
+    assert len(set(cells.tolist())) == free.size
+    assert np.array_equal(free.slots[cells], np.arange(free.size))
+    taken = np.setdiff1d(np.arange(WIDTH * HEIGHT), cells)
+    assert (free.slots[taken] == -1).all()
+    for x in range(WIDTH):
+        for y in range(HEIGHT):
+            assert ((x, y) in free) == ((x, y) in open_positions)
+
+
+def test_take_open_and_sample():
+    rng = make_rng(0)
+    free = FreeCells(WIDTH, HEIGHT, UniformBuffer(make_rng(1)))
+    open_positions = {(x, y) for x in range(WIDTH) for y in range(HEIGHT)}
+    check_invariants(free, open_positions)
+    all_positions = sorted(open_positions)
+    for _ in range(2000):
+        position = all_positions[rng.integers(len(all_positions))]
+        if position in open_positions:
+            free.remove(position)
+            open_positions.remove(position)
+        else:
+            free.append(position)
+            open_positions.add(position)
+        check_invariants(free, open_positions)
+        if open_positions:
+            assert free.random_position() in open_positions
+
+
+# Samples cover every open cell about equally often
+def test_sampling_is_uniform():
+    free = FreeCells(WIDTH, HEIGHT, UniformBuffer(make_rng(2)))
+    for position in [(0, 0), (3, 2), (6, 4), (1, 4)]:
+        free.remove(position)
+    counts = {}
+    num_samples = 200 * len(free)
+    for _ in range(num_samples):
+        position = free.random_position()
+        counts[position] = counts.get(position, 0) + 1
+    assert set(counts) == set(free.positions())
+    expected = num_samples / len(free)
+    # Well within binomial noise (sd about 14 of 200)
+    assert all(abs(count - expected) < 0.4 * expected for count in counts.values())
+
+
+# The open positions of a simulation are the empty cells of its grid
+def test_open_positions_of_a_run():
+    CA = make_automation(make_constants(engine='object', seed=1, width=20, height=20, initial_pop_size=60,
+                                        number_iterations=10))
+    CA.run()
+    empty = {(x, y) for y, x in zip(*np.nonzero(CA.grid < 0))}
+    assert set(CA.open_positions.positions()) == empty
@@ -0,0 +1,149 @@
+import numpy as np
+import pytest
+import main
+from active_set import ActiveSet
+from population import ALIVE, SUSCEPTIBLE, INFECTED, SOCIAL_DISTANCE, WEAR_MASK, INFECTIOUS, NOT_INFECTIOUS, \
+    INFECTIOUS_NO_MASK, INFECTIOUS_MASK
+from helpers import make_constants, make_automation
+
+'''
+Notes:
+- The structures the object engine keeps up to date incrementally checked against a brute-force recomputation after
+  every step of a run (on a small grid, with few and many SD people)
+'''
+
+small_grid = {'width': 30, 'height': 30, 'initial_pop_size': 120, 'number_iterations': 25}
+policies = ['low', 'very high']
+NEIGHBORS = [(dx, dy) for dy in (-1, 0, 1) for dx in (-1, 0, 1) if (dx, dy) != (0, 0)]
+
+
+# Ids on the 8 cells around a person, -1 if empty (plain modulo, nothing shared with the engine)
+def neighbor_ids(CA, id):
+    height, width = CA.grid.shape
+    x, y = int(CA.population.x[id]), int(CA.population.y[id])
+    return [int(CA.grid[(y + dy) % height, (x + dx) % width]) for dx, dy in NEIGHBORS]
+
+
+# Would the update of a person do anything: progress their infection, move (or have to move for SD people) or get
+# an infection check
+def would_change(CA, id):
+    pop = CA.population
+    if CA.due[id] or CA.move_draws[id] < pop.movement_prob(np.array([id]))[0]:
+        return True
+    neighbors = [n for n in neighbor_ids(CA, id) if n >= 0]
+    if pop.has(SOCIAL_DISTANCE, id) and neighbors:
+        return True
+    return bool(pop.has(SUSCEPTIBLE, id)) and any(pop.infection_stage[n] == INFECTIOUS for n in neighbors)
+
+
+# Active set that checks, at the start and the end of its phase, that nobody it skipped would have changed
+class ShadowActiveSet(ActiveSet):
+    missed = []
+
+    def __init__(self, CA, ids, social_distance, skip_inactive=True):
+        super(ShadowActiveSet, self).__init__(CA, ids, social_distance, skip_inactive)
+        self._check('start')
+
+    def _check(self, when):
+        for id in self.members:
+            if not self.seen[id] and would_change(self.CA, id):
+                ShadowActiveSet.missed.append((self.CA.timestep, when, id))
+
+    def __iter__(self):
+        for id in super(ShadowActiveSet, self).__iter__():
+            yield id
+        self._check('end')
+
+
+@pytest.mark.parametrize('policy', policies)
+def test_active_set_skips_only_unchanged_people(policy, monkeypatch):
+    monkeypatch.setattr(main, 'ActiveSet', ShadowActiveSet)
+    ShadowActiveSet.missed = []
+    CA = make_automation(make_constants(policy, engine='object', seed=1, **small_grid))
+    CA.run()
+    # Some people got infected during the run (so the infection checks were exercised)
+    assert CA.data_collect.total_infected > 0
+    assert ShadowActiveSet.missed == []
+
+
+# Run the object engine one step at a time and call `check(CA)` at the start and after every step
+def run_checking(policy, check, active_set=True):
+    CA = make_automation(make_constants(policy, engine='object', seed=1, active_set=active_set, **small_grid))
+    check(CA)
+    for _ in range(CA.grid_C['number_iterations']):
+        CA.advance(1)
+        check(CA)
+    return CA
+
+
+# Every infected person is in the calendar once, at the timestep their next stage starts (from their infection periods)
+def check_calendar(CA):
+    pop = CA.population
+    ids = np.flatnonzero(pop.has(ALIVE) & pop.has(INFECTED))
+    expected = []
+    for id in ids.tolist():
+        step = pop.next_stage_step(id)
+        if step is not None:
+            expected.append((int(pop.infection_timestep[id]) + step, id))
+    timesteps, calendar_ids = CA.calendar.to_arrays()
+    assert sorted(zip(timesteps.tolist(), calendar_ids.tolist())) == sorted(expected)
+    # No event is left behind
+    assert all(t >= CA.timestep for t, _ in expected)
+
+
+@pytest.mark.parametrize('policy', policies)
+@pytest.mark.parametrize('active_set', [True, False])
+def test_event_calendar(policy, active_set):
+    CA = run_checking(policy, check_calendar, active_set)
+    assert CA.data_collect.total_infected > 0
+
+
+# Number of cells of a mask in the 3x3 (wrapped) around every cell, loop by loop
+def brute_force_count(mask):
+    height, width = mask.shape
+    counts = np.zeros(mask.shape, dtype=np.int64)
+    for y in range(height):
+        for x in range(width):
+            counts[y, x] = sum(mask[(y + dy) % height, (x + dx) % width] for dy in (-1, 0, 1) for dx in (-1, 0, 1))
+    return counts
+
+
+def check_neighbor_counts(CA):
+    assert np.array_equal(CA.neighbor_counts, brute_force_count(CA.grid >= 0))
+    # Everyone is on the grid where the population says
+    ids = CA.population.alive_ids()
+    assert np.array_equal(CA.grid[CA.population.y[ids], CA.population.x[ids]], ids)
+    assert (CA.grid >= 0).sum() == len(ids)
+
+
+@pytest.mark.parametrize('policy', policies)
+def test_neighbor_counts(policy):
+    run_checking(policy, check_neighbor_counts)
+
+
+def check_infectious_pressure(CA):
+    pop = CA.population
+    infectious_grid = np.full(CA.grid.shape, NOT_INFECTIOUS, dtype=np.int64)
+    for id in pop.alive_ids().tolist():
+        if pop.infection_stage[id] == INFECTIOUS:
+            infectious_grid[pop.y[id], pop.x[id]] = INFECTIOUS_MASK if pop.has(WEAR_MASK, id) else INFECTIOUS_NO_MASK
+    assert np.array_equal(CA.infectious_grid, infectious_grid)
+    for i, code in enumerate([INFECTIOUS_NO_MASK, INFECTIOUS_MASK]):
+        assert np.array_equal(CA.infectious_counts[i], brute_force_count(infectious_grid == code))
+
+
+@pytest.mark.parametrize('policy', policies)
+def test_infectious_pressure(policy):
+    CA = run_checking(policy, check_infectious_pressure)
+    assert CA.data_collect.total_infected > 0
+
+
+# Kermack-McKendrick probability of every (unmasked, masked) count of infectious neighbors
+def test_infection_prob_table():
+    CA = make_automation(make_constants(engine='object', seed=1, **small_grid))
+    base, decrease = CA.disease_C['base_infection_prob'], CA.disease_C['mask_infection_prob_decrease']
+    for no_mask in range(9):
+        for mask in range(9 - no_mask):
+            r = no_mask + mask
+            p = base - mask * decrease / r if r else 0.
+            assert CA.infection_probs[no_mask, mask] == pytest.approx(1 - (1 - p) ** r)
@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+from helpers import make_constants, make_automation
+
+'''
+Notes:
+- Neighborhood and wrap indices of both engines against a brute-force modulo reference, at every edge and corner of a
+  grid that isn't square (so width and height can't be swapped) and in the middle
+'''
+
+WIDTH, HEIGHT = 9, 7
+
+
+# Corners, the middle of every edge and the middle of the grid
+def edge_positions():
+    xs = [0, WIDTH // 2, WIDTH - 1]
+    ys = [0, HEIGHT // 2, HEIGHT - 1]
+    return [(x, y) for x in xs for y in ys]
+
+
+# (x, y) of the side_length x side_length neighborhood around a position, row by row
+def reference_neighborhood(position, side_length):
+    mid = side_length // 2
+    return [((position[0] + dx) % WIDTH, (position[1] + dy) % HEIGHT)
+            for dy in range(-mid, mid + 1) for dx in range(-mid, mid + 1)]
+
+
+def make_grid_automation(engine):
+    return make_automation(make_constants(engine=engine, seed=0, width=WIDTH, height=HEIGHT, initial_pop_size=10))
+
+
+@pytest.mark.parametrize('side_length', [3, 5, 7])
+def test_object_neighborhood_ids(side_length):
+    CA = make_grid_automation('object')
+    # A different value on every cell, so any wrong cell shows
+    CA.grid = np.arange(WIDTH * HEIGHT, dtype=np.int32).reshape(HEIGHT, WIDTH)
+    for position in edge_positions():
+        expected = [y * WIDTH + x for x, y in reference_neighborhood(position, side_length)]
+        assert CA._get_neighborhood_ids(position, side_length).ravel().tolist() == expected
+
+
+@pytest.mark.parametrize('side_length', [3, 5, 7])
+def test_object_yield_neighbors(side_length):
+    CA = make_grid_automation('object')
+    CA.grid = np.full((HEIGHT, WIDTH), -1, dtype=np.int32)
+    mid = side_length // 2
+    relative = [(dx, dy) for dy in range(-mid, mid + 1) for dx in range(-mid, mid + 1)]
+    for position in edge_positions():
+        neighbors = list(CA._yield_neighbors(position, side_length))
+        assert [n for n, _, _ in neighbors] == [None] * side_length ** 2
+        assert [p for _, p, _ in neighbors] == reference_neighborhood(position, side_length)
+        assert [r for _, _, r in neighbors] == relative
+
+
+def test_object_cell_pos():
+    CA = make_grid_automation('object')
+    for x in range(-WIDTH, 2 * WIDTH):
+        for y in range(-HEIGHT, 2 * HEIGHT):
+            assert CA._get_cell_pos(x, y) == (x % WIDTH, y % HEIGHT)
+
+
+def test_object_infectious_codes():
+    CA = make_grid_automation('object')
+    CA.infectious_grid = (np.arange(WIDTH * HEIGHT) % 3).astype(CA.infectious_grid.dtype).reshape(HEIGHT, WIDTH)
+    for position in edge_positions():
+        expected = [(y * WIDTH + x) % 3 for x, y in reference_neighborhood(position, 3)]
+        assert CA._get_infectious_codes(position).ravel().tolist() == expected
+
+
+def test_vectorized_neighbor_cells():
+    CA = make_grid_automation('vectorized')
+    ids = np.arange(len(edge_positions()))
+    CA.population.x[ids] = [x for x, _ in edge_positions()]
+    CA.population.y[ids] = [y for _, y in edge_positions()]
+    for id, cells in zip(ids, CA._neighbor_cells(ids)):
+        expected = [y * WIDTH + x for x, y in reference_neighborhood(edge_positions()[id], 3)]
+        # Without the middle cell
+        del expected[4]
+        assert cells.tolist() == expected
+
+
+def test_vectorized_cell_neighborhoods():
+    CA = make_grid_automation('vectorized')
+    cells = np.array([y * WIDTH + x for x, y in edge_positions()])
+    for position, neighborhood in zip(edge_positions(), CA._cell_neighborhoods(cells)):
+        assert neighborhood.tolist() == [y * WIDTH + x for x, y in reference_neighborhood(position, 3)]
+
+
+def test_vectorized_neighborhood_count():
+    CA = make_grid_automation('vectorized')
+    occupied = np.random.default_rng(0).random((HEIGHT, WIDTH)) < 0.4
+    counts = CA._neighborhood_count(occupied)
+    for y in range(HEIGHT):
+        for x in range(WIDTH):
+            assert counts[y, x] == sum(occupied[ny, nx] for nx, ny in reference_neighborhood((x, y), 3))
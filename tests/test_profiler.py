@@ -0,0 +1,55 @@
+import pytest
+from person import Person
+from profiler import Profiler, engine_phases, data_collector_phases
+from helpers import make_constants, make_automation
+
+'''
+Notes:
+- A profiled run leaves nothing patched once it's over, whether it finished or failed in the middle
+'''
+
+small_grid = {'width': 20, 'height': 20, 'initial_pop_size': 40, 'number_iterations': 6}
+FAIL_AT = 3
+
+
+class Crash(Exception):
+    pass
+
+
+# Frames that make the run fail at the FAIL_AT-th step
+class FailingFrames:
+    def __init__(self, fail=True):
+        self.fail = fail
+        self.count = 0
+
+    def draw(self, population):
+        self.count += 1
+        if self.fail and self.count == FAIL_AT:
+            raise Crash()
+
+    def close(self):
+        pass
+
+
+def assert_detached(CA, engine, progress_infection):
+    assert Person.progress_infection is progress_infection
+    assert CA.profiler is None
+    assert not set(vars(CA)) & set(engine_phases[engine])
+    assert not set(vars(CA.data_collect)) & set(data_collector_phases)
+
+
+@pytest.mark.parametrize('engine', ['object', 'vectorized'])
+@pytest.mark.parametrize('fail', [False, True])
+def test_detached_after_run(engine, fail):
+    progress_infection = Person.progress_infection
+    CA = make_automation(make_constants(engine=engine, seed=0, **small_grid))
+    profiler = Profiler(memory=False)
+    if fail:
+        with pytest.raises(Crash):
+            CA.run(profiler=profiler, frames=FailingFrames())
+        assert CA.timestep == FAIL_AT
+    else:
+        CA.run(profiler=profiler, frames=FailingFrames(fail=False))
+    assert_detached(CA, engine, progress_infection)
+    # What was recorded is kept
+    assert len(profiler.rows) >= FAIL_AT
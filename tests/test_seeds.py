@@ -0,0 +1,50 @@
+import json
+import numpy as np
+import pytest
+from helpers import make_constants, make_automation
+
+'''
+Notes:
+- Every engine gives the same run for the same seed (data collected and where everyone ends up) and a different run
+  for a different seed
+'''
+
+small_grid = {'width': 30, 'height': 30, 'initial_pop_size': 80, 'number_iterations': 6}
+engines = [('object', {}), ('vectorized', {}), ('jit', {}), ('tiled', {'tiles': 2, 'workers': 1})]
+
+
+# Data collected and final positions and flags of a run
+def run_result(engine, grid, seed):
+    CA = make_automation(make_constants(engine=engine, seed=seed, **dict(small_grid, **grid)))
+    CA.run()
+    size = CA.population.size
+    return (json.dumps(CA.data_collect.summary(), sort_keys=True, default=float),
+            np.array(CA.population.x[:size]), np.array(CA.population.y[:size]), np.array(CA.population.flags[:size]))
+
+
+def same_result(a, b):
+    return a[0] == b[0] and all(np.array_equal(x, y) for x, y in zip(a[1:], b[1:]))
+
+
+@pytest.mark.parametrize('engine, grid', engines, ids=[engine for engine, _ in engines])
+def test_same_seed_same_run(engine, grid):
+    assert same_result(run_result(engine, grid, 7), run_result(engine, grid, 7))
+
+
+@pytest.mark.parametrize('engine, grid', engines, ids=[engine for engine, _ in engines])
+def test_different_seed_different_run(engine, grid):
+    # Not just the seed in the summary: people end up somewhere else
+    a, b = run_result(engine, grid, 7), run_result(engine, grid, 8)
+    assert not np.array_equal(a[1], b[1]) and not np.array_equal(a[2], b[2])
+
+
+# A null seed is resolved to a fresh one, which reproduces the run
+@pytest.mark.parametrize('engine', ['object', 'vectorized'])
+def test_resolved_seed_reproduces(engine):
+    CA = make_automation(make_constants(engine=engine, seed=None, **small_grid))
+    CA.run()
+    assert CA.data_collect.seed == CA.seed is not None
+    size = CA.population.size
+    result = (json.dumps(CA.data_collect.summary(), sort_keys=True, default=float), np.array(CA.population.x[:size]),
+              np.array(CA.population.y[:size]), np.array(CA.population.flags[:size]))
+    assert same_result(result, run_result(engine, {}, CA.seed))
@@ -0,0 +1,102 @@
+import os
+import json
+import time
+import signal
+import threading
+import urllib.request
+import urllib.error
+from http.server import ThreadingHTTPServer
+import pytest
+import service
+from helpers import make_constants
+
+'''
+Notes:
+- A job of the service runs to the end, and a worker dying in the middle of a run fails the runs of its pool and
+  starts a new pool (one worker, through HTTP)
+'''
+
+tiny_grid = {'width': 20, 'height': 20, 'initial_pop_size': 40, 'number_iterations': 5}
+# Long enough to still be running when its worker is killed
+long_grid = {'width': 60, 'height': 60, 'initial_pop_size': 1500, 'number_iterations': 100000}
+TIMEOUT = 60
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), service.ServiceHandler)
+    server.daemon_threads = True
+    server.service = service.SimulationService(make_constants(engine='vectorized', **tiny_grid), workers=1)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    server.service.shutdown()
+
+
+def post(server, spec):
+    request = urllib.request.Request('http://127.0.0.1:{}/jobs'.format(server.server_address[1]),
+                                     data=json.dumps(spec).encode('utf-8'), method='POST')
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, json.load(response)
+    except urllib.error.HTTPError as e:
+        return e.code, json.load(e)
+
+
+def wait_for(condition):
+    end = time.time() + TIMEOUT
+    while not condition():
+        assert time.time() < end, 'Timed out'
+        time.sleep(0.1)
+
+
+def finished(server, job_id):
+    return server.service.info(job_id)['status'] in service.finished_statuses
+
+
+def kill_workers(pool):
+    for pid in list(pool._processes):
+        os.kill(pid, signal.SIGKILL)
+
+
+def test_job_runs(server):
+    code, job = post(server, {'replicates': 2, 'seed': 0})
+    assert code == 202
+    wait_for(lambda: finished(server, job['id']))
+    info = server.service.info(job['id'])
+    assert info['status'] == service.DONE
+    assert [summary['seed'] for summary in info['summaries']] == job['seeds']
+
+
+def test_worker_dies_during_a_run(server):
+    constants = make_constants(engine='vectorized', **long_grid)
+    code, job = post(server, {'constants': constants, 'replicates': 2, 'seed': 0})
+    assert code == 202
+    wait_for(lambda: server.service.info(job['id'])['runs'][0] == service.RUNNING)
+    pool = server.service.pool
+    kill_workers(pool)
+    wait_for(lambda: finished(server, job['id']))
+    assert server.service.info(job['id'])['runs'] == [service.FAILED] * 2
+    wait_for(lambda: server.service.pool is not pool)
+    # The new pool runs jobs
+    code, job = post(server, {'replicates': 1, 'seed': 1})
+    assert code == 202
+    wait_for(lambda: finished(server, job['id']))
+    assert server.service.info(job['id'])['status'] == service.DONE
+
+
+# A job submitted to a pool that broke before any run noticed gets a 503, the next one runs
+def test_submit_to_broken_pool(server):
+    pool = server.service.pool
+    code, job = post(server, {'replicates': 1, 'seed': 0})
+    wait_for(lambda: finished(server, job['id']))
+    kill_workers(pool)
+    wait_for(lambda: pool._broken)
+    code, response = post(server, {'replicates': 2, 'seed': 0})
+    assert code == 503 and 'error' in response
+    assert server.service.pool is not pool
+    code, job = post(server, {'replicates': 1, 'seed': 1})
+    assert code == 202
+    wait_for(lambda: finished(server, job['id']))
+    assert server.service.info(job['id'])['status'] == service.DONE
@@ -0,0 +1,93 @@
+import os
+import numpy as np
+import pytest
+from trajectory import TrajectoryWriter, TrajectoryReader, fields, block_header
+from helpers import make_constants, make_automation
+
+'''
+Notes:
+- A recorded run read back with `TrajectoryReader.state(t)` gives the state of everyone at every timestep (keyframes
+  and deltas, in and out of order), for a closed file and for the file of a run that crashed before closing
+'''
+
+small_grid = {'width': 20, 'height': 20, 'initial_pop_size': 60, 'number_iterations': 12}
+KEYFRAME_EVERY = 4
+
+
+# Writer that also keeps a copy of every state it writes
+class RecordingWriter(TrajectoryWriter):
+    def __init__(self, *args, **kwargs):
+        super(RecordingWriter, self).__init__(*args, **kwargs)
+        self.states = []
+
+    def write_step(self, timestep, population):
+        super(RecordingWriter, self).write_step(timestep, population)
+        self.states.append({k: np.array(getattr(population, k)[:population.size], dtype=dtype) for k, dtype in fields})
+
+
+def record_run(path, engine='object', close=True):
+    constants = make_constants(engine=engine, seed=4, **small_grid)
+    writer = RecordingWriter(path, constants, keyframe_every=KEYFRAME_EVERY)
+    CA = make_automation(constants, trajectory=writer)
+    if close:
+        CA.run()
+    else:
+        # Crashed run: the writer is never closed
+        CA.advance(small_grid['number_iterations'])
+    return CA, writer
+
+
+def assert_state(reader, timestep, expected):
+    state = reader.state(timestep)
+    assert state.timestep == timestep
+    for k, _ in fields:
+        assert np.array_equal(getattr(state, k), expected[k]), (timestep, k)
+
+
+@pytest.mark.parametrize('engine', ['object', 'vectorized'])
+def test_round_trip(engine, tmp_path):
+    path = str(tmp_path / 'run.traj')
+    CA, writer = record_run(path, engine)
+    reader = TrajectoryReader(path)
+    assert reader.complete
+    assert reader.seed == CA.seed
+    assert len(reader) == len(writer.states) == small_grid['number_iterations'] + 1
+    # Forward (from the cached state), backward and jumping around (from keyframes)
+    order = list(range(len(reader))) + list(reversed(range(len(reader)))) + [7, 2, 11, 5, 0, 9]
+    for t in order:
+        assert_state(reader, t, writer.states[t])
+
+
+def test_crashed_run(tmp_path):
+    path = str(tmp_path / 'crashed.traj')
+    CA, writer = record_run(path, close=False)
+    # What is on disk when the process dies: everything up to the last keyframe at least
+    crashed_path = str(tmp_path / 'copy.traj')
+    with open(path, 'rb') as f, open(crashed_path, 'wb') as copy:
+        copy.write(f.read())
+    reader = TrajectoryReader(crashed_path)
+    assert not reader.complete
+    assert reader.seed == CA.seed
+    last_keyframe = (len(writer.states) - 1) // KEYFRAME_EVERY * KEYFRAME_EVERY
+    assert last_keyframe < len(reader) <= len(writer.states)
+    for t in range(len(reader)):
+        assert_state(reader, t, writer.states[t])
+    writer.close()
+
+
+# A closed file cut in the middle of its last block: every block before it is still read
+def test_truncated_block(tmp_path):
+    path = str(tmp_path / 'run.traj')
+    _, writer = record_run(path)
+    reader = TrajectoryReader(path)
+    offset, length, _ = reader.index[len(reader) - 1]
+    del reader
+    truncated_path = str(tmp_path / 'truncated.traj')
+    with open(path, 'rb') as f, open(truncated_path, 'wb') as truncated:
+        truncated.write(f.read()[:int(offset) + int(length) // 2])
+    assert os.path.getsize(truncated_path) > block_header.size
+    reader = TrajectoryReader(truncated_path)
+    assert not reader.complete
+    assert len(reader) == len(writer.states) - 1
+    for t in range(len(reader)):
+        assert_state(reader, t, writer.states[t])
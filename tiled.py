@@ -0,0 +1,270 @@
+import numpy as np
+import os
+import weakref
+from multiprocessing import Pool, shared_memory
+from vectorized import VectorizedCellularAutomation, INFECTIOUS_NO_MASK, INFECTIOUS_MASK, NEIGHBOR_DX, NEIGHBOR_DY
+from population import Population, ALIVE, INFECTIOUS, WEAR_MASK, SOCIAL_DISTANCE
+from rng import make_rng
+
+'''
+Notes:
+- Domain decomposition of the vectorized engine for huge grids: the (toroidal) grid is split into horizontal strips of
+  rows ("tiles") and the people of each tile are stepped by a pool of worker processes
+    - The grid and every population array live in shared memory (`multiprocessing.shared_memory`), so workers read and
+      write them directly and nothing but tile bounds and counters goes through pickling
+    - Strips span the full width, so wrapping around in x stays inside a tile and only rows need a halo
+- A tile is stepped on a copy of its rows plus a halo of `move_length + 1` rows above and below (halo exchange), and
+  the copy is written back when it is done
+    - A mover can walk `move_length` cells out of its tile (cross-tile migration) and the safe cell check looks one
+      cell further, so the halo holds everything a phase of a tile can read or write
+    - Tiles are stepped in two rounds, even tiles then odd tiles: tiles of the same round are never next to each other
+      so their windows don't overlap (needs an even number of tiles, each at least twice the halo high), the odd tiles
+      see the moves of the even ones through the written back rows
+- Same two-phase ordering as the other engines: infection progression (in the main process), then the non SD people
+  of every tile, then the SD people of every tile
+    - The tile of a person is decided by their row at the start of a phase, so people that migrate during the phase
+      aren't stepped again by the tile they end up in
+- Random draws of a tile come from a generator seeded by (seed, timestep, phase, tile), so a run is reproducible for
+  the same seed and tiles no matter how many workers step them
+- Grid constants: `tiles` (number of strips, null to pick from the workers) and `workers` (processes, null for all CPU
+  cores, 0 or 1 to step the tiles in the main process)
+- The shared memory is freed at the end of `run` (or with `close()` after using `advance`, or `with
+  TiledCellularAutomation(...) as CA:`), the arrays are copied back into normal memory first
+    - If it is never closed the blocks are still unlinked when the engine is garbage collected or at exit
+- Checkpoints of a tiled run (see `checkpoint.py`) are loaded as the tiled engine (with new shared memory)
+'''
+
+# Per process state of a worker: the shared blocks it attached to and the engine that steps tiles on them
+_worker = {}
+
+
+# Unlink shared memory blocks ({name: SharedMemory}), they are only unmapped once no array uses them anymore
+def _free_blocks(blocks):
+    for block in list(blocks.values()):
+        try:
+            block.close()
+        except BufferError:
+            pass
+        block.unlink()
+    blocks.clear()
+
+
+class TiledCellularAutomation(VectorizedCellularAutomation):
+    # Tiles step the grid rules only (see `contacts.py`)
+    structure_support = []
+
+    def __init__(self, constants, data_collect):
+        super(TiledCellularAutomation, self).__init__(constants, data_collect)
+        self._init_tiles()
+
+    # Tiles, workers and shared memory of the grid and population (also for a simulation loaded from a checkpoint)
+    def _init_tiles(self):
+        self.constants = {'grid': self.grid_C, 'render': self.render_C, 'person': self.person_C,
+                          'disease': self.disease_C}
+        self.halo = self.person_C['move_length'] + 1
+        workers = self.grid_C.get('workers')
+        self.workers = os.cpu_count() if workers is None else workers
+        num_tiles = self.grid_C.get('tiles')
+        if num_tiles is None:
+            num_tiles = min(2 * max(self.workers, 1), self.height // (2 * self.halo))
+            num_tiles -= num_tiles % 2
+        assert num_tiles >= 2 and num_tiles % 2 == 0, 'Number of tiles has to be even and at least 2'
+        assert self.height // num_tiles >= 2 * self.halo, \
+            'Tiles have to be at least {} rows high (2 * (move_length + 1))'.format(2 * self.halo)
+        # First row of every tile (and the end of the last one)
+        self.tile_rows = np.linspace(0, self.height, num_tiles + 1).astype(np.int64)
+        self.num_tiles = num_tiles
+        self.pool = None
+        self._share()
+
+    # Shared memory ------
+    # Move the grid and the population arrays into shared memory blocks
+    def _share(self):
+        # {name: SharedMemory} and {name: (block name, shape, dtype)} for the workers to attach to
+        self.shared = {}
+        self.shared_specs = {}
+        # Blocks are unlinked when the engine is garbage collected or at exit if `close` was never called
+        self._finalizer = weakref.finalize(self, _free_blocks, self.shared)
+
+        def share(name, array):
+            block = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+            view = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+            view[...] = array
+            self.shared[name] = block
+            self.shared_specs[name] = (block.name, array.shape, array.dtype.str)
+            return view
+
+        self.grid = share('grid', self.grid)
+        self.grid_flat = self.grid.reshape(-1)
+        for k in Population.array_names:
+            setattr(self.population, k, share('population.' + k, getattr(self.population, k)))
+        # Ids of a phase sorted by tile (each tile steps a slice of it)
+        self.phase_ids = share('phase_ids', np.zeros(self.population.capacity, dtype=np.int64))
+
+    # Stop the workers and free the shared memory (arrays are copied back into normal memory first)
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        if not self.shared:
+            return
+        self.grid = np.array(self.grid)
+        self.grid_flat = self.grid.reshape(-1)
+        for k in Population.array_names:
+            setattr(self.population, k, np.array(getattr(self.population, k)))
+        self.phase_ids = None
+        _worker.clear()
+        self._finalizer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _map(self, tasks):
+        if self.workers <= 1:
+            # Weak reference, so the worker state doesn't keep the engine (and its shared memory) alive
+            if _worker.get('owner') is None or _worker['owner']() is not self:
+                _worker.clear()
+                _worker['owner'] = weakref.ref(self)
+                _worker['tile'] = TileEngine(self.constants, self.population, self.grid, self.phase_ids, self.halo)
+            return [_step_tile(task) for task in tasks]
+        if self.pool is None:
+            self.pool = Pool(processes=self.workers, initializer=_init_worker,
+                             initargs=(self.shared_specs, self.constants, self.population.size, self.halo))
+        return self.pool.map(_step_tile, tasks, chunksize=1)
+
+    # Stepping ------
+    def _tiled_phase(self, ids, phase):
+        pop = self.population
+        ids = ids[pop.has(ALIVE, ids)]
+        tiles = np.searchsorted(self.tile_rows, pop.y[ids], side='right') - 1
+        order = np.argsort(tiles, kind='stable')
+        self.phase_ids[:len(ids)] = ids[order]
+        ends = np.cumsum(np.bincount(tiles, minlength=self.num_tiles))
+        starts = ends - np.bincount(tiles, minlength=self.num_tiles)
+        for parity in (0, 1):
+            tasks = [(t, int(self.tile_rows[t]), int(self.tile_rows[t + 1]), int(starts[t]), int(ends[t]),
+                      [self.seed, self.timestep, phase, t], self.profiler is not None)
+                     for t in range(parity, self.num_tiles, 2)]
+            for counts in self._map(tasks):
+                self.data_collect.increment_total_infected(counts.pop('total_infected', 0))
+                if self.profiler is not None:
+                    for name, amount in list(counts.items()):
+                        self.profiler.count(name, amount)
+
+    def step(self):
+        # SD membership at the start of the step decides the phase of each person
+        ids = self.population.alive_ids()
+        SD = self.population.has(SOCIAL_DISTANCE, ids)
+        SD_ids, not_SD_ids = ids[SD], ids[~SD]
+        # Non SD people of every tile first, then SD people (each progressed right before their phase)
+        self._progress_infection(not_SD_ids)
+        self._tiled_phase(not_SD_ids, 0)
+        self._progress_infection(SD_ids)
+        self._tiled_phase(SD_ids, 1)
+        self.data_collect.update_population(self.population)
+
+    def run(self, render=False, profiler=None, frames=None):
+        try:
+            super(TiledCellularAutomation, self).run(render, profiler, frames)
+        finally:
+            self.close()
+
+
+# Worker side ------
+def _init_worker(specs, constants, population_size, halo):
+    blocks = {name: shared_memory.SharedMemory(name=spec[0]) for name, spec in list(specs.items())}
+    arrays = {name: np.ndarray(spec[1], dtype=np.dtype(spec[2]), buffer=blocks[name].buf)
+              for name, spec in list(specs.items())}
+    population = Population(1, constants['person'], constants['disease'], make_rng(0))
+    for k in Population.array_names:
+        setattr(population, k, arrays['population.' + k])
+    population.capacity = len(population.x)
+    population.size = population_size
+    _worker['blocks'] = blocks
+    _worker['tile'] = TileEngine(constants, population, arrays['grid'], arrays['phase_ids'], halo)
+
+
+# Returns the counters of the tile (people infected, and profiler counters if asked)
+def _step_tile(task):
+    tile, first_row, end_row, start, end, entropy, count = task
+    recorder = TileRecorder()
+    _worker['tile'].step_tile(first_row, end_row, start, end, make_rng(entropy), recorder, count)
+    return recorder.counts
+
+
+# Stands in for the data collector and the profiler inside a tile
+class TileRecorder:
+    def __init__(self):
+        self.counts = {}
+
+    def count(self, name, amount=1):
+        self.counts[name] = self.counts.get(name, 0) + int(amount)
+
+    def increment_total_infected(self, amount=1):
+        self.count('total_infected', amount)
+
+
+# Steps the people of one tile with the vectorized rules on a window of rows (the tile plus the halo), not a full
+# simulation on its own
+class TileEngine(VectorizedCellularAutomation):
+    def __init__(self, constants, population, grid, phase_ids, halo):
+        self.grid_C = constants['grid']
+        self.person_C = constants['person']
+        self.disease_C = constants['disease']
+        self.population = population
+        self.global_grid = grid
+        self.phase_ids = phase_ids
+        self.halo = halo
+        self.global_height, self.width = grid.shape
+        self.profiler = None
+
+    def step_tile(self, first_row, end_row, start, end, rng, recorder, count):
+        # Halo exchange in: copy the rows of the window
+        self.first_row = first_row - self.halo
+        rows = np.arange(self.first_row, end_row + self.halo) % self.global_height
+        self.grid = self.global_grid[rows]
+        self.grid_flat = self.grid.reshape(-1)
+        self.height = len(rows)
+        self.infectious_grid = np.zeros(self.grid.shape, dtype=np.int8)
+        self.infectious_grid_flat = self.infectious_grid.reshape(-1)
+        # New courses of people infected in the tile are drawn from the tile's generator too
+        population_rng = self.population.rng
+        self.rng = self.population.rng = rng
+        self.data_collect = recorder
+        self.profiler = recorder if count else None
+        try:
+            self._update_phase(np.array(self.phase_ids[start:end]))
+        finally:
+            self.population.rng = population_rng
+        # Halo exchange out: write the window back
+        self.global_grid[rows] = self.grid
+
+    # Window rows of people
+    def _rows(self, ids):
+        return (self.population.y[ids] - self.first_row) % self.global_height
+
+    def _cells(self, ids):
+        return self._rows(ids) * self.width + self.population.x[ids]
+
+    # People never get closer than one cell to the edge of the window, so rows don't wrap
+    def _neighbor_cells(self, ids):
+        xs = (self.population.x[ids, None] + NEIGHBOR_DX) % self.width
+        ys = self._rows(ids)[:, None] + NEIGHBOR_DY
+        return ys * self.width + xs
+
+    def _move_people(self, ids, new_cells):
+        old_cells = super(TileEngine, self)._move_people(ids, new_cells)
+        self.population.y[ids] = (new_cells // self.width + self.first_row) % self.global_height
+        return old_cells
+
+    # Infectious people in the window (including the halo)
+    def _refresh_infectious_grid(self):
+        pop = self.population
+        ids = self.grid_flat[self.grid_flat >= 0]
+        ids = ids[pop.infection_stage[ids] == INFECTIOUS]
+        self.infectious_grid_flat[self._cells(ids)] = np.where(pop.has(WEAR_MASK, ids), INFECTIOUS_MASK,
+                                                               INFECTIOUS_NO_MASK)
@@ -0,0 +1,246 @@
+import numpy as np
+import json
+import zlib
+import struct
+import csv
+from population import ALIVE
+
+'''
+Notes:
+- Records the position and state (flags, infection and symptom stage) of every person at every timestep in one compact
+  binary file, and replays any timestep of it without re-simulating
+- Each timestep is one zlib compressed block:
+    - Keyframe (every `keyframe_every` timesteps, and the first one): the full arrays
+    - Otherwise deltas from the timestep before: the move in x and y (int8, shortest way around the wrapping grid) and
+      the XOR of the flags and stages, which are mostly zeros so they compress to almost nothing
+    - A timestep where someone moved further than an int8 is a keyframe too
+- File: magic, a JSON header (constants, seed...) and its length, the blocks (each after its length and keyframe
+  flag), then at `close` an index (int64 offset, length and keyframe of every timestep), a JSON footer (number of
+  people and timesteps...), the footer's length and an end marker, the index and blocks are read through a memory map
+    - A file without the end marker (the run crashed before closing the writer) is still readable: the index is
+      rebuilt by walking the blocks from their lengths, up to the last complete one
+    - The file is flushed after every keyframe, so at most the timesteps since the last keyframe are lost
+- Record through the data collector (it gets the population of every timestep, including the initial one):
+  `DataCollector(..., trajectory=TrajectoryWriter('run.traj', constants))` (the seed is set by the simulation)
+- Replay: `TrajectoryReader('run.traj').state(t)` is a population-like view (`x`, `y`, `flags`, stages, `has`,
+  `alive_ids`) that the render functions take, eg. `replay(path, Renderer(...))` or with a `FrameExporter`
+- `export_csv` writes some timesteps of it as one row per person per timestep (eg. for the Tableau workbooks)
+'''
+
+MAGIC = b'CATRAJ2\n'
+END_MAGIC = b'CATRAJEND'
+# Before every block: its length and if it is a keyframe
+block_header = struct.Struct('<IB')
+DEFAULT_KEYFRAME_EVERY = 50
+# Per person arrays in a block, in order
+fields = [('x', np.int32), ('y', np.int32), ('flags', np.uint16), ('infection_stage', np.int8),
+          ('symptom_stage', np.int8)]
+# Same for a delta block (the x and y moves, the rest XORed)
+delta_fields = [('x', np.int8), ('y', np.int8), ('flags', np.uint16), ('infection_stage', np.uint8),
+                ('symptom_stage', np.uint8)]
+
+
+class TrajectoryWriter:
+    def __init__(self, path, constants, seed=None, keyframe_every=DEFAULT_KEYFRAME_EVERY, level=6):
+        self.path = path
+        self.file = open(path, 'wb')
+        self.width = constants['grid']['width']
+        self.height = constants['grid']['height']
+        self.footer = {'constants': constants, 'seed': seed, 'keyframe_every': keyframe_every}
+        self.keyframe_every = keyframe_every
+        self.level = level
+        # Rows of (offset, length, keyframe)
+        self.index = []
+        self.previous = None
+        # Timestep of the first state (a run resumed from a checkpoint starts later)
+        self.first_timestep = None
+
+    # Seed the run actually uses (also in the constants, so the run can be reproduced from the file)
+    def set_seed(self, seed):
+        assert self.first_timestep is None, 'The seed has to be set before the first timestep is written'
+        constants = self.footer['constants']
+        self.footer['constants'] = dict(constants, grid=dict(constants['grid'], seed=seed))
+        self.footer['seed'] = seed
+
+    # Shortest move around a wrapping axis
+    def _move(self, new, old, size):
+        return (new - old + size // 2) % size - size // 2
+
+    # State of everyone at the next timestep (timesteps have to come in order)
+    def write_step(self, timestep, population):
+        if self.first_timestep is None:
+            self.first_timestep = self.footer['first_timestep'] = timestep
+            self._write_header()
+        assert timestep == self.first_timestep + len(self.index), 'Timesteps have to be written in order'
+        state = {k: np.array(getattr(population, k)[:population.size], dtype=dtype) for k, dtype in fields}
+        keyframe = self.previous is None or len(self.index) % self.keyframe_every == 0 or \
+            len(state['x']) != len(self.previous['x'])
+        if not keyframe:
+            moves = [self._move(state['x'], self.previous['x'], self.width),
+                     self._move(state['y'], self.previous['y'], self.height)]
+            keyframe = max(np.abs(moves[0]).max(initial=0), np.abs(moves[1]).max(initial=0)) > 127
+        if keyframe:
+            data = b''.join(state[k].tobytes() for k, _ in fields)
+        else:
+            changes = moves + [state[k] ^ self.previous[k] for k in ['flags', 'infection_stage', 'symptom_stage']]
+            data = b''.join(change.astype(dtype).tobytes() for change, (_, dtype) in zip(changes, delta_fields))
+        block = zlib.compress(data, self.level)
+        self.file.write(block_header.pack(len(block), int(keyframe)))
+        self.index.append((self.file.tell(), len(block), int(keyframe)))
+        self.file.write(block)
+        self.previous = state
+        self.footer['num_people'] = len(state['x'])
+        # What a crashed run leaves on disk ends at a keyframe at worst
+        if keyframe: self.file.flush()
+
+    # What is known before the first timestep (all a crashed run's file needs besides its blocks)
+    def _write_header(self):
+        header = json.dumps(self.footer).encode('utf-8')
+        self.file.write(MAGIC + struct.pack('<Q', len(header)) + header)
+
+    def close(self):
+        if self.file is None:
+            return
+        if self.first_timestep is None:
+            self._write_header()
+        self.footer['index_offset'] = self.file.tell()
+        self.footer['num_steps'] = len(self.index)
+        self.file.write(np.array(self.index, dtype=np.int64).reshape(-1, 3).tobytes())
+        footer = json.dumps(self.footer).encode('utf-8')
+        self.file.write(footer)
+        self.file.write(struct.pack('<Q', len(footer)) + END_MAGIC)
+        self.file.close()
+        self.file = None
+
+
+# The state of everyone at one timestep (what the render functions need of a `Population`)
+class TrajectoryState:
+    def __init__(self, timestep, arrays):
+        self.timestep = timestep
+        for k, _ in fields:
+            setattr(self, k, arrays[k])
+        self.size = len(self.x)
+
+    def has(self, flag, ids=None):
+        if ids is None:
+            return (self.flags & flag) != 0
+        return (self.flags[ids] & flag) != 0
+
+    def alive_ids(self):
+        return np.flatnonzero(self.has(ALIVE))
+
+
+class TrajectoryReader:
+    def __init__(self, path):
+        self.data = np.memmap(path, dtype=np.uint8, mode='r')
+        assert self.data[:len(MAGIC)].tobytes() == MAGIC, '{} is not a trajectory file'.format(path)
+        # The run finished (or at least closed the writer)
+        self.complete = self.data[-len(END_MAGIC):].tobytes() == END_MAGIC
+        if self.complete:
+            end = len(self.data) - len(END_MAGIC)
+            footer_length = struct.unpack('<Q', self.data[end - 8:end].tobytes())[0]
+            self.footer = json.loads(self.data[end - 8 - footer_length:end - 8].tobytes().decode('utf-8'))
+            self.index = np.memmap(path, dtype=np.int64, mode='r', offset=self.footer['index_offset'],
+                                   shape=(self.footer['num_steps'], 3))
+        else:
+            self.footer, self.index = self._scan()
+        self.constants = self.footer['constants']
+        self.seed = self.footer['seed']
+        self.num_steps = self.footer['num_steps']
+        self.first_timestep = self.footer.get('first_timestep', 0)
+        self.num_people = self.footer.get('num_people', 0)
+        self.width = self.constants['grid']['width']
+        self.height = self.constants['grid']['height']
+        # Last decoded state (moving forward from it is cheaper than from a keyframe)
+        self.cached = None
+
+    # Header and index of a file without a footer: walk the blocks, the last one might be cut short
+    def _scan(self):
+        start = len(MAGIC) + 8
+        assert len(self.data) >= start, 'Trajectory file has no timesteps'
+        header_length = struct.unpack('<Q', self.data[len(MAGIC):start].tobytes())[0]
+        footer = json.loads(self.data[start:start + header_length].tobytes().decode('utf-8'))
+        index = []
+        offset = start + header_length
+        while offset + block_header.size <= len(self.data):
+            length, keyframe = block_header.unpack(self.data[offset:offset + block_header.size].tobytes())
+            offset += block_header.size
+            if offset + length > len(self.data):
+                break
+            index.append((offset, length, keyframe))
+            offset += length
+        index = np.array(index, dtype=np.int64).reshape(-1, 3)
+        footer['num_steps'] = len(index)
+        if len(index):
+            # The first block is a keyframe: all the per person arrays
+            person_size = sum(np.dtype(dtype).itemsize for _, dtype in fields)
+            footer['num_people'] = len(zlib.decompress(self.data[index[0, 0]:index[0, 0] + index[0, 1]])) // person_size
+        return footer, index
+
+    def __len__(self):
+        return self.num_steps
+
+    def _arrays(self, timestep, field_types):
+        offset, length, _ = self.index[timestep]
+        data = zlib.decompress(self.data[offset:offset + length])
+        arrays, start = {}, 0
+        for k, dtype in field_types:
+            end = start + self.num_people * np.dtype(dtype).itemsize
+            arrays[k] = np.frombuffer(data[start:end], dtype=dtype)
+            start = end
+        return arrays
+
+    def _apply_delta(self, arrays, timestep):
+        changes = self._arrays(timestep, delta_fields)
+        return {'x': (arrays['x'] + changes['x']) % self.width, 'y': (arrays['y'] + changes['y']) % self.height,
+                'flags': arrays['flags'] ^ changes['flags'],
+                'infection_stage': arrays['infection_stage'] ^ changes['infection_stage'].view(np.int8),
+                'symptom_stage': arrays['symptom_stage'] ^ changes['symptom_stage'].view(np.int8)}
+
+    # State at any timestep: decoded from the last keyframe before it (or the last state read if that is closer)
+    def state(self, timestep):
+        assert 0 <= timestep - self.first_timestep < self.num_steps, 'Timestep {} is not in the trajectory'.format(timestep)
+        timestep -= self.first_timestep
+        keyframe = timestep
+        while not self.index[keyframe, 2]:
+            keyframe -= 1
+        if self.cached is not None and keyframe <= self.cached.timestep <= timestep:
+            start, arrays = self.cached.timestep, {k: getattr(self.cached, k) for k, _ in fields}
+        else:
+            start, arrays = keyframe, {k: v.astype(dtype) for (k, dtype), v in
+                                       zip(fields, self._arrays(keyframe, fields).values())}
+        for t in range(start + 1, timestep + 1):
+            arrays = self._apply_delta(arrays, t)
+        arrays = {k: arrays[k].astype(dtype) for k, dtype in fields}
+        self.cached = TrajectoryState(timestep, arrays)
+        return TrajectoryState(self.first_timestep + timestep, arrays)
+
+    def __iter__(self):
+        for t in range(self.num_steps):
+            yield self.state(self.first_timestep + t)
+
+
+# Draw timesteps of a trajectory with a `Renderer` (see `render.py`) or a `FrameExporter` (see `frame_export.py`)
+def replay(path, renderer, start=0, end=None):
+    reader = TrajectoryReader(path)
+    start = max(start, reader.first_timestep)
+    end = reader.first_timestep + reader.num_steps if end is None else end
+    for t in range(start, end):
+        renderer.draw(reader.state(t))
+    if hasattr(renderer, 'close'): renderer.close()
+    return reader
+
+
+# One row per alive person per timestep (every `every`th timestep of [start, end))
+def export_csv(path, out_path, start=0, end=None, every=1):
+    reader = TrajectoryReader(path)
+    start = max(start, reader.first_timestep)
+    end = reader.first_timestep + reader.num_steps if end is None else end
+    with open(out_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['timestep', 'id'] + [k for k, _ in fields])
+        for t in range(start, end, every):
+            state = reader.state(t)
+            ids = state.alive_ids()
+            columns = [np.full(len(ids), t), ids] + [getattr(state, k)[ids] for k, _ in fields]
+            writer.writerows(np.stack(columns, axis=1).tolist())
@@ -0,0 +1,347 @@
+import numpy as np
+from main import policies_safety
+from rng import resolve_seed, make_rng
+from contacts import ContactLayers, configured_structure, load_obstacles, load_zones, CONTACT_LAYERS_STREAM
+from population import Population, ALIVE, SUSCEPTIBLE, INFECTED, RECOVERED, SOCIAL_DISTANCE, \
+    SOCIAL_DISTANCE_BEFORE_SYMPTOMS, WEAR_MASK, WEAR_MASK_BEFORE_SYMPTOMS, ALTRUISTIC, LATENT, INFECTIOUS, RECOVER, \
+    INCUBATION, MILD, SEVERE, DEATH, NO_STAGE, NORMAL_MOVEMENT, LOW_MOVEMENT, NO_MOVEMENT, \
+    DAYS_SD, DAYS_NOT_SD, DAYS_WM, DAYS_NOT_WM, NOT_INFECTIOUS, INFECTIOUS_NO_MASK, INFECTIOUS_MASK
+
+'''
+Notes:
+- Same rules as `CellularAutomation` in `main.py` (and the same `Population` arrays to store people) but each timestep is computed with batched array operations instead of looping through `Person` objects
+- People are updated synchronously within each phase (non SD people first, then SD people) instead of one at a time,
+  so conflicts (two people moving to the same cell, or two SD people moving next to each other) are settled by a
+  random priority; the curves match the object engine statistically but not step for step (see `tests/test_engines.py`)
+- The infection of the people of a phase progresses right before the phase, like at their turn in the object engine
+  (progressing everyone before the non SD phase moved the stages of SD people a phase earlier, which lowered the SAR)
+- Optional spatial structure (see `contacts.py`): obstacle cells nobody is placed on or moves onto, zones people only
+  move within, and contact layers (eg. households) checked once per timestep with sparse matrix-vector products
+'''
+
+# Relative positions of the 8 neighbors (same order as `_yield_neighbors` without the middle cell)
+NEIGHBOR_DX = np.array([-1, 0, 1, -1, 1, -1, 0, 1])
+NEIGHBOR_DY = np.array([-1, -1, -1, 0, 0, 1, 1, 1])
+# Same with the middle cell (the whole 3x3)
+NEIGHBORHOOD_DX = np.array([-1, 0, 1, -1, 0, 1, -1, 0, 1])
+NEIGHBORHOOD_DY = np.array([-1, -1, -1, 0, 0, 0, 1, 1, 1])
+
+
+class VectorizedCellularAutomation:
+    # Spatial structure grid constants the engine can run with (see `contacts.py`)
+    structure_support = ['obstacles', 'zones', 'contact_layers']
+    # Flat obstacle (bool) and zone (label) masks and `ContactLayers`, None if not used
+    obstacles = None
+    zones = None
+    contact_layers = None
+
+    def __init__(self, constants, data_collect):
+        self.grid_C = constants['grid']
+        self.render_C = constants['render']
+        self.person_C = constants['person']
+        self.disease_C = constants['disease']
+        self.data_collect = data_collect
+        # Every random draw comes from one generator made from the seed (see `rng.py`)
+        self.seed = resolve_seed(self.grid_C.get('seed'))
+        self.rng = make_rng(self.seed)
+        self.data_collect.set_seed(self.seed)
+        self.width = self.grid_C['width']
+        self.height = self.grid_C['height']
+        # Grid stores the person IDs (index into the arrays) in a 2D structure, -1 if empty
+        self.grid = np.full((self.height, self.width), -1, dtype=np.int32)
+        self.grid_flat = self.grid.reshape(-1)
+        # Infectious code of the person on each cell (see `population.py`)
+        self.infectious_grid = np.zeros((self.height, self.width), dtype=np.int8)
+        self.infectious_grid_flat = self.infectious_grid.reshape(-1)
+        # Number of timesteps done so far (a run can start later if resumed from a checkpoint)
+        self.timestep = 0
+        # Optional `Profiler` (see `profiler.py`), set while a profiled run is running
+        self.profiler = None
+        self._load_structure(self.seed)
+        # Initialize the people and the grid
+        self._initialize_people()
+
+    # Obstacles, zones and contact layers of the grid constants (the layers' groups are drawn from seed)
+    def _load_structure(self, seed):
+        unsupported = set(configured_structure(self.grid_C)) - set(self.structure_support)
+        assert not unsupported, 'This engine does not support {}'.format(', '.join(sorted(unsupported)))
+        if self.grid_C.get('obstacles') is not None:
+            self.obstacles = load_obstacles(self.grid_C['obstacles'], self.width, self.height)
+        if self.grid_C.get('zones') is not None:
+            self.zones = load_zones(self.grid_C['zones'], self.width, self.height)
+        if self.grid_C.get('contact_layers'):
+            self.contact_layers = ContactLayers(self.grid_C['contact_layers'], self.grid_C['initial_pop_size'],
+                                                make_rng([seed, CONTACT_LAYERS_STREAM]))
+
+    # Grid initialization ------
+    def _initialize_people(self):
+        n = self.grid_C['initial_pop_size']
+        assert n <= self.width * self.height, 'More people ({}) than cells'.format(n)
+        self.population = Population(n, self.person_C, self.disease_C, self.rng)
+        policy = policies_safety[self.person_C['policy_type']]
+        # Random (unique) positions, not on obstacles
+        if self.obstacles is None:
+            cells = self.rng.choice(self.width * self.height, size=n, replace=False)
+        else:
+            free_cells = np.flatnonzero(~self.obstacles)
+            assert n <= len(free_cells), 'More people ({}) than cells without obstacles'.format(n)
+            cells = self.rng.choice(free_cells, size=n, replace=False)
+        age = self.rng.integers(self.person_C['age_range'][0], self.person_C['age_range'][1] + 1, size=n)
+        SD = self.rng.random(n) < policy['social_distance_prob']
+        WM = self.rng.random(n) < policy['wear_mask_prob']
+        altruistic = self.rng.random(n) < self.person_C['altruistic_prob']
+        infected = self.rng.random(n) < self.person_C['initial_infection_prob']
+        ids = self.population.add(cells % self.width, cells // self.width, age, SD, WM, altruistic, infected)
+        self.grid_flat[cells] = ids
+        # Initial data
+        self.data_collect.increment_initial_S(int((~infected).sum()))
+        self.data_collect.update_population(self.population)
+
+    # Neighbors ------
+    # Flat cell indices of the 8 neighbors of each of the given people, shape (len(ids), 8)
+    def _neighbor_cells(self, ids):
+        xs = (self.population.x[ids, None] + NEIGHBOR_DX) % self.width
+        ys = (self.population.y[ids, None] + NEIGHBOR_DY) % self.height
+        return ys * self.width + xs
+
+    # Number of nonzero cells in the 3x3 (wrapped) around each cell, including the cell itself (the last two axes are
+    # the rows and columns)
+    def _neighborhood_count(self, grid_bool):
+        arr = grid_bool.astype(np.int8)
+        rows = arr + np.roll(arr, 1, axis=-2) + np.roll(arr, -1, axis=-2)
+        return rows + np.roll(rows, 1, axis=-1) + np.roll(rows, -1, axis=-1)
+
+    def _cells(self, ids):
+        return self.population.y[ids] * self.width + self.population.x[ids]
+
+    # Flat cell indices of the 3x3 (wrapped) around flat cells, shape (len(cells), 9)
+    def _cell_neighborhoods(self, cells):
+        # Start of the grid the cell is in (there can be more than one, see `batched.py`)
+        start = cells - cells % (self.height * self.width)
+        xs = (cells % self.width)[:, None] + NEIGHBORHOOD_DX
+        ys = ((cells // self.width) % self.height)[:, None] + NEIGHBORHOOD_DY
+        return start[:, None] + (ys % self.height) * self.width + xs % self.width
+
+    # Infectious grid has to follow infectious people around and their mask status
+    def _refresh_infectious_grid(self):
+        self.infectious_grid.fill(NOT_INFECTIOUS)
+        pop = self.population
+        ids = np.flatnonzero(pop.has(ALIVE) & (pop.infection_stage[:pop.size] == INFECTIOUS))
+        self.infectious_grid_flat[self._cells(ids)] = np.where(pop.has(WEAR_MASK, ids), INFECTIOUS_MASK, INFECTIOUS_NO_MASK)
+
+    # Infection ------
+    # Progress the infection of the infected people of a phase in both infectiousness and symptoms (see
+    # `Person.progress_infection`)
+    def _progress_infection(self, ids):
+        pop = self.population
+        ids = ids[pop.has(ALIVE, ids) & pop.has(INFECTED, ids)]
+        # Count infectious days
+        infectious = ids[pop.infection_stage[ids] == INFECTIOUS]
+        SD, WM = pop.has(SOCIAL_DISTANCE, infectious), pop.has(WEAR_MASK, infectious)
+        pop.infectious_days[infectious, np.where(SD, DAYS_SD, DAYS_NOT_SD)] += 1
+        pop.infectious_days[infectious, np.where(WM, DAYS_WM, DAYS_NOT_WM)] += 1
+        pop.infection_step[ids] += 1
+        # New stages are fully decided by the infection step
+        new_infection_stage, new_symptom_stage = pop.stages_at(ids, pop.infection_step[ids])
+        changed_infection = new_infection_stage != pop.infection_stage[ids]
+        changed_symptom = new_symptom_stage != pop.symptom_stage[ids]
+        pop.infection_stage[ids] = new_infection_stage
+        pop.symptom_stage[ids] = new_symptom_stage
+        # Dead
+        self._kill_people(ids[new_symptom_stage == DEATH])
+        # If mild symptoms check altruistic to see what happens
+        mild = ids[changed_symptom & (new_symptom_stage == MILD)]
+        mild = mild[pop.has(ALTRUISTIC, mild)]
+        pop.movement[mild] = LOW_MOVEMENT
+        pop.set_flag(WEAR_MASK | SOCIAL_DISTANCE, mild)
+        # Severe means SD and WM and NO non-defensive movement
+        severe = ids[changed_symptom & (new_symptom_stage == SEVERE)]
+        pop.movement[severe] = NO_MOVEMENT
+        pop.set_flag(WEAR_MASK | SOCIAL_DISTANCE, severe)
+        # If not dead and end of infection then recovered
+        recovered = ids[changed_infection & (new_infection_stage == RECOVER) & (new_symptom_stage != DEATH)]
+        pop.set_flag(RECOVERED, recovered)
+        pop.set_flag(INFECTED | SUSCEPTIBLE, recovered, False)
+        pop.set_flag(WEAR_MASK, recovered, pop.has(WEAR_MASK_BEFORE_SYMPTOMS, recovered))
+        pop.set_flag(SOCIAL_DISTANCE, recovered, pop.has(SOCIAL_DISTANCE_BEFORE_SYMPTOMS, recovered))
+        pop.movement[recovered] = NORMAL_MOVEMENT
+        pop.symptom_stage[recovered] = NO_STAGE
+        days = pop.infectious_days[recovered]
+        self.data_collect.add_lifetime_infected_batch(pop.num_people_infected[recovered], days[:, DAYS_SD],
+                                                      days[:, DAYS_NOT_SD], days[:, DAYS_WM], days[:, DAYS_NOT_WM])
+
+    # A person can die from the disease
+    def _kill_people(self, ids):
+        self.population.kill(ids)
+        self.grid_flat[self._cells(ids)] = -1
+        self.data_collect.increment_death_data(len(ids))
+        if self.profiler is not None: self.profiler.count('deaths', len(ids))
+
+    # Check if people get infected given the infectious people in their immediate neighborhood
+    def _check_infection(self, ids):
+        pop = self.population
+        ids = ids[pop.has(SUSCEPTIBLE, ids)]
+        if len(ids) == 0:
+            return
+        neighbor_cells = self._neighbor_cells(ids)
+        codes = self.infectious_grid_flat[neighbor_cells]
+        r = (codes != NOT_INFECTIOUS).sum(axis=1)
+        exposed = r > 0
+        ids, neighbor_cells, codes, r = ids[exposed], neighbor_cells[exposed], codes[exposed], r[exposed]
+        if self.profiler is not None: self.profiler.count('infections_evaluated', len(ids))
+        I_prob = self._infection_prob(ids, r, (codes == INFECTIOUS_MASK).sum(axis=1))
+        newly_infected = self.rng.random(len(ids)) < I_prob
+        self._infect(ids[newly_infected])
+        # Add to the num of people infected to each infectious neighbor for calc. Ro
+        infectors = neighbor_cells[newly_infected][codes[newly_infected] != NOT_INFECTIOUS]
+        np.add.at(pop.num_people_infected, self.grid_flat[infectors], 1)
+
+    # Check if susceptible people get infected by their infectious contacts in the contact layers
+    def _check_layer_infection(self):
+        pop = self.population
+        alive = pop.has(ALIVE)
+        infectious = alive & (pop.infection_stage[:pop.size] == INFECTIOUS)
+        I_prob = self.contact_layers.infection_prob(infectious)
+        ids = np.flatnonzero(alive & pop.has(SUSCEPTIBLE) & (I_prob > 0))
+        if self.profiler is not None: self.profiler.count('infections_evaluated', len(ids))
+        ids = ids[self.rng.random(len(ids)) < I_prob[ids]]
+        self._infect(ids)
+        # Same for Ro: each infectious contact of a newly infected person
+        pop.num_people_infected[:pop.size] += (self.contact_layers.contacts_of(ids, pop.size) *
+                                               infectious).astype(pop.num_people_infected.dtype)
+
+    def _infect(self, ids):
+        pop = self.population
+        pop.set_flag(INFECTED, ids)
+        pop.set_flag(SUSCEPTIBLE, ids, False)
+        pop.infection_stage[ids] = LATENT
+        pop.symptom_stage[ids] = INCUBATION
+        pop.infection_step[ids] = 0
+        pop.assign_courses(ids)
+        self.data_collect.increment_total_infected(len(ids))
+
+    # Use Kermack-McKendrick Model of infection probability
+    # 1 - (1 - p) ^ r; p -> avg infection prob of one person; r -> number of infectious people (masks of them wear one)
+    def _infection_prob(self, ids, r, masks):
+        p = self.disease_C['base_infection_prob'] - (masks * self.disease_C['mask_infection_prob_decrease']) / r
+        return 1 - (1 - p) ** r
+
+    # Movement ------
+    def _move_people(self, ids, new_cells):
+        old_cells = self._cells(ids)
+        codes = self.infectious_grid_flat[old_cells]
+        self.grid_flat[old_cells] = -1
+        self.infectious_grid_flat[old_cells] = NOT_INFECTIOUS
+        self.grid_flat[new_cells] = ids
+        self.infectious_grid_flat[new_cells] = codes
+        self.population.x[ids] = new_cells % self.width
+        self.population.y[ids] = (new_cells // self.width) % self.height
+        return old_cells
+
+    # Only one person can win a cell, and for SD people no two winners can be within each others' neighborhood
+    def _resolve_conflicts(self, target_cells, social_distance):
+        priority = self.rng.random(len(target_cells))
+        best = np.full(self.grid.size, -1.)
+        np.maximum.at(best, target_cells, priority)
+        if not social_distance:
+            return priority == best[target_cells]
+        # Highest priority in the 3x3 around each target (only the targets, not the whole grid)
+        return priority == best[self._cell_neighborhoods(target_cells)].max(axis=1)
+
+    # Each person moves to a random empty (and for SD people: safe) neighbor, up to their move length times, and
+    # checks if they got infected after each step
+    def _movement(self, ids, social_distance):
+        if len(ids) == 0:
+            return
+        if social_distance:
+            # Move it if its own cell is not safe OR its moving intentionally
+            occupied_count = self._neighborhood_count(self.grid >= 0).reshape(-1)
+            unsafe = occupied_count[self._cells(ids)] > 1
+            moving = unsafe | (self.rng.random(len(ids)) < self.population.movement_prob(ids))
+            # Move only one time if just moving cuz its unsafe
+            move_length = np.where(unsafe, 1, self.person_C['move_length'])[moving]
+        else:
+            moving = self.rng.random(len(ids)) < self.population.movement_prob(ids)
+            move_length = np.full(moving.sum(), self.person_C['move_length'])
+        ids = ids[moving]
+        last_cells = np.full(len(ids), -1)
+        for m in range(self.person_C['move_length']):
+            active = move_length > m
+            ids, last_cells, move_length = ids[active], last_cells[active], move_length[active]
+            if len(ids) == 0:
+                break
+            if self.profiler is not None: self.profiler.count('moves_attempted', len(ids))
+            neighbor_cells = self._neighbor_cells(ids)
+            valid = (self.grid_flat[neighbor_cells] == -1) & (neighbor_cells != last_cells[:, None])
+            if self.obstacles is not None:
+                valid &= ~self.obstacles[neighbor_cells]
+            if self.zones is not None:
+                valid &= self.zones[neighbor_cells] == self.zones[self._cells(ids)][:, None]
+            if social_distance:
+                if self.profiler is not None: self.profiler.count('safe_cell_checks', np.count_nonzero(valid))
+                # Safe if the only person around the cell is the one moving
+                occupied_count = self._neighborhood_count(self.grid >= 0).reshape(-1)
+                valid &= occupied_count[neighbor_cells] == 1
+            # Pick a random valid neighbor, end if there is none
+            keys = np.where(valid, self.rng.random(valid.shape), -1.)
+            choice = keys.argmax(axis=1)
+            can_move = keys[np.arange(len(ids)), choice] >= 0
+            ids, last_cells, move_length = ids[can_move], last_cells[can_move], move_length[can_move]
+            targets = neighbor_cells[can_move, choice[can_move]]
+            won = self._resolve_conflicts(targets, social_distance)
+            last_cells[won] = self._move_people(ids[won], targets[won])
+            if self.profiler is not None: self.profiler.count('moves_succeeded', np.count_nonzero(won))
+            self._check_infection(ids[won])
+
+    def _update_phase(self, ids):
+        ids = ids[self.population.has(ALIVE, ids)]
+        self._refresh_infectious_grid()
+        self._check_infection(ids)
+        # Movement rules follow the current SD of each person (might have changed from symptoms)
+        SD = self.population.has(SOCIAL_DISTANCE, ids)
+        self._movement(ids[~SD], False)
+        self._movement(ids[SD], True)
+
+    def step(self):
+        # SD membership at the start of the step decides the phase of each person
+        ids = self.population.alive_ids()
+        SD = self.population.has(SOCIAL_DISTANCE, ids)
+        SD_ids, not_SD_ids = ids[SD], ids[~SD]
+        if self.contact_layers is not None: self._check_layer_infection()
+        # Update those who do NOT practice social distancing first, then those who do so they get to be at a safe dist.
+        # from others at the end of the iteration
+        # The infection of each person progresses in their own phase (like the object engine does at their turn), so
+        # infectiousness and symptoms of SD people change right before they move, not before the non SD people do
+        self._progress_infection(not_SD_ids)
+        self._update_phase(not_SD_ids)
+        self._progress_infection(SD_ids)
+        self._update_phase(SD_ids)
+        self.data_collect.update_population(self.population)
+
+    # profiler: optional `Profiler` (see `profiler.py`) to time the phases of every timestep
+    # frames: optional `FrameExporter` (see `frame_export.py`) that gets a frame after every step (no display needed)
+    def run(self, render=False, profiler=None, frames=None):
+        if profiler is not None: profiler.attach(self)
+        # Detached even if the run fails, o.w. the profiler's wrappers stay on the simulation and its data collector
+        try:
+            # Rendering (and pygame) is only loaded if needed
+            if render:
+                from render import Renderer
+                renderer = Renderer(self.render_C, self.width, self.height)
+                if profiler is not None: renderer.draw = profiler.wrap('render', renderer.draw)
+            if frames is not None and profiler is not None: frames.draw = profiler.wrap('render', frames.draw)
+            while self.timestep < self.grid_C['number_iterations']:
+                self.advance(1)
+                if render: renderer.draw(self.population)
+                if frames is not None: frames.draw(self.population)
+            self.data_collect.reset(self.timestep, last=True)
+            if frames is not None: frames.close()
+        finally:
+            if profiler is not None: profiler.detach()
+
+    # Run some timesteps without finishing the run (eg. a warm-up to checkpoint, see `checkpoint.py`)
+    def advance(self, num_timesteps):
+        for t in range(self.timestep, self.timestep + num_timesteps):
+            self.data_collect.reset(t)
+            self.step()
+            self.timestep = t + 1